@@ -0,0 +1,75 @@
+import datetime
+import threading
+from collections import namedtuple
+
+# Versión de los datos en uso: el DataFrame, el hash del archivo y cuándo se cargó
+Dataset = namedtuple("Dataset", ["df", "version", "cargado_en"])
+
+
+class ActualizadorDatos:
+    # Mantiene el último dataset válido y lo refresca cada `intervalo` segundos en un hilo aparte.
+    # Mientras se descarga y valida la versión nueva se siguen sirviendo los datos anteriores.
+
+    def __init__(self, cargar, intervalo=1800, invalidar=None):
+        self._cargar = cargar
+        # Borra lo guardado en disco (snapshots, almacén por mes) para forzar una recarga completa
+        self._invalidar = invalidar
+        self._recarga_completa = False
+        self.intervalo = intervalo
+        self.dataset = None
+        self.estado = "sin datos"
+        self.error = None
+        self.verificado_en = None
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._bucle, name="actualizador-datos", daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            try:
+                self.cargar_ahora()
+            except Exception:
+                # El error queda en self.error y se sigue sirviendo la versión anterior
+                pass
+
+    def refrescar_ahora(self):
+        # Pide al hilo un refresco inmediato sin bloquear la sesión que lo pidió
+        self._despertar.set()
+
+    def recargar_completo(self):
+        # Como refrescar_ahora, pero el hilo borra lo guardado antes de cargar. La invalidación se
+        # hace dentro del lock para no pisar una carga que está escribiendo el almacén
+        self._recarga_completa = True
+        self._despertar.set()
+
+    def cargar_ahora(self, solo_si_vacio=False):
+        # Un solo refresco a la vez. Con solo_si_vacio, si otra sesión ya cargó los datos
+        # mientras se esperaba el lock, se devuelven esos sin volver a descargar
+        with self._lock:
+            if solo_si_vacio and self.dataset is not None:
+                return self.dataset
+            self.estado = "actualizando"
+            if self._recarga_completa:
+                self._recarga_completa = False
+                if self._invalidar is not None:
+                    self._invalidar()
+            try:
+                df, version = self._cargar()
+            except Exception as e:
+                self.estado = "error"
+                self.error = str(e)
+                raise
+            self.verificado_en = datetime.datetime.now()
+            if self.dataset is None or self.dataset.version != version:
+                # Asignación de una sola referencia: cada lectura ve la versión vieja o la nueva completa
+                self.dataset = Dataset(df, version, self.verificado_en)
+            self.estado = "al día"
+            self.error = None
+            return self.dataset
@@ -0,0 +1,438 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from preparacion import (
+    COL_COSTO, COL_STOCK, COL_VENTA, DatasetPreparado, clave_de_periodo, filas_mes, periodo_de_clave,
+    rangos_contiguos,
+)
+
+# Resultado de sumas_con_totales: detalle por todas las dimensiones, subtotales por la primera
+# y total general (Series con índice (período, medida))
+SumasConTotales = namedtuple("SumasConTotales", ["detalle", "subtotales", "total"])
+
+# Agrupaciones del gráfico de dispersión (margen vs utilidad)
+AGRUPADORES_DISPERSION = ["SUBSECTOR", "SECTOR", "MARCA", "LOCAL"]
+
+# Resultado de comparar: tabla por las dimensiones pedidas, la misma tabla por la primera dimensión
+# (subtotales) y dict con los mismos valores para el total
+Comparacion = namedtuple("Comparacion", ["detalle", "subtotales", "total"])
+
+# Sumas acumuladas por grupo sobre la serie mensual: series[medida] tiene n_meses + 1 columnas,
+# la primera en 0, y la columna i es la suma de los i meses desde mes_inicial
+Acumulados = namedtuple("Acumulados", ["claves", "mes_inicial", "n_meses", "series"])
+
+# Agrupador de las tablas de variación (Comparativos y Comparativo por Tipo de Variación)
+AGRUPADOR_VARIACION = ["LOCAL", "SECTOR", "SUBSECTOR", "MARCA"]
+
+# Grano del cubo mensual y medidas que guarda (columna de origen, agregación).
+# El margen de la fuente ("%:") no es aditivo: se guarda su suma y su cantidad para poder sacar el promedio.
+# FECHA_MIN / FECHA_MAX dicen si un mes se puede tomar entero para un rango de fechas
+DIMENSIONES_CUBO = ["MES_KEY", "JEFE_AREA", "LOCAL", "SECTOR", "SUBSECTOR", "MARCA"]
+MEDIDAS_CUBO = {
+    COL_VENTA: (COL_VENTA, "sum"),
+    COL_COSTO: (COL_COSTO, "sum"),
+    COL_STOCK: (COL_STOCK, "sum"),
+    "Valor de Compras:": ("Valor de Compras:", "sum"),
+    "Valor:": ("Valor:", "sum"),
+    "MARGEN_SUMA": ("%:", "sum"),
+    "MARGEN_N": ("%:", "count"),
+    "FILAS": ("MES_KEY", "size"),
+    "FECHA_MIN": ("FECHA", "min"),
+    "FECHA_MAX": ("FECHA", "max"),
+}
+# Cómo se combinan las medidas al subir de nivel (lo que no está acá se suma)
+ROLLUP_CUBO = {"FECHA_MIN": "min", "FECHA_MAX": "max"}
+
+
+def indexar_por_mes(df):
+    # Ordena un df que ya tiene MES_KEY y JEFE_AREA para que cada mes y cada (jefe, mes)
+    # ocupen filas contiguas, y arma los rangos. El orden original se mantiene dentro de cada bloque
+    jefes = df["JEFE_AREA"].astype("category")
+    df = df.assign(_JEFE_COD=jefes.cat.codes.to_numpy())
+    df = df.sort_values(["MES_KEY", "_JEFE_COD"], kind="stable").reset_index(drop=True)
+
+    claves_mes = df["MES_KEY"].to_numpy()
+    codigos = df["_JEFE_COD"].to_numpy().astype("int64")
+    rangos_mes = rangos_contiguos(claves_mes)
+
+    # Clave compuesta mes * (n jefes + 1) + código, ya ordenada por cómo se ordenó el df
+    n_jefes = len(jefes.cat.categories)
+    compuestas = claves_mes.astype("int64") * (n_jefes + 1) + (codigos + 1)
+    rangos_jefe_mes = {}
+    for compuesta, rango in rangos_contiguos(compuestas).items():
+        mes, codigo = divmod(compuesta, n_jefes + 1)
+        if codigo == 0:
+            continue  # filas sin JEFE_AREA
+        rangos_jefe_mes[(jefes.cat.categories[codigo - 1], mes)] = rango
+
+    df = df.drop(columns="_JEFE_COD")
+    return DatasetPreparado(df, rangos_mes, rangos_jefe_mes)
+
+
+def _agregar_cubo(df):
+    # dropna=False para no perder filas con alguna dimensión vacía al agregar por menos dimensiones
+    medidas = {nombre: spec for nombre, spec in MEDIDAS_CUBO.items() if spec[0] in df.columns}
+    return df.groupby(DIMENSIONES_CUBO, observed=True, dropna=False, sort=True).agg(**medidas).reset_index()
+
+
+def construir_cubo(preparado):
+    # Cubo materializado una vez por versión: totales por mes × jefe × local × sector × subsector × marca.
+    # Se indexa igual que el dataset preparado, así un mes o un (jefe, mes) es un slice del cubo
+    return indexar_por_mes(_agregar_cubo(preparado.df))
+
+
+def construir_cubo_por_meses(preparados):
+    # El mismo cubo a partir de un DatasetPreparado por mes (backend particionado): cada mes se
+    # agrega y se descarta antes de leer el siguiente, así nunca está todo el dataset en memoria.
+    # Los meses no se mezclan entre partes, por eso concatenar los agregados da el cubo completo
+    return indexar_por_mes(pd.concat([_agregar_cubo(parte.df) for parte in preparados], ignore_index=True))
+
+
+def consultar(cubo, dims, meses=None, jefe=None):
+    # Roll-up del cubo a las dimensiones pedidas (lista vacía = total), para los meses y el jefe dados
+    if meses is None:
+        filas = cubo.df if jefe is None else cubo.df[cubo.df["JEFE_AREA"] == jefe]
+    else:
+        partes = [filas_mes(cubo, mes, jefe) for mes in meses]
+        filas = pd.concat(partes) if len(partes) > 1 else (partes[0] if partes else cubo.df.iloc[0:0])
+    rollup = {
+        col: ROLLUP_CUBO.get(col, "sum") for col in cubo.df.columns if col not in DIMENSIONES_CUBO
+    }
+    if not dims:
+        return filas.agg(rollup).to_frame().T
+    return filas.groupby(dims, observed=True).agg(rollup)
+
+
+def meses_de_rango(cubo, inicio, fin):
+    # Meses que caen enteros dentro de [inicio, fin]. Si algún mes queda cortado por el rango
+    # el cubo no alcanza y se devuelve None para que se usen las filas
+    fechas = cubo.df.groupby("MES_KEY").agg(desde=("FECHA_MIN", "min"), hasta=("FECHA_MAX", "max"))
+    fechas = fechas[fechas.index >= 0]
+    adentro = (fechas["desde"] >= inicio) & (fechas["hasta"] <= fin)
+    afuera = (fechas["hasta"] < inicio) | (fechas["desde"] > fin)
+    if not (adentro | afuera).all():
+        return None
+    return [periodo_de_clave(clave) for clave in fechas.index[adentro]]
+
+
+def sumas_alineadas(periodos, dims, medidas=(COL_VENTA, COL_COSTO), dropna=True):
+    # Un solo groupby por período y todos alineados sobre el mismo índice de claves.
+    # Columnas: (período, medida). Las claves que no existen en un período quedan en NaN
+    partes = {
+        nombre: datos.groupby(dims, observed=True, dropna=dropna)[list(medidas)].sum()
+        for nombre, datos in periodos.items()
+    }
+    alineado = pd.concat(partes, axis=1, join="outer").sort_index()
+    return alineado
+
+
+def sumas_con_totales(periodos, dims, medidas=(COL_VENTA, COL_COSTO)):
+    # Como GROUPING SETS ((dims), (dims[0]), ()): un groupby por período al nivel de detalle y los
+    # subtotales por la primera dimensión y el total general salen de sumar esos grupos, sin volver
+    # a recorrer las filas. Las claves vacías no se muestran en el detalle pero sí cuentan en los totales
+    alineado = sumas_alineadas(periodos, dims, medidas, dropna=False).fillna(0)
+    return _con_totales(alineado)
+
+
+def _con_totales(alineado):
+    # Detalle (sin claves vacías), subtotales por la primera dimensión y total de un df ya agregado
+    claves = alineado.index.to_frame(index=False)
+    detalle = alineado[claves.notna().all(axis=1).to_numpy()]
+    subtotales = alineado.groupby(level=0, observed=True).sum()
+    return SumasConTotales(detalle, subtotales, alineado.sum())
+
+
+def con_fila_total(tabla, dims, etiqueta, valores):
+    # Agrega al final la fila de totales: la etiqueta en la primera dimensión y el resto en blanco
+    fila = {dims[0]: [etiqueta], **{dim: [""] for dim in dims[1:]}}
+    fila.update({columna: [valor] for columna, valor in valores.items()})
+    return pd.concat([tabla, pd.DataFrame(fila)], ignore_index=True)
+
+
+def _margen(ventas, costo):
+    # Igual que (ventas - costo) / ventas seguido de fillna(0): 0/0 queda en 0, x/0 queda en ±inf
+    with np.errstate(divide="ignore", invalid="ignore"):
+        margen = (ventas - costo) / ventas
+    return margen.fillna(0)
+
+
+def margen_de(sumas):
+    # Margen por grupo a partir de las sumas de ventas y costo de un período
+    return _margen(sumas[COL_VENTA], sumas[COL_COSTO])
+
+
+def margen_global(total):
+    # Margen de un total (Series con ventas y costo); sin ventas queda en 0
+    ventas, costo = total[COL_VENTA], total[COL_COSTO]
+    return (ventas - costo) / ventas if ventas != 0 else 0
+
+
+def utilidad_de(sumas):
+    return sumas[COL_VENTA] - sumas[COL_COSTO]
+
+
+def _variacion(actual, anterior):
+    return (actual - anterior) / anterior.replace(0, pd.NA)
+
+
+def comparar(cubo, metrica, dims, periodo_a, periodo_b, jefe=None):
+    # Comparación genérica de una métrica ("ventas", "margen" o "utilidad") entre dos meses por las
+    # dimensiones dadas, leída del cubo. Detalle con las columnas actual, comparado, variacion_% y
+    # diferencia (en el margen la variación es la diferencia en puntos) y la misma cuenta para el total
+    sumas = sumas_con_totales(
+        {"a": filas_mes(cubo, periodo_a, jefe), "b": filas_mes(cubo, periodo_b, jefe)}, list(dims)
+    )
+    return _comparacion(sumas, metrica)
+
+
+def _tabla_comparacion(sumas_a, sumas_b, metrica):
+    # actual, comparado, variacion_% y diferencia por grupo a partir de las sumas de los dos períodos
+    if metrica == "margen":
+        actual, comparado = margen_de(sumas_a), margen_de(sumas_b)
+        variacion = actual - comparado
+    else:
+        valor = utilidad_de if metrica == "utilidad" else (lambda sumas_periodo: sumas_periodo[COL_VENTA])
+        actual, comparado = valor(sumas_a), valor(sumas_b)
+        variacion = _variacion(actual, comparado)
+    return pd.DataFrame({
+        "actual": actual,
+        "comparado": comparado,
+        "variacion_%": variacion,
+        "diferencia": actual - comparado,
+    }).reset_index()
+
+
+def _comparacion(sumas, metrica):
+    # Cuentas de comparar sobre las sumas de ventas y costo de dos períodos ("a" y "b"): las del
+    # detalle y los subtotales por grupo, y las del total general
+    detalle = _tabla_comparacion(sumas.detalle["a"], sumas.detalle["b"], metrica)
+    subtotales = _tabla_comparacion(sumas.subtotales["a"], sumas.subtotales["b"], metrica)
+    if metrica == "margen":
+        total_a, total_b = margen_global(sumas.total["a"]), margen_global(sumas.total["b"])
+        variacion_total = total_a - total_b
+    else:
+        valor = utilidad_de if metrica == "utilidad" else (lambda sumas_periodo: sumas_periodo[COL_VENTA])
+        total_a, total_b = valor(sumas.total["a"]), valor(sumas.total["b"])
+        variacion_total = (total_a - total_b) / total_b if total_b != 0 else 0
+    total = {
+        "actual": total_a,
+        "comparado": total_b,
+        "variacion_%": variacion_total,
+        "diferencia": total_a - total_b,
+    }
+    return Comparacion(detalle, subtotales, total)
+
+
+def acumulados_mensuales(cubo, dims, jefe=None, medidas=(COL_VENTA, COL_COSTO, "FILAS")):
+    # Serie mensual de cada grupo (todos los meses seguidos, con 0 donde no hubo filas) como sumas
+    # acumuladas: la suma de cualquier ventana de meses es una resta por grupo, sin volver a las filas
+    filas = cubo.df if jefe is None else cubo.df[cubo.df["JEFE_AREA"] == jefe]
+    agrupado = filas.groupby(list(dims), observed=True, dropna=False, sort=True)
+    claves = agrupado.size().index
+    codigos = agrupado.ngroup().to_numpy()
+    meses = filas["MES_KEY"].to_numpy()
+    validos = meses >= 0
+    mes_inicial = int(meses[validos].min()) if validos.any() else 0
+    n_meses = int(meses[validos].max()) - mes_inicial + 1 if validos.any() else 0
+
+    acumulados = {}
+    for medida in medidas:
+        serie = np.zeros((len(claves), n_meses))
+        np.add.at(serie, (codigos[validos], meses[validos] - mes_inicial), filas[medida].to_numpy()[validos])
+        acumulados[medida] = np.concatenate(
+            [np.zeros((len(claves), 1)), serie.cumsum(axis=1)], axis=1
+        )
+    return Acumulados(claves, mes_inicial, n_meses, acumulados)
+
+
+def suma_ventana(acumulados, medida, desde, hasta):
+    # Suma por grupo de los meses [desde, hasta] (claves de mes); lo que queda fuera de la serie vale 0
+    inicio = min(max(desde - acumulados.mes_inicial, 0), acumulados.n_meses)
+    fin = min(max(hasta - acumulados.mes_inicial + 1, 0), acumulados.n_meses)
+    serie = acumulados.series[medida]
+    return serie[:, fin] - serie[:, inicio]
+
+
+def ventana_de(periodo, ventana):
+    # Meses (desde, hasta) de la ventana que termina en periodo: "ytd" desde enero, "t12m" los últimos 12
+    hasta = clave_de_periodo(periodo)
+    desde = periodo.year * 12 if ventana == "ytd" else hasta - 11
+    return desde, hasta
+
+
+def comparar_ventana(acumulados, metrica, periodo, ventana):
+    # Como comparar, pero para la ventana (YTD o últimos 12 meses) contra la misma ventana un año antes.
+    # Cuesta O(grupos): dos restas de acumulados por medida
+    desde, hasta = ventana_de(periodo, ventana)
+    partes = {
+        nombre: pd.DataFrame(
+            {medida: suma_ventana(acumulados, medida, desde - corrimiento, hasta - corrimiento)
+             for medida in acumulados.series},
+            index=acumulados.claves,
+        )
+        for nombre, corrimiento in (("a", 0), ("b", 12))
+    }
+    alineado = pd.concat(partes, axis=1)
+    # Solo los grupos con filas en alguna de las dos ventanas
+    alineado = alineado[(alineado[("a", "FILAS")] + alineado[("b", "FILAS")]).to_numpy() > 0]
+    return _comparacion(_con_totales(alineado), metrica)
+
+
+def panel_mensual(cubo, dims, jefe=None, desplazamientos=(1, 12), medidas=(COL_VENTA, COL_COSTO, "FILAS")):
+    # Panel de todos los meses a la vez: para cada (mes, grupo) las sumas del mes (columna 0) y las
+    # del mes corrido 1 y 12 hacia atrás, como un shift sobre la serie mensual de cada grupo.
+    # Columnas (desplazamiento, medida); cambiar de mes es tomar las filas de ese mes
+    filas = cubo.df if jefe is None else cubo.df[cubo.df["JEFE_AREA"] == jefe]
+    filas = filas[filas["MES_KEY"] >= 0]
+    sumas = filas.groupby([*dims, "MES_KEY"], observed=True, dropna=False)[list(medidas)].sum()
+    if filas.empty:
+        return pd.DataFrame(
+            columns=pd.MultiIndex.from_product([(0, *desplazamientos), list(medidas)]),
+            index=pd.MultiIndex.from_arrays([[]] * (len(dims) + 1), names=["MES_KEY", *dims]),
+            dtype="float64",
+        )
+    meses = np.arange(filas["MES_KEY"].min(), filas["MES_KEY"].max() + 1)
+    # Una columna por (medida, mes), con todos los meses seguidos y 0 donde el grupo no tuvo filas
+    ancho = sumas.unstack("MES_KEY", fill_value=0).reindex(
+        columns=pd.MultiIndex.from_product([list(medidas), meses]), fill_value=0
+    )
+    claves = ancho.index
+
+    datos = {}
+    for medida in medidas:
+        valores = ancho[medida].to_numpy(dtype="float64")
+        for desplazamiento in (0, *desplazamientos):
+            corrido = np.zeros_like(valores)
+            if desplazamiento < len(meses):
+                corrido[:, desplazamiento:] = valores[:, :len(meses) - desplazamiento]
+            # Filas en orden (mes, grupo)
+            datos[(desplazamiento, medida)] = corrido.T.ravel()
+
+    posiciones = np.tile(np.arange(len(claves)), len(meses))
+    indice = pd.MultiIndex.from_arrays(
+        [np.repeat(meses, len(claves)), *(claves.get_level_values(i).take(posiciones) for i in range(claves.nlevels))],
+        names=["MES_KEY", *dims],
+    )
+    panel = pd.DataFrame(datos, index=indice)
+    # Solo los (mes, grupo) con filas en el mes o en alguno de los meses con que se compara
+    con_filas = sum(panel[(desplazamiento, "FILAS")] for desplazamiento in (0, *desplazamientos))
+    return panel[con_filas.to_numpy() > 0]
+
+
+def comparar_en_panel(panel, metrica, periodo, desplazamiento):
+    # Como comparar(periodo, periodo - desplazamiento) pero leyendo el mes del panel, sin agrupar filas
+    clave = clave_de_periodo(periodo)
+    if clave in panel.index.get_level_values(0):
+        mes = panel.xs(clave, level="MES_KEY")
+    else:
+        mes = panel.iloc[0:0].droplevel("MES_KEY")
+    mes = mes[(mes[(0, "FILAS")] + mes[(desplazamiento, "FILAS")]).to_numpy() > 0]
+    alineado = pd.concat({"a": mes[0], "b": mes[desplazamiento]}, axis=1)
+    return _comparacion(_con_totales(alineado), metrica)
+
+
+def _tabla_dispersion(parte, agrupador):
+    tabla = parte.reset_index()[[agrupador, COL_VENTA, COL_COSTO]]
+    tabla[agrupador] = tabla[agrupador].astype(str)
+    tabla["UTILIDAD"] = tabla[COL_VENTA] - tabla[COL_COSTO]
+    tabla["MARGEN_%"] = tabla["UTILIDAD"] / tabla[COL_VENTA].replace(0, pd.NA)
+    return tabla
+
+
+def datos_dispersion(filas, agrupadores=AGRUPADORES_DISPERSION):
+    # Ventas, costo, utilidad y margen del mes por cada agrupación y cada combinación de filtro
+    # de local y sector (None = todos), con clave (agrupador, local, sector). Sale de una agregación
+    # por agrupación a (LOCAL, SECTOR, agrupador) y sus roll-ups; elegir en los filtros es buscar la clave
+    medidas = [COL_VENTA, COL_COSTO]
+    datos = {}
+    for agrupador in agrupadores:
+        dims = list(dict.fromkeys(["LOCAL", "SECTOR", agrupador]))
+        # dropna=False: las filas sin LOCAL o SECTOR cuentan en las vistas que no filtran por ese campo
+        base = filas[filas[agrupador].notna()].groupby(dims, observed=True, dropna=False)[medidas].sum()
+        for filtros in (["LOCAL", "SECTOR"], ["LOCAL"], ["SECTOR"], []):
+            niveles = list(dict.fromkeys([*filtros, agrupador]))
+            nivel = base.groupby(level=niveles, observed=True, dropna=False).sum() if niveles != dims else base
+            if not filtros:
+                datos[(agrupador, None, None)] = _tabla_dispersion(nivel, agrupador)
+                continue
+            for clave, parte in nivel.groupby(level=filtros, observed=True):
+                valores = dict(zip(filtros, clave))
+                datos[(agrupador, valores.get("LOCAL"), valores.get("SECTOR"))] = _tabla_dispersion(parte, agrupador)
+    return datos
+
+
+def _codigos(serie):
+    # Códigos enteros (-1 = vacío) y niveles ordenados; las categóricas ya los traen
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.codes.to_numpy().astype("int64"), np.asarray(serie.cat.categories)
+    codigo, nivel = pd.factorize(serie, sort=True)
+    return codigo, np.asarray(nivel)
+
+
+def pivotear(filas, indice, columna, valor, agregacion="sum"):
+    # Igual que pd.pivot_table(filas, index=indice, columns=columna, values=valor, aggfunc=agregacion,
+    # observed=True) para "sum" y "mean", pero con códigos enteros y np.bincount sobre la grilla
+    # filas × columnas. Las etiquetas quedan como valores simples (no categóricos)
+    codigos, niveles = zip(*(_codigos(filas[dim]) for dim in [*indice, columna]))
+    valores = filas[valor].to_numpy(dtype="float64", na_value=np.nan)
+    # Como en pivot_table, las filas con alguna dimensión vacía no cuentan
+    validos = np.logical_and.reduce([codigo >= 0 for codigo in codigos])
+    if not validos.all():
+        codigos = [codigo[validos] for codigo in codigos]
+        valores = valores[validos]
+
+    forma = [len(nivel) for nivel in niveles[:-1]]
+    clave_fila = np.ravel_multi_index(codigos[:-1], forma)
+    # Filas de la tabla = combinaciones presentes, numeradas en orden. Si la grilla de combinaciones
+    # posibles no es mucho más grande que los datos se marca con bincount; si no, np.unique
+    if np.prod(forma, dtype="float64") <= 4 * len(clave_fila) + 1024:
+        presentes = np.bincount(clave_fila, minlength=int(np.prod(forma))) > 0
+        claves_fila = np.flatnonzero(presentes)
+        fila = (np.cumsum(presentes) - 1)[clave_fila]
+    else:
+        claves_fila, fila = np.unique(clave_fila, return_inverse=True)
+    n_columnas = len(niveles[-1])
+    celda = fila * n_columnas + codigos[-1]
+    n_celdas = len(claves_fila) * n_columnas
+
+    con_valor = ~np.isnan(valores)
+    suma = np.bincount(celda[con_valor], weights=valores[con_valor], minlength=n_celdas)
+    if agregacion == "mean":
+        cantidad = np.bincount(celda[con_valor], minlength=n_celdas)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            matriz = np.where(cantidad > 0, suma / cantidad, np.nan)
+    else:
+        # Las celdas sin filas quedan vacías; las que tienen filas suman aunque sean NaN (da 0)
+        matriz = np.where(np.bincount(celda, minlength=n_celdas) > 0, suma, np.nan)
+    matriz = matriz.reshape(len(claves_fila), n_columnas)
+
+    codigos_fila = np.unravel_index(claves_fila, forma)
+    tabla = pd.DataFrame(
+        matriz,
+        index=pd.MultiIndex.from_arrays(
+            [nivel[codigo] for nivel, codigo in zip(niveles, codigos_fila)], names=list(indice)
+        ),
+        columns=pd.Index(niveles[-1], name=columna),
+    )
+    # Como pivot_table (dropna=True): sin filas ni columnas completamente vacías
+    return tabla.dropna(how="all").dropna(axis=1, how="all")
+
+
+def medir_pivot(filas, indice, columna, valor, agregacion="sum"):
+    # Tiempo de pivotear contra pd.pivot_table sobre las mismas filas, y si dan lo mismo
+    inicio = time.perf_counter()
+    rapido = pivotear(filas, indice, columna, valor, agregacion)
+    tiempo_rapido = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    original = pd.pivot_table(
+        filas, index=indice, columns=columna, values=valor, aggfunc=agregacion, observed=True
+    )
+    tiempo_original = time.perf_counter() - inicio
+    iguales = (
+        rapido.shape == original.shape
+        and np.allclose(rapido.to_numpy(), original.to_numpy(dtype="float64"), equal_nan=True)
+    )
+    return tiempo_rapido, tiempo_original, iguales
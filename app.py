@@ -5,13 +5,30 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
-import io
-import plotly.graph_objects as go
 import datetime
 import requests
-import tempfile
 from comparativos_variacion import mostrar_comparativos_variacion
+from carga_datos import (
+    cargar_dataset, invalidar_snapshot, invalidar_almacen_mensual, leer_particiones, meses_particionados,
+    obtener_ultima_ingesta
+)
+from actualizacion import ActualizadorDatos
+from agregaciones import (
+    AGRUPADOR_VARIACION, acumulados_mensuales, comparar, comparar_en_panel, construir_cubo, construir_cubo_por_meses,
+    consultar, datos_dispersion, medir_pivot, meses_de_rango, panel_mensual, pivotear, ventana_de
+)
+from exportacion import FORMATOS_EXPORTACION, CacheExportaciones, GeneradorInformes, exportar, huella_tabla
+from graficos import GRAFICOS
+from formatos import (
+    formatear_guaranies, formatear_porcentaje, formatear_columna_guaranies, formatear_columna_numero,
+    formatear_columna_numeroint, formatear_columna_porcentaje, medir_formatos
+)
+from informe import (
+    COLUMNAS_QUIEBRE, COLUMNAS_SOBRE_STOCK, GRUPO_COMPARATIVOS, TABLAS_COMPARATIVOS, TABLAS_VARIACION,
+    filtrar_quiebre_total, filtrar_sobre_stock, margen_maximo, margen_por_subsector, pasos_informe, tabla_acumulada,
+    tabla_de_comparacion, tabla_de_subtotales
+)
+from preparacion import COLUMNAS_INTERNAS, preparar_dataset, particionar_por_jefe, particion_vacia, filas_mes, filas_rango, meses_disponibles, periodo_de_clave
 
 st.set_page_config(page_title="Informe por Jefe", layout="wide")
 
@@ -38,46 +55,26 @@ if not st.session_state.logueado:
             st.error(" Usuario o contraseña incorrectos")
     st.stop()
 
-# Función para exportar DataFrame a Excel en memoria
-def generar_excel(df, nombre_hoja="Resumen"):
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=True, sheet_name=nombre_hoja)
-    output.seek(0)
-    return output
-
-def formatear_guaranies(valor):
-    try:
-        if pd.isna(valor):
-            return ""
-        return f"₲ {valor:,.0f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except:
-        return valor
-
-def formatear_numero(valor):
-    try:
-        if pd.isna(valor):
-            return ""
-        return f"{valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except:
-        return ""
-    
-def formatear_porcentaje(valor):
-    valor = valor * 100
-    try:
-        if pd.isna(valor):
-            return ""
-        return f"{valor:.2f}%".replace(".", ",")
-    except:
-        return valor
-
-def formatear_numeroint(valor):
-    try:
-        if pd.isna(valor):
-            return ""
-        return f"{valor:,.0f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except:
-        return valor
+# Archivos exportados compartidos por todas las sesiones, limitados por tamaño total
+@st.cache_resource
+def obtener_cache_exportaciones():
+    config = st.secrets.get("exportacion", {})
+    return CacheExportaciones(config.get("cache_mb", 64) * 1024 * 1024)
+
+def boton_descarga(label, df, nombre_hoja, nombre_archivo, tipo_valores=None):
+    # Descarga en el formato elegido en la barra lateral. El archivo se arma recién cuando se hace
+    # clic (en otro hilo), no en cada rerun, y si otra descarga ya generó la misma tabla se
+    # reutiliza. La copia sin datos (copy-on-write) protege de cambios posteriores al df
+    formato = st.session_state.get("formato_descarga", "xlsx")
+    extension, mime = FORMATOS_EXPORTACION[formato]
+    df = df.copy(deep=False)
+    cache = obtener_cache_exportaciones()
+    st.download_button(
+        label=label,
+        data=lambda: exportar(cache, df, nombre_hoja, formato, tipo_valores),
+        file_name=f"{nombre_archivo}.{extension}",
+        mime=mime
+    )
 
 def estilo_delta(valor):
     flecha = "⬆️" if valor >= 0 else "⬇️"
@@ -110,44 +107,201 @@ with st.sidebar:
         "📅 Quiebres, Sobre stock y Margen <10%",
         "📊 Comparativo por Tipo de Variación"
     ])    
+    # Excel para el uso diario; CSV y Parquet para exportaciones grandes (se generan mucho más rápido)
+    st.radio(
+        "Formato de descarga:", list(FORMATOS_EXPORTACION),
+        format_func={"xlsx": "Excel (.xlsx)", "csv": "CSV (;)", "parquet": "Parquet"}.get,
+        key="formato_descarga", horizontal=True
+    )
 
 # Cargar los datos
-@st.cache_data
-def cargar_datos_desde_dropbox():
-    # url = st.secrets["urls"]["dropbox"]
-    #usar documento excel como url
+# El actualizador es compartido por todas las sesiones y refresca el archivo en segundo plano
+@st.cache_resource
+def obtener_actualizador():
     url = st.secrets["urls"]["dropbox"]
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        st.error(" No se pudo descargar el archivo desde Dropbox")
-        st.stop()
+    config = st.secrets.get("actualizacion", {})
+    minutos = config.get("intervalo_minutos", 30)
+    # "incremental" solo vuelve a convertir los meses nuevos o modificados del Excel
+    modo = config.get("modo_ingesta", "incremental")
+    particionado = config.get("backend", "memoria") == "particionado"
+
+    def invalidar_guardados():
+        invalidar_snapshot()
+        invalidar_almacen_mensual()
+
+    actualizador = ActualizadorDatos(
+        lambda: cargar_dataset(url, modo, particionado),
+        intervalo=minutos * 60,
+        invalidar=invalidar_guardados,
+    )
+    actualizador.iniciar()
+    return actualizador
 
-    # Guardar en archivo temporal
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-        tmp.write(response.content)
-        tmp_path = tmp.name
+def cargar_datos_desde_dropbox():
+    actualizador = obtener_actualizador()
+    dataset = actualizador.dataset
+    if dataset is None:
+        # Solo la primera carga bloquea; después se sirve la última versión válida
+        try:
+            with st.spinner("Cargando datos..."):
+                dataset = actualizador.cargar_ahora(solo_si_vacio=True)
+        except requests.RequestException:
+            st.error(" No se pudo descargar el archivo desde Dropbox")
+            st.stop()
+        except ValueError as e:
+            st.error(f" El archivo descargado no es válido: {e}")
+            st.stop()
+    return dataset
 
-    df = pd.read_excel(tmp_path, engine="openpyxl")
-    return df
+actualizador = obtener_actualizador()
 
-df = cargar_datos_desde_dropbox()
+if st.session_state.usuario == "admin":
+    with st.sidebar:
+        if st.button("🔄 Recargar datos desde Dropbox"):
+            actualizador.recargar_completo()
 
-#filtrar de df para sacar o evitas los que tienen cero en vtas y stock
-df = df[(df["Valor de Vtas:"].fillna(0) != 0) | (df["Valor de Stock:"].fillna(0) != 0)]
+dataset = cargar_datos_desde_dropbox()
+df = dataset.df
+
+with st.sidebar:
+    st.caption(f"📅 Datos del {dataset.cargado_en:%d/%m/%Y %H:%M} · estado: {actualizador.estado}")
+    if actualizador.verificado_en and actualizador.verificado_en != dataset.cargado_en:
+        st.caption(f"Última verificación: {actualizador.verificado_en:%d/%m/%Y %H:%M}")
+    if actualizador.error:
+        st.caption(f"⚠️ Último refresco falló, se muestran los datos anteriores: {actualizador.error}")
+
+# Rendimiento de la última lectura del Excel (o del snapshot, si no hubo que parsearlo)
+ingesta = obtener_ultima_ingesta()
+if st.session_state.usuario == "admin" and ingesta:
+    with st.sidebar:
+        st.caption(
+            f"Última ingesta: {ingesta.get('filas', 0):,} filas en {ingesta.get('segundos', 0):.1f} s "
+            f"({ingesta.get('filas_por_seg', 0):,.0f} filas/seg)"
+        )
+        if ingesta.get("meses_reingestados") is not None:
+            st.caption(
+                f"Meses reprocesados: {ingesta['meses_reingestados']} de {ingesta.get('meses_totales', 0)}"
+            )
+        if ingesta.get("memoria_antes") is not None:
+            st.caption(
+                f"Memoria del DataFrame: {ingesta['memoria_antes'] / 1e6:,.1f} MB → "
+                f"{ingesta.get('memoria_despues', 0) / 1e6:,.1f} MB"
+            )
+        elif ingesta.get("memoria_despues") is not None:
+            st.caption(f"Memoria del DataFrame: {ingesta['memoria_despues'] / 1e6:,.1f} MB")
+
+if st.session_state.usuario == "admin":
+    exportaciones = obtener_cache_exportaciones().estadisticas()
+    with st.sidebar:
+        st.caption(
+            f"Exportaciones en cache: {exportaciones['aciertos']} aciertos, {exportaciones['fallos']} fallos, "
+            f"{exportaciones['archivos']} archivos ({exportaciones['bytes_usados'] / 1e6:,.1f} de "
+            f"{exportaciones['max_bytes'] / 1e6:,.0f} MB, {exportaciones['desalojos']} desalojados)"
+        )
+        ultima = exportaciones["ultima"]
+        if ultima:
+            st.caption(
+                f"Última exportación: {ultima['hoja']} ({ultima['formato']}), "
+                f"{ultima['filas']:,} filas en {ultima['segundos']:.2f} s, "
+                f"{ultima['bytes'] / 1e3:,.0f} KB"
+            )
+
+# Filtro de filas sin ventas ni stock, columnas derivadas (utilidad, meses/días de stock),
+# MES_KEY y rangos de filas por mes y por (jefe, mes): una vez por versión de los datos
+@st.cache_resource(max_entries=2)
+def obtener_preparado(version, _df):
+    return preparar_dataset(_df)
+
+# Particiones por jefe compartidas entre sesiones: cada jefe lee directo la suya, el admin usa todo
+@st.cache_resource(max_entries=2)
+def obtener_particiones(version, _preparado):
+    return particionar_por_jefe(_preparado)
+
+# Backend opcional (actualizacion.backend = "particionado"): el dataset queda en un parquet particionado
+# por MES y JEFE_AREA y en memoria solo su esquema (dataset.df sin filas). Cada sección lee los meses
+# y el jefe que necesita con filtros sobre las particiones, prepara esas filas y las corta con
+# filas_mes / filas_rango como en memoria
+usar_particionado = st.secrets.get("actualizacion", {}).get("backend", "memoria") == "particionado"
+
+def preparar_particiones(version, meses, jefe, referencia):
+    # Filas leídas en el orden del archivo y preparadas: quedan ordenadas por (MES_KEY, FECHA)
+    return preparar_dataset(leer_particiones(version, meses, jefe, referencia))
+
+if not usar_particionado:
+    preparado = obtener_preparado(dataset.version, df)
+    df = preparado.df
 
 st.session_state.df = df
 
 # Validar columna clave
 usuario = st.session_state.usuario
 
+# Cubo mensual (mes × jefe × local × sector × subsector × marca) materializado una vez por versión;
+# los totales por mes, local o jefe salen de acá sin volver a recorrer las filas
+@st.cache_resource(max_entries=2)
+def obtener_cubo(version, _preparado):
+    return construir_cubo(_preparado)
+
+# Con particiones el cubo se arma leyendo un mes por vez
+@st.cache_resource(max_entries=2)
+def obtener_cubo_particionado(version, _referencia):
+    return construir_cubo_por_meses(
+        preparar_particiones(version, [mes], None, _referencia) for mes in meses_particionados(version)
+    )
+
+if usar_particionado:
+    cubo = obtener_cubo_particionado(dataset.version, dataset.df.dtypes)
+else:
+    cubo = obtener_cubo(dataset.version, preparado)
+
+# Tablas pivot (índice × LOCAL) por versión, rango y jefe
+@st.cache_data(max_entries=32)
+def obtener_pivot(version, rango, jefe, indice, columna, valor, agregacion, _filas):
+    return pivotear(_filas, list(indice), columna, valor, agregacion)
+
+@st.cache_data(max_entries=16)
+def obtener_margen_maximo(version, rango, jefe, _filas):
+    return margen_maximo(_filas)
+
+# Figuras de Plotly por gráfico, huella de la tabla que grafican y parámetros de layout: si los datos
+# no cambiaron (otro rerun, otra sesión con el mismo mes y jefe) se reutiliza la figura ya armada y
+# solo queda serializarla. cache_resource no la copia; plotly_chart no la modifica
+@st.cache_resource(max_entries=64)
+def obtener_figura(grafico, huella, parametros, _datos):
+    return GRAFICOS[grafico](_datos, **dict(parametros))
+
+def mostrar_grafico(grafico, datos, **parametros):
+    figura = obtener_figura(grafico, huella_tabla(datos), tuple(sorted(parametros.items())), datos)
+    st.plotly_chart(figura, use_container_width=True)
+jefe_usuario = None if usuario == "admin" else usuario.upper()
+
+if usar_particionado:
+    preparado_usuario = None
+elif usuario == "admin":
+    preparado_usuario = preparado
+else:
+    particiones = obtener_particiones(dataset.version, preparado)
+    preparado_usuario = particiones.get(usuario.upper()) or particion_vacia(preparado)
+
+# Filas del usuario con FECHA en [inicio, fin]: búsqueda binaria sobre su partición (o todo el df para
+# el admin). Con particiones se leen solo los meses del rango y los archivos de su jefe
+@st.cache_data(max_entries=16)
+def leer_rango_particionado(version, inicio, fin, jefe, _referencia):
+    meses = [str(mes) for mes in pd.period_range(inicio, fin, freq="M")]
+    return filas_rango(preparar_particiones(version, meses, jefe, _referencia), inicio, fin)
+
+def obtener_datos_rango(inicio, fin):
+    if usar_particionado:
+        return leer_rango_particionado(dataset.version, inicio, fin, jefe_usuario, dataset.df.dtypes)
+    return filas_rango(preparado_usuario, inicio, fin)
+
 if seccion == "📊 Vista General":
     st.title(" Informe Comercial por Jefe de Área")
 
     # 🧠 Cargar df solo si no está en memoria
     if "df" not in st.session_state:
         with st.spinner("Cargando datos..."):
-            st.session_state.df = cargar_datos_desde_dropbox()
+            st.session_state.df = cargar_datos_desde_dropbox().df
 
     # ✅ Ya disponible para usar
     df = st.session_state.df
@@ -161,7 +315,8 @@ if seccion == "📊 Vista General":
     # min_fecha = df["FECHA"].min()  por ahora no vamos a usar el mínimo de fecha del archivo, sino un valor fijo hasta que eliminemos 2017
     # minimo fecha var ahora 2024-01-01
     min_fecha = pd.to_datetime("2024-01-01")
-    max_fecha = df["FECHA"].max()
+    # La última fecha sale del cubo (en memoria y con particiones)
+    max_fecha = cubo.df["FECHA_MAX"].max()
 
     #Definir valor por defecto (últimos 3 meses)
     default_inicio = (max_fecha - pd.DateOffset(months=1)).date()
@@ -180,14 +335,14 @@ if seccion == "📊 Vista General":
         max_value=max_fecha.date()
     )
 
-    df_rango = df[
-        (df["FECHA"] >= pd.to_datetime(fecha_inicio)) &
-        (df["FECHA"] <= pd.to_datetime(fecha_fin))
-    ]
-    if st.session_state.get("usuario") == "admin":
-        datos_filtrados = df_rango.copy()
-    else:
-        datos_filtrados = df_rango[df_rango["JEFE_AREA"] == st.session_state.get("usuario").upper()]
+    # Las filas del usuario ya vienen separadas (partición del jefe o todo el df para el admin)
+    # y ordenadas por fecha: el rango es un slice por búsqueda binaria
+    datos_filtrados = obtener_datos_rango(
+        pd.to_datetime(fecha_inicio), pd.to_datetime(fecha_fin)
+    ).drop(columns=COLUMNAS_INTERNAS)
+
+    # Si el rango toma meses enteros, los gráficos por mes y por local se leen del cubo
+    meses_rango = meses_de_rango(cubo, pd.to_datetime(fecha_inicio), pd.to_datetime(fecha_fin))
 
     st.markdown(f"👤 Usuario logueado: `{st.session_state.get('usuario')}`")
     st.markdown(f"🔎 Filas visibles: {len(datos_filtrados)}")
@@ -202,40 +357,32 @@ if seccion == "📊 Vista General":
     if "FECHA" in tabla_para_mostrar.columns:
         tabla_para_mostrar["FECHA"] = tabla_para_mostrar["FECHA"].dt.strftime("%d/%m/%Y")
 
-    #AÑADIMOS LOS CAMPOS CALCULADOS DE MESES DE STOCK Y DIAS DE STOCK
-    tabla_para_mostrar["MESES_DE_STOCK"] = (tabla_para_mostrar["Valor de Stock:"] / tabla_para_mostrar["Valor de Vtas:"]).replace([np.inf, -np.inf], np.nan).fillna(0).fillna(0)
-    tabla_para_mostrar["DIAS_DE_STOCK"] = (tabla_para_mostrar["Valor de Stock:"] / (tabla_para_mostrar["Valor de Vtas:"] / 30)).replace([np.inf, -np.inf], np.nan).fillna(0).fillna(0)
-    tabla_para_mostrar["QUIEBRE_INMINENTE"] = np.where((0 < tabla_para_mostrar["DIAS_DE_STOCK"]) & (tabla_para_mostrar["DIAS_DE_STOCK"] < 20), "QUIEBRE INMINENTE", "")
+    # MESES_DE_STOCK, DIAS_DE_STOCK y QUIEBRE_INMINENTE ya vienen calculados en el dataset preparado
     # Formatear columnas numéricas
     if "Valor de Vtas:" in tabla_para_mostrar.columns:
-        tabla_para_mostrar["Valor de Vtas:"] = tabla_para_mostrar["Valor de Vtas:"].apply(formatear_guaranies)
+        tabla_para_mostrar["Valor de Vtas:"] = formatear_columna_guaranies(tabla_para_mostrar["Valor de Vtas:"])
     if "Costo de Vtas:" in tabla_para_mostrar.columns:
-        tabla_para_mostrar["Costo de Vtas:"] = tabla_para_mostrar["Costo de Vtas:"].apply(formatear_guaranies)
+        tabla_para_mostrar["Costo de Vtas:"] = formatear_columna_guaranies(tabla_para_mostrar["Costo de Vtas:"])
     if "Valor de Compras:" in tabla_para_mostrar.columns:
-        tabla_para_mostrar["Valor de Compras:"] = tabla_para_mostrar["Valor de Compras:"].apply(formatear_guaranies)
+        tabla_para_mostrar["Valor de Compras:"] = formatear_columna_guaranies(tabla_para_mostrar["Valor de Compras:"])
     if "Fec.Ult Compra:" in tabla_para_mostrar.columns:
         tabla_para_mostrar["Fec.Ult Compra:"] = tabla_para_mostrar["Fec.Ult Compra:"].dt.strftime("%d/%m/%Y")
     if "Valor:" in tabla_para_mostrar.columns:
-        tabla_para_mostrar["Valor:"] = tabla_para_mostrar["Valor:"].apply(formatear_guaranies)
+        tabla_para_mostrar["Valor:"] = formatear_columna_guaranies(tabla_para_mostrar["Valor:"])
     if "%:" in tabla_para_mostrar.columns:
-        tabla_para_mostrar["%:"] = tabla_para_mostrar["%:"].apply(formatear_porcentaje)
+        tabla_para_mostrar["%:"] = formatear_columna_porcentaje(tabla_para_mostrar["%:"])
     if "Valor de Stock:" in tabla_para_mostrar.columns:
-        tabla_para_mostrar["Valor de Stock:"] = tabla_para_mostrar["Valor de Stock:"].apply(formatear_guaranies)
+        tabla_para_mostrar["Valor de Stock:"] = formatear_columna_guaranies(tabla_para_mostrar["Valor de Stock:"])
     if "MESES_DE_STOCK" in tabla_para_mostrar.columns:
-        tabla_para_mostrar["MESES_DE_STOCK"] = tabla_para_mostrar["MESES_DE_STOCK"].apply(formatear_numero)
+        tabla_para_mostrar["MESES_DE_STOCK"] = formatear_columna_numero(tabla_para_mostrar["MESES_DE_STOCK"])
     if "DIAS_DE_STOCK" in tabla_para_mostrar.columns:
-        tabla_para_mostrar["DIAS_DE_STOCK"] = tabla_para_mostrar["DIAS_DE_STOCK"].apply(formatear_numeroint)
+        tabla_para_mostrar["DIAS_DE_STOCK"] = formatear_columna_numeroint(tabla_para_mostrar["DIAS_DE_STOCK"])
     
     # Mostrar tabla con fecha formateada
     st.dataframe(tabla_para_mostrar, use_container_width=True)
 
-    excel_gral = generar_excel(tabla_para_mostrar, "General")
-    st.download_button(
-        label="⬇️ Descargar Demo General",
-        data=excel_gral,
-        file_name=f"demo_gral_{usuario}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    # Se exportan los valores crudos (con formato de Excel), no los textos formateados
+    boton_descarga("⬇️ Descargar Demo General", datos_filtrados, "General", f"demo_gral_{usuario}")
     
     
 
@@ -262,46 +409,30 @@ if seccion == "📊 Vista General":
 
     # Gráfico de evolución mensual
     if "FECHA" in datos_filtrados.columns and col_venta in datos_filtrados.columns:
-        df_mes = datos_filtrados.copy()
-        df_mes["MES"] = df_mes["FECHA"].dt.to_period("M").astype(str)
-        ventas_por_mes = df_mes.groupby("MES")[col_venta].sum().reset_index()
-
-        fig = px.line(ventas_por_mes, x="MES", y=col_venta, title=f"Evolución de Ventas - {usuario}")
-        fig.update_traces(mode="lines+markers")
-        fig.update_layout(xaxis_title="Mes", yaxis_title="Ventas", hovermode="x unified")
-        fig.update_layout(yaxis_tickprefix="₲ ", yaxis_tickformat=",")
+        if meses_rango is not None:
+            ventas_por_mes = consultar(cubo, ["MES_KEY"], meses_rango, jefe_usuario)[[col_venta]].reset_index()
+            ventas_por_mes.insert(0, "MES", [str(periodo_de_clave(c)) for c in ventas_por_mes.pop("MES_KEY")])
+        else:
+            df_mes = datos_filtrados.copy()
+            df_mes["MES"] = df_mes["FECHA"].dt.to_period("M").astype(str)
+            ventas_por_mes = df_mes.groupby("MES")[col_venta].sum().reset_index()
 
-        st.plotly_chart(fig, use_container_width=True)
+        mostrar_grafico("evolucion", ventas_por_mes, columna=col_venta, titulo=f"Evolución de Ventas - {usuario}")
     else:
         st.warning("No se encontraron columnas 'FECHA' y 'Valor de Vtas:' para graficar la evolución mensual.")
 
 
     # Gráfico de ventas por LOCAL (sucursal)
     if "LOCAL" in datos_filtrados.columns and col_venta in datos_filtrados.columns:
-        ventas_por_local = datos_filtrados.groupby("LOCAL")[col_venta].sum().reset_index()
+        if meses_rango is not None:
+            ventas_por_local = consultar(cubo, ["LOCAL"], meses_rango, jefe_usuario)[[col_venta]].reset_index()
+        else:
+            ventas_por_local = datos_filtrados.groupby("LOCAL", observed=True)[col_venta].sum().reset_index()
         ventas_por_local = ventas_por_local.sort_values(by=col_venta, ascending=False)
         ventas_por_local["ventas_format"] = ventas_por_local[col_venta].map(formatear_millones)
 
 
-        fig_local = px.bar(
-            ventas_por_local,
-            x="LOCAL",
-            y=col_venta,
-            title="Ventas por Sucursal",
-            labels={col_venta: "Ventas"},
-            text="ventas_format"
-        )
-        fig_local.update_layout(
-            xaxis_title="Sucursal",
-            yaxis_title="Ventas (₲)",
-            yaxis_tickprefix="₲ ",
-            yaxis_tickformat=",.2s",
-            uniformtext_minsize=8,
-            uniformtext_mode='hide'
-        )
-        fig_local.update_traces(texttemplate='%{text}', textposition='outside')
-
-        st.plotly_chart(fig_local, use_container_width=True)
+        mostrar_grafico("ventas_local", ventas_por_local, columna=col_venta)
     else:
         st.warning("No se encontraron columnas 'LOCAL' y 'Valor de Vtas:' para graficar ventas por sucursal.")
 
@@ -349,29 +480,43 @@ if seccion == "📊 Vista General":
 
 
 
+    # Clave de las filas visibles para los pivots: los meses si el rango los toma enteros, si no las fechas
+    rango_vista = tuple(map(str, meses_rango)) if meses_rango is not None else (str(fecha_inicio), str(fecha_fin))
+
+    if usuario == "admin" and st.checkbox("⏱️ Medir tiempo de los pivots contra pd.pivot_table"):
+        for nombre, indice, valor, agregacion in [
+            ("Margen", ["SECTOR", "SUBSECTOR", "MARCA"], "%:", "mean"),
+            ("Ventas", ["SECTOR", "SUBSECTOR", "MARCA"], "Valor de Vtas:", "sum"),
+            ("Utilidad", ["SECTOR", "SUBSECTOR"], "Valor:", "sum"),
+        ]:
+            tiempo_rapido, tiempo_original, iguales = medir_pivot(datos_filtrados, indice, "LOCAL", valor, agregacion)
+            st.caption(
+                f"{nombre}: {tiempo_rapido * 1000:,.1f} ms contra {tiempo_original * 1000:,.1f} ms de pivot_table"
+                f" ({'mismo resultado' if iguales else 'resultado distinto'})"
+            )
+
+    if usuario == "admin" and st.checkbox("⏱️ Medir tiempo de los formatos por columna contra .map"):
+        for columna in [c for c in ["Valor de Vtas:", "%:"] if c in datos_filtrados.columns]:
+            for nombre, (tiempo_rapido, tiempo_original, iguales) in medir_formatos(datos_filtrados[columna]).items():
+                st.caption(
+                    f"{nombre} de {columna} {tiempo_rapido * 1000:,.1f} ms contra {tiempo_original * 1000:,.1f} ms con .map"
+                    f" ({'mismo texto' if iguales else 'texto distinto'})"
+                )
+
     st.subheader(" Tabla resumen de MARGEN por Sector, Subsector y Marca")
 
     if all(col in datos_filtrados.columns for col in ["SECTOR", "SUBSECTOR", "MARCA", "LOCAL", "%:"]):
-        tabla_margen = pd.pivot_table(
-            datos_filtrados,
-            index=["SECTOR", "SUBSECTOR", "MARCA"],
-            columns="LOCAL",
-            values="%:",
-            aggfunc="mean"
+        tabla_margen = obtener_pivot(
+            dataset.version, rango_vista, jefe_usuario,
+            ("SECTOR", "SUBSECTOR", "MARCA"), "LOCAL", "%:", "mean", datos_filtrados
         )
 
         # Formatear como texto estilo regional
-        tabla_margen = tabla_margen.map(formatear_porcentaje)
+        tabla_margen_mostrar = formatear_columna_porcentaje(tabla_margen)
 
-        st.dataframe(tabla_margen, use_container_width=True)
+        st.dataframe(tabla_margen_mostrar, use_container_width=True)
         # Botón de descarga
-        excel_margen = generar_excel(tabla_margen, "Margen")
-        st.download_button(
-            label="⬇️ Descargar tabla de margen",
-            data=excel_margen,
-            file_name=f"tabla_margen_{usuario}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        boton_descarga("⬇️ Descargar tabla de margen", tabla_margen, "Margen", f"tabla_margen_{usuario}", "porcentaje")
     else:
         st.warning("Faltan columnas para generar la tabla de margen.")
         
@@ -380,49 +525,31 @@ if seccion == "📊 Vista General":
     st.subheader(" Tabla resumen de VENTAS por Sector, Subsector y Marca")
 
     if all(col in datos_filtrados.columns for col in ["SECTOR", "SUBSECTOR", "MARCA", "LOCAL", "Valor de Vtas:"]):
-        tabla_ventas = pd.pivot_table(
-            datos_filtrados,
-            index=["SECTOR", "SUBSECTOR", "MARCA"],
-            columns="LOCAL",
-            values="Valor de Vtas:",
-            aggfunc="sum"
+        tabla_ventas = obtener_pivot(
+            dataset.version, rango_vista, jefe_usuario,
+            ("SECTOR", "SUBSECTOR", "MARCA"), "LOCAL", "Valor de Vtas:", "sum", datos_filtrados
         )
 
-        tabla_ventas = tabla_ventas.map(formatear_guaranies)
+        tabla_ventas_mostrar = formatear_columna_guaranies(tabla_ventas)
 
-        st.dataframe(tabla_ventas, use_container_width=True)
+        st.dataframe(tabla_ventas_mostrar, use_container_width=True)
 
-        excel_ventas = generar_excel(tabla_ventas, "Ventas")
-        st.download_button(
-            label="⬇️ Descargar tabla de ventas",
-            data=excel_ventas,
-            file_name=f"tabla_ventas_{usuario}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        boton_descarga("⬇️ Descargar tabla de ventas", tabla_ventas, "Ventas", f"tabla_ventas_{usuario}", "guaranies")
 
 
     st.subheader(" Tabla resumen de UTILIDAD por Sector, Subsector y Marca")
 
     if all(col in datos_filtrados.columns for col in ["SECTOR", "SUBSECTOR", "LOCAL", "Valor:"]):
-        tabla_utilidad = pd.pivot_table(
-            datos_filtrados,
-            index=["SECTOR", "SUBSECTOR"],
-            columns="LOCAL",
-            values="Valor:",
-            aggfunc="sum"
+        tabla_utilidad = obtener_pivot(
+            dataset.version, rango_vista, jefe_usuario,
+            ("SECTOR", "SUBSECTOR"), "LOCAL", "Valor:", "sum", datos_filtrados
         )
 
-        tabla_utilidad = tabla_utilidad.map(formatear_guaranies)
+        tabla_utilidad_mostrar = formatear_columna_guaranies(tabla_utilidad)
 
-        st.dataframe(tabla_utilidad, use_container_width=True)
+        st.dataframe(tabla_utilidad_mostrar, use_container_width=True)
 
-        excel_utilidad = generar_excel(tabla_utilidad, "Utilidad")
-        st.download_button(
-        label="⬇️ Descargar tabla de utilidad",
-        data=excel_utilidad,
-        file_name=f"tabla_utilidad_{usuario}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        boton_descarga("⬇️ Descargar tabla de utilidad", tabla_utilidad, "Utilidad", f"tabla_utilidad_{usuario}", "guaranies")
 
 #hasta aca es vista gral
 
@@ -435,6 +562,108 @@ if seccion == "📊 Vista General":
 #que el selector sea tipo abril-2024
 # Convertir a string para el selectbox
 # df["MES_AÑO"] = df["MES_AÑO"].dt.strftime("%B-%Y")
+# Filas de un mes del usuario: un slice de su partición por jefe (o de todo el dataset para el admin),
+# ya ordenado por FECHA. Con particiones se leen solo los archivos de ese mes y ese jefe
+@st.cache_data(max_entries=64)
+def leer_mes_particionado(version, periodo, jefe, _referencia):
+    return filas_mes(preparar_particiones(version, [periodo], jefe, _referencia), periodo)
+
+def obtener_datos_mes(periodo):
+    if usar_particionado:
+        return leer_mes_particionado(dataset.version, periodo, jefe_usuario, dataset.df.dtypes)
+    return filas_mes(preparado_usuario, periodo)
+
+# Panel de todos los meses por agrupación y jefe: cada mes con el anterior (shift 1) y el mismo
+# mes del año pasado (shift 12) ya alineados, armado una vez por versión de los datos
+DESPLAZAMIENTOS_PANEL = (1, 12)
+
+@st.cache_resource(max_entries=32)
+def obtener_panel(version, dims, jefe, _cubo):
+    return panel_mensual(_cubo, list(dims), jefe, DESPLAZAMIENTOS_PANEL)
+
+# Comparación de una métrica del mes contra el de `desplazamiento` meses atrás (detalle, subtotales
+# por la primera dimensión y total), memoizada por versión de los datos: cambiar de sección o tocar un
+# filtro reutiliza lo que ya se calculó. Contra el mes anterior o el mismo mes del año pasado es una
+# lectura del panel; cualquier otro par de meses sale de comparar sobre el cubo
+@st.cache_data(max_entries=256)
+def comparar_periodos(version, metrica, dims, periodo, desplazamiento, jefe, _cubo):
+    if desplazamiento in DESPLAZAMIENTOS_PANEL:
+        panel = obtener_panel(version, dims, jefe, _cubo)
+        return comparar_en_panel(panel, metrica, periodo, desplazamiento)
+    return comparar(_cubo, metrica, list(dims), periodo, periodo - desplazamiento, jefe)
+
+# Sumas acumuladas de la serie mensual por grupo (para comparar YTD y últimos 12 meses)
+@st.cache_resource(max_entries=32)
+def obtener_acumulados(version, dims, jefe, _cubo):
+    return acumulados_mensuales(_cubo, list(dims), jefe)
+
+# Datos del gráfico de dispersión del mes para cada agrupación y filtro de local y sector
+@st.cache_resource(max_entries=64)
+def obtener_dispersion(version, mes, jefe, _cubo):
+    return datos_dispersion(filas_mes(_cubo, mes, jefe))
+
+# Especificación de cada tabla de Comparativos (métrica, meses hacia atrás, columnas, etiqueta del total)
+ESPEC_COMPARATIVOS = {hoja: espec for hoja, *espec in TABLAS_COMPARATIVOS}
+
+def tabla_comparativo(hoja, por_local=False):
+    # La tabla de la hoja del informe para el mes analizado (con las columnas renombradas como en el
+    # informe). por_local: los subtotales por LOCAL de la misma comparación, para los gráficos
+    metrica, desplazamiento, columnas, etiqueta = ESPEC_COMPARATIVOS[hoja]
+    comparacion = comparar_periodos(
+        dataset.version, metrica, tuple(GRUPO_COMPARATIVOS), mes_analizado, desplazamiento, jefe_usuario, cubo
+    )
+    if por_local:
+        return tabla_de_subtotales(comparacion, GRUPO_COMPARATIVOS[0], columnas)
+    return tabla_de_comparacion(comparacion, GRUPO_COMPARATIVOS, columnas, etiqueta)
+
+# Informes completos (todas las tablas del mes en un libro) armados en hilos aparte y compartidos
+# por las sesiones hasta que cambia la versión de los datos
+@st.cache_resource
+def obtener_generador_informes():
+    return GeneradorInformes()
+
+def pedir_informe(periodo):
+    # Los paneles, acumulados y filas del mes salen de los caches de siempre; las tablas se arman en el hilo
+    grupo = tuple(GRUPO_COMPARATIVOS)
+    pasos = pasos_informe(
+        periodo,
+        obtener_panel(dataset.version, grupo, jefe_usuario, cubo),
+        obtener_panel(dataset.version, tuple(AGRUPADOR_VARIACION), jefe_usuario, cubo),
+        obtener_acumulados(dataset.version, grupo, jefe_usuario, cubo),
+        obtener_datos_mes(periodo),
+    )
+    return obtener_generador_informes().pedir(dataset.version, (str(periodo), jefe_usuario), pasos)
+
+def mostrar_progreso_informe(trabajo):
+    # Corre como fragmento que se repite solo mientras el hilo arma el libro: el resto de la página
+    # no se vuelve a ejecutar. Al terminar, un rerun completo muestra la descarga
+    if trabajo.futuro.done():
+        st.rerun()
+    progreso = trabajo.progreso
+    st.progress(
+        progreso["hechas"] / max(progreso["total"], 1),
+        text=f"Armando informe: {progreso['etapa']} ({progreso['hechas']}/{progreso['total']})"
+    )
+
+def informe_completo(periodo):
+    trabajo = obtener_generador_informes().trabajo(dataset.version, (str(periodo), jefe_usuario))
+    fallido = trabajo is not None and trabajo.futuro.done() and trabajo.futuro.exception() is not None
+    if trabajo is None or fallido:
+        if fallido:
+            st.error(f"No se pudo armar el informe: {trabajo.futuro.exception()}")
+        if not st.button("🔁 Reintentar informe" if fallido else "📦 Armar informe completo del mes"):
+            return
+        trabajo = pedir_informe(periodo)
+    if not trabajo.futuro.done():
+        st.fragment(mostrar_progreso_informe, run_every=0.5)(trabajo)
+        return
+    st.download_button(
+        label="⬇️ Descargar informe completo",
+        data=trabajo.futuro.result(),
+        file_name=f"informe_{usuario}_{periodo}.xlsx",
+        mime=FORMATOS_EXPORTACION["xlsx"][1]
+    )
+
 datos_mes_actual = pd.DataFrame()
 datos_mes_anterior = pd.DataFrame()
 datos_mes_aa = pd.DataFrame()
@@ -442,9 +671,7 @@ datos_filtrados = pd.DataFrame()
 
 if seccion != "📊 Vista General":
     # 👇 Todo tu bloque original
-    meses_periodos = sorted(df["FECHA"].dt.to_period("M").dropna().unique())
-    meses_periodos = [p for p in meses_periodos if p >= pd.Period("2024-01")]
-    meses_periodos = [pd.Period(p, freq='M') for p in meses_periodos]
+    meses_periodos = meses_disponibles(cubo, desde=pd.Period("2024-01", freq="M"))
     mes_labels = [p.to_timestamp().strftime("%B-%Y").upper() for p in meses_periodos]
     label_to_period = dict(zip(mes_labels, meses_periodos))
 
@@ -455,118 +682,35 @@ if seccion != "📊 Vista General":
     fecha_actual = mes_analizado.to_timestamp()
     fecha_anterior = fecha_actual - pd.DateOffset(months=1)
 
-    if usuario == "admin":
-        datos_mes_actual = df[df["FECHA"].dt.to_period("M") == mes_analizado].copy()
-        datos_mes_anterior = df[df["FECHA"].dt.to_period("M") == mes_anterior].copy()
-        datos_mes_aa = df[df["FECHA"].dt.to_period("M") == mes_anterior_anio].copy()
-    else:
-        datos_mes_actual = df[
-            (df["JEFE_AREA"] == usuario.upper()) &
-            (df["FECHA"].dt.to_period("M") == mes_analizado)
-        ].copy()
-        datos_mes_anterior = df[
-            (df["JEFE_AREA"] == usuario.upper()) &
-            (df["FECHA"].dt.to_period("M") == mes_anterior)
-        ].copy()
-        datos_mes_aa = df[
-            (df["JEFE_AREA"] == usuario.upper()) &
-            (df["FECHA"].dt.to_period("M") == mes_anterior_anio)
-        ].copy()
+    datos_mes_actual = obtener_datos_mes(mes_analizado)
+    datos_mes_anterior = obtener_datos_mes(mes_anterior)
+    datos_mes_aa = obtener_datos_mes(mes_anterior_anio)
 
     datos_filtrados = datos_mes_actual.copy()
-    # Regenerar las tablas necesarias
-    col_venta = "Valor de Vtas:"
-    col_costo = "Costo de Vtas:"
-    grupo = ["LOCAL", "SECTOR"]
 
-    
     # ======================= TABLAS DE VARIACIÓN PARA NUEVO AGRUPADOR =======================
     agrupador = ["LOCAL", "SECTOR", "SUBSECTOR", "MARCA"]
-    col_venta = "Valor de Vtas:"
-    col_costo = "Costo de Vtas:"
-
-    # Variación mensual de ventas
-    actual_grouped = datos_mes_actual.groupby(agrupador)[col_venta].sum().reset_index().rename(columns={col_venta: "ventas_mes_actual"})
-    anterior_grouped = datos_mes_anterior.groupby(agrupador)[col_venta].sum().reset_index().rename(columns={col_venta: "ventas_mes_anterior"})
-
-    tabla_ventas_mensual = pd.merge(actual_grouped, anterior_grouped, on=agrupador, how="outer").fillna(0)
-    tabla_ventas_mensual["variacion_%"] = ((tabla_ventas_mensual["ventas_mes_actual"] - tabla_ventas_mensual["ventas_mes_anterior"]) /
-                                        tabla_ventas_mensual["ventas_mes_anterior"].replace(0, pd.NA)) 
-    tabla_ventas_mensual["diferencia"] = tabla_ventas_mensual["ventas_mes_actual"] - tabla_ventas_mensual["ventas_mes_anterior"]
-
-    # Variación mensual de margen
-    m_actual = datos_mes_actual.groupby(agrupador).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    m_actual["margen_actual"] = (m_actual[col_venta] - m_actual[col_costo]) / m_actual[col_venta]
-    m_actual.drop(columns=[col_venta, col_costo], inplace=True)
-
-    m_anterior = datos_mes_anterior.groupby(agrupador).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    m_anterior["margen_anterior"] = (m_anterior[col_venta] - m_anterior[col_costo]) / m_anterior[col_venta]
-    m_anterior.drop(columns=[col_venta, col_costo], inplace=True)
-
-    tabla_margen_mensual = pd.merge(m_actual, m_anterior, on=agrupador, how="outer").fillna(0)
-    tabla_margen_mensual["variacion_%"] = tabla_margen_mensual["margen_actual"] - tabla_margen_mensual["margen_anterior"]
-
-    # Variación mensual de utilidad
-    u_actual = datos_mes_actual.groupby(agrupador).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    u_actual["utilidad_actual"] = u_actual[col_venta] - u_actual[col_costo]
-
-    u_anterior = datos_mes_anterior.groupby(agrupador).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    u_anterior["utilidad_anterior"] = u_anterior[col_venta] - u_anterior[col_costo]
-
-    tabla_utilidad_mensual = pd.merge(
-        u_actual[agrupador + ["utilidad_actual"]],
-        u_anterior[agrupador + ["utilidad_anterior"]],
-        on=agrupador,
-        how="outer"
-    ).fillna(0)
-
-    tabla_utilidad_mensual["variacion_%"] = ((tabla_utilidad_mensual["utilidad_actual"] - tabla_utilidad_mensual["utilidad_anterior"]) /
-                                            tabla_utilidad_mensual["utilidad_anterior"].replace(0, pd.NA)) 
-    tabla_utilidad_mensual["diferencia"] = tabla_utilidad_mensual["utilidad_actual"] - tabla_utilidad_mensual["utilidad_anterior"]
 
-    # =================== REPETIR PARA AÑO ANTERIOR ===================
-
-    actual_grouped_aa = datos_mes_actual.groupby(agrupador)[col_venta].sum().reset_index().rename(columns={col_venta: "ventas_actual"})
-    anterior_grouped_aa = datos_mes_aa.groupby(agrupador)[col_venta].sum().reset_index().rename(columns={col_venta: "ventas_anio_anterior"})
-
-    tabla_ventas_anual = pd.merge(actual_grouped_aa, anterior_grouped_aa, on=agrupador, how="outer").fillna(0)
-    tabla_ventas_anual["variacion_%"] = ((tabla_ventas_anual["ventas_actual"] - tabla_ventas_anual["ventas_anio_anterior"]) /
-                                        tabla_ventas_anual["ventas_anio_anterior"].replace(0, pd.NA)) 
-    tabla_ventas_anual["diferencia"] = tabla_ventas_anual["ventas_actual"] - tabla_ventas_anual["ventas_anio_anterior"]
-
-    # Margen anual
-    m_actual_aa = datos_mes_actual.groupby(agrupador).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    m_actual_aa["margen_actual"] = (m_actual_aa[col_venta] - m_actual_aa[col_costo]) / m_actual_aa[col_venta]
-
-    m_anterior_aa = datos_mes_aa.groupby(agrupador).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    m_anterior_aa["margen_anio_anterior"] = (m_anterior_aa[col_venta] - m_anterior_aa[col_costo]) / m_anterior_aa[col_venta]
-
-    tabla_margen_anual = pd.merge(
-        m_actual_aa[agrupador + ["margen_actual"]],
-        m_anterior_aa[agrupador + ["margen_anio_anterior"]],
-        on=agrupador,
-        how="outer"
-    ).fillna(0)
-
-    tabla_margen_anual["variacion_%"] = tabla_margen_anual["margen_actual"] - tabla_margen_anual["margen_anio_anterior"]
-
-    # Utilidad anual
-    u_actual_aa = datos_mes_actual.groupby(agrupador).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    u_actual_aa["utilidad_actual"] = u_actual_aa[col_venta] - u_actual_aa[col_costo]
-
-    u_anterior_aa = datos_mes_aa.groupby(agrupador).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    u_anterior_aa["utilidad_anio_anterior"] = u_anterior_aa[col_venta] - u_anterior_aa[col_costo]
-
-    tabla_utilidad_anual = pd.merge(
-        u_actual_aa[agrupador + ["utilidad_actual"]],
-        u_anterior_aa[agrupador + ["utilidad_anio_anterior"]],
-        on=agrupador,
-        how="outer"
-    ).fillna(0)
+    # Las seis tablas (mensual y anual de ventas, margen y utilidad) del Comparativo por Tipo de Variación
+    tablas_variacion = {
+        nombre: tabla_de_comparacion(
+            comparar_periodos(
+                dataset.version, metrica, tuple(agrupador), mes_analizado, desplazamiento, jefe_usuario, cubo
+            ),
+            agrupador, columnas
+        )
+        for nombre, (metrica, desplazamiento, columnas) in TABLAS_VARIACION.items()
+    }
+    tabla_ventas_mensual = tablas_variacion["ventas_mensual"]
+    tabla_margen_mensual = tablas_variacion["margen_mensual"]
+    tabla_utilidad_mensual = tablas_variacion["utilidad_mensual"]
+    tabla_ventas_anual = tablas_variacion["ventas_anual"]
+    tabla_margen_anual = tablas_variacion["margen_anual"]
+    tabla_utilidad_anual = tablas_variacion["utilidad_anual"]
 
-    tabla_utilidad_anual["variacion_%"] = ((tabla_utilidad_anual["utilidad_actual"] - tabla_utilidad_anual["utilidad_anio_anterior"]) /
-                                        tabla_utilidad_anual["utilidad_anio_anterior"].replace(0, pd.NA)) 
-    tabla_utilidad_anual["diferencia"] = tabla_utilidad_anual["utilidad_actual"] - tabla_utilidad_anual["utilidad_anio_anterior"]
+    # Comparativos, Quiebres y Variación del mes en un solo Excel
+    with st.sidebar:
+        informe_completo(mes_analizado)
 
 
 
@@ -575,7 +719,6 @@ if seccion == "📆 Comparativos Mensuales y Anuales":
     st.subheader(f" Resumen de KPIs  con var mensual y anual – {mes_analizado}")
     
     col_venta = "Valor de Vtas:"
-    col_costo = "Costo de Vtas:"
 
     # Total ventas
     ventas_actual = datos_mes_actual[col_venta].sum()
@@ -584,9 +727,9 @@ if seccion == "📆 Comparativos Mensuales y Anuales":
     delta_ventas = ((ventas_actual - ventas_anio_ant) / ventas_anio_ant)  if ventas_anio_ant else 0
 
     # Total utilidad
-    util_actual = (datos_mes_actual[col_venta] - datos_mes_actual[col_costo]).sum()
-    util_anio_ant = (datos_mes_aa[col_venta] - datos_mes_aa[col_costo]).sum()
-    util_mes_ant = (datos_mes_anterior[col_venta] - datos_mes_anterior[col_costo]).sum()
+    util_actual = datos_mes_actual["UTILIDAD"].sum()
+    util_anio_ant = datos_mes_aa["UTILIDAD"].sum()
+    util_mes_ant = datos_mes_anterior["UTILIDAD"].sum()
     delta_util = ((util_actual - util_anio_ant) / util_anio_ant)  if util_anio_ant else 0
 
     # Margen promedio
@@ -648,169 +791,58 @@ if seccion == "📆 Comparativos Mensuales y Anuales":
 
     st.subheader(" Variación Mensual de Ventas por Local y Sector")
 
-    col_venta = "Valor de Vtas:"
-    grupo = ["LOCAL", "SECTOR"]
-
-    # Agrupar ventas por mes actual y anterior
-    actual_grouped = datos_mes_actual.groupby(grupo)[col_venta].sum().reset_index().rename(columns={col_venta: "ventas_mes_actual"})
-    anterior_grouped = datos_mes_anterior.groupby(grupo)[col_venta].sum().reset_index().rename(columns={col_venta: "ventas_mes_anterior"})
-
-    # Combinar
-    variacion = pd.merge(actual_grouped, anterior_grouped, on=grupo, how="outer").fillna(0)
-
-    # Calcular variaciones
-    variacion["variacion_%"] = ((variacion["ventas_mes_actual"] - variacion["ventas_mes_anterior"]) / 
-                                variacion["ventas_mes_anterior"].replace(0, pd.NA)) 
-    variacion["diferencia"] = variacion["ventas_mes_actual"] - variacion["ventas_mes_anterior"]
-
-    # Total global
-    ventas_global_actual = datos_mes_actual[col_venta].sum()
-    ventas_global_anterior = datos_mes_anterior[col_venta].sum()
-    # Fila de totales
-    totales = pd.DataFrame({
-        "LOCAL": ["TOTAL"],
-        "SECTOR": [""],
-        "ventas_mes_actual": [ventas_global_actual],
-        "ventas_mes_anterior": [ventas_global_anterior],
-        "variacion_%": [(ventas_global_actual - ventas_global_anterior) / ventas_global_anterior] if ventas_global_anterior else [0],
-        "diferencia": [ventas_global_actual - ventas_global_anterior]
-    })
-    # Agregar fila de totales
-    variacion = pd.concat([variacion, totales], ignore_index=True)
+    # Ventas por local y sector de los dos meses, con variación, diferencia y fila de totales
+    variacion = tabla_comparativo("Variación de Ventas")
 
     #copiamos y mostramos la tabla mas lindo
     tabla_para_mostrar = variacion.copy()
-    tabla_para_mostrar["ventas_mes_actual"] = tabla_para_mostrar["ventas_mes_actual"].map(formatear_guaranies)
-    tabla_para_mostrar["ventas_mes_anterior"] = tabla_para_mostrar["ventas_mes_anterior"].map(formatear_guaranies)
-    tabla_para_mostrar["variacion_%"] = tabla_para_mostrar["variacion_%"].map(formatear_porcentaje)
-    tabla_para_mostrar["diferencia"] = tabla_para_mostrar["diferencia"].map(formatear_guaranies)
+    tabla_para_mostrar["ventas_mes_actual"] = formatear_columna_guaranies(tabla_para_mostrar["ventas_mes_actual"])
+    tabla_para_mostrar["ventas_mes_anterior"] = formatear_columna_guaranies(tabla_para_mostrar["ventas_mes_anterior"])
+    tabla_para_mostrar["variacion_%"] = formatear_columna_porcentaje(tabla_para_mostrar["variacion_%"])
+    tabla_para_mostrar["diferencia"] = formatear_columna_guaranies(tabla_para_mostrar["diferencia"])
 
     st.dataframe(tabla_para_mostrar, use_container_width=True)
     # Botón de descarga con datos originales
-    excel_variacion = generar_excel(variacion, nombre_hoja="Variación de Ventas")
-    st.download_button(
-        label="⬇️ Descargar tabla de variación mensual",
-        data=excel_variacion,
-        file_name=f"variacion_mensual_{mes_analizado}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    boton_descarga("⬇️ Descargar tabla de variación mensual", variacion, "Variación de Ventas", f"variacion_mensual_{mes_analizado}")
 
 
     st.subheader(" Comparativo Anual de Ventas por Local y Sector")
 
-    col_venta = "Valor de Vtas:"
-    grupo = ["LOCAL", "SECTOR"]
-
-    # Agrupación por mes actual
-    actual_grouped = datos_mes_actual.groupby(grupo)[col_venta].sum().reset_index()
-    actual_grouped = actual_grouped.rename(columns={col_venta: "ventas_actual"})
-
-    # Agrupación por mismo mes del año anterior
-    aa_grouped = datos_mes_aa.groupby(grupo)[col_venta].sum().reset_index()
-    aa_grouped = aa_grouped.rename(columns={col_venta: "ventas_anio_anterior"})
-
-    # Combinar
-    comparativo_aa = pd.merge(actual_grouped, aa_grouped, on=grupo, how="outer").fillna(0)
-
-    # Cálculos
-    comparativo_aa["variacion_%"] = (
-        (comparativo_aa["ventas_actual"] - comparativo_aa["ventas_anio_anterior"]) /
-        comparativo_aa["ventas_anio_anterior"].replace(0, pd.NA)
-    ) 
-
-    comparativo_aa["diferencia"] = comparativo_aa["ventas_actual"] - comparativo_aa["ventas_anio_anterior"]
-
-    #total global
-    ventas_global_actual = datos_mes_actual[col_venta].sum()
-
-
-    #total año anterior
-    ventas_global_aa = datos_mes_aa[col_venta].sum()
-
-
-    #fila de totales
-    totales = pd.DataFrame({
-        "LOCAL": ["TOTAL"],
-        "SECTOR": [""],
-        "ventas_actual": [ventas_global_actual],
-        "ventas_anio_anterior": [ventas_global_aa],
-        "variacion_%": [(ventas_global_actual - ventas_global_aa) / ventas_global_aa] if ventas_global_aa else [0],
-        "diferencia": [ventas_global_actual - ventas_global_aa]
-    })
-
-    # Agregar fila de totales
-    comparativo_aa = pd.concat([comparativo_aa, totales], ignore_index=True)
+    # Ventas por local y sector del mes y del mismo mes del año anterior, con fila de totales
+    comparativo_aa = tabla_comparativo("Comparativo Anual Ventas")
 
     # Formato para mostrar
     comparativo_mostrar = comparativo_aa.copy()
-    comparativo_mostrar["ventas_actual"] = comparativo_mostrar["ventas_actual"].map(formatear_guaranies)
-    comparativo_mostrar["ventas_anio_anterior"] = comparativo_mostrar["ventas_anio_anterior"].map(formatear_guaranies)
-    comparativo_mostrar["variacion_%"] = pd.to_numeric(comparativo_mostrar["variacion_%"], errors="coerce").round(2).map(formatear_porcentaje)
-    comparativo_mostrar["diferencia"] = comparativo_mostrar["diferencia"].map(formatear_guaranies)
+    comparativo_mostrar["ventas_actual"] = formatear_columna_guaranies(comparativo_mostrar["ventas_actual"])
+    comparativo_mostrar["ventas_anio_anterior"] = formatear_columna_guaranies(comparativo_mostrar["ventas_anio_anterior"])
+    comparativo_mostrar["variacion_%"] = formatear_columna_porcentaje(pd.to_numeric(comparativo_mostrar["variacion_%"], errors="coerce").round(2))
+    comparativo_mostrar["diferencia"] = formatear_columna_guaranies(comparativo_mostrar["diferencia"])
 
     st.dataframe(comparativo_mostrar.fillna(""), use_container_width=True)
 
     # Descarga
-    excel_comparativo_aa = generar_excel(comparativo_aa, "Comparativo Anual Ventas")
-    st.download_button(
-        label="⬇️ Descargar comparativo anual de ventas",
-        data=excel_comparativo_aa,
-        file_name=f"ventas_vs_año_pasado_{mes_analizado}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    boton_descarga("⬇️ Descargar comparativo anual de ventas", comparativo_aa, "Comparativo Anual Ventas", f"ventas_vs_año_pasado_{mes_analizado}")
 
 
 
     st.subheader(" Comparación Mensual de Ventas por Local")
 
-    # Agrupar
-    ventas_mes = datos_mes_actual.groupby("LOCAL")["Valor de Vtas:"].sum().reset_index().rename(columns={"Valor de Vtas:": "ventas_actual"})
-    ventas_ant = datos_mes_anterior.groupby("LOCAL")["Valor de Vtas:"].sum().reset_index().rename(columns={"Valor de Vtas:": "ventas_anterior"})
-    ventas_local_mes = pd.merge(ventas_mes, ventas_ant, on="LOCAL", how="outer").fillna(0)
+    # Subtotales por LOCAL de la variación mensual de ventas por local y sector
+    ventas_local_mes = tabla_comparativo("Variación de Ventas", por_local=True)
 
     # Generar etiquetas con formato ₲
-    ventas_local_mes["ventas_actual_txt"] = ventas_local_mes["ventas_actual"].map(formatear_millones)
-    ventas_local_mes["ventas_anterior_txt"] = ventas_local_mes["ventas_anterior"].map(formatear_millones)
+    ventas_local_mes["ventas_mes_actual_txt"] = ventas_local_mes["ventas_mes_actual"].map(formatear_millones)
+    ventas_local_mes["ventas_mes_anterior_txt"] = ventas_local_mes["ventas_mes_anterior"].map(formatear_millones)
 
     # Nombre del mes anterior para el título
     nombre_mes_ant = (mes_analizado - 1).strftime("%B-%Y").upper()
 
     # Gráfico con etiquetas
-    fig_mes = go.Figure(data=[
-        go.Bar(
-            name="Mes actual",
-            x=ventas_local_mes["LOCAL"],
-            y=ventas_local_mes["ventas_actual"],
-            text=ventas_local_mes["ventas_actual_txt"],
-            textposition="outside",
-            marker_color="rgb(55, 83, 109)",
-            #negrita
-            textfont=dict(size=10, color="white", family="Arial", weight="bold")
-        ),
-        go.Bar(
-            name="Mes anterior",
-            x=ventas_local_mes["LOCAL"],
-            y=ventas_local_mes["ventas_anterior"],
-            text=ventas_local_mes["ventas_anterior_txt"],
-            textposition="outside",
-            marker_color="rgb(204, 204, 204)"
-        )
-    ])
-
-    fig_mes.update_layout(
-        barmode="group",
-        title=f" Ventas por Local – {mes_analizado} vs {nombre_mes_ant}",
-        xaxis_title="Local",
-        yaxis_title="Ventas (₲)",
-        yaxis_tickprefix="₲ ",
-        yaxis_tickformat=",",
-        hovermode="x unified",
-        uniformtext_minsize=8,
-        uniformtext_mode="hide"
+    mostrar_grafico(
+        "barras_comparadas", ventas_local_mes, actual="ventas_mes_actual", comparado="ventas_mes_anterior",
+        nombre_comparado="Mes anterior", titulo=f" Ventas por Local – {mes_analizado} vs {nombre_mes_ant}"
     )
 
-    st.plotly_chart(fig_mes, use_container_width=True)
-
 
 
 
@@ -853,34 +885,20 @@ if seccion == "📆 Comparativos Mensuales y Anuales":
             index=0 # Por defecto "Todos los Sectores"
         )
 
-    if local_seleccionado != "Todos los Locales":
-        datos_filtrados = datos_filtrados[datos_filtrados['LOCAL'] == local_seleccionado]
-
-    if sector_seleccionado != "Todos los Sectores":
-        datos_filtrados = datos_filtrados[datos_filtrados['SECTOR'] == sector_seleccionado]
-    if agrupador not in datos_filtrados.columns:
-        st.warning(f"La columna '{agrupador}' no está disponible para la agrupación con los filtros actuales. Intenta seleccionar otra combinación.")
-        st.stop()
-    # Eliminar NaNs en la columna del agrupador y asegurar que sea string
-    datos_filtrados = datos_filtrados[datos_filtrados[agrupador].notna()].copy()
-    datos_filtrados[agrupador] = datos_filtrados[agrupador].astype(str)
-
     col_venta = "Valor de Vtas:"
     col_costo = "Costo de Vtas:"
 
-    # Agrupar y calcular (ahora sobre los datos filtrados)
-    df_disp = datos_filtrados.groupby(agrupador).agg({
-        col_venta: "sum",
-        col_costo: "sum"
-    }).reset_index()
-
-    df_disp["UTILIDAD"] = df_disp[col_venta] - df_disp[col_costo]
-    df_disp["MARGEN_%"] = (df_disp["UTILIDAD"] / df_disp[col_venta].replace(0, pd.NA))
-
-    # Formateo
-    df_disp["UTILIDAD_TXT"] = df_disp["UTILIDAD"].map(formatear_guaranies)
-    df_disp["MARGEN_TXT"] = df_disp["MARGEN_%"].map(formatear_porcentaje)
-    df_disp["VENTA_TXT"] = df_disp[col_venta].map(formatear_guaranies)
+    # Los datos de todas las agrupaciones y combinaciones de filtros ya están calculados para el mes
+    # y el jefe: cambiar un filtro es buscar la tabla (y después ordenar)
+    dispersion = obtener_dispersion(dataset.version, mes_analizado, jefe_usuario, cubo)
+    clave_dispersion = (
+        agrupador,
+        None if local_seleccionado == "Todos los Locales" else local_seleccionado,
+        None if sector_seleccionado == "Todos los Sectores" else sector_seleccionado,
+    )
+    df_disp = dispersion.get(clave_dispersion)
+    if df_disp is None:
+        df_disp = pd.DataFrame(columns=[agrupador, col_venta, col_costo, "UTILIDAD", "MARGEN_%"])
 
     # Selector de ordenamiento para el top N
     criterios_orden = {
@@ -898,6 +916,11 @@ if seccion == "📆 Comparativos Mensuales y Anuales":
     df_disp = df_disp[df_disp[col_venta] > 0]
     df_disp = df_disp.sort_values(columna_orden, ascending=False).head(50)
 
+    # Formateo (solo de las filas que se grafican)
+    df_disp["UTILIDAD_TXT"] = formatear_columna_guaranies(df_disp["UTILIDAD"])
+    df_disp["MARGEN_TXT"] = formatear_columna_porcentaje(df_disp["MARGEN_%"])
+    df_disp["VENTA_TXT"] = formatear_columna_guaranies(df_disp[col_venta])
+
     if not df_disp.empty:
         top_etiquetas = df_disp.head(15)[agrupador].tolist() # Mostrar las primeras 15 etiquetas
         df_disp["ETIQUETA"] = df_disp[agrupador].where(df_disp[agrupador].isin(top_etiquetas), "")
@@ -909,94 +932,24 @@ if seccion == "📆 Comparativos Mensuales y Anuales":
     df_disp["ETIQUETA"] = df_disp[agrupador].where(df_disp[agrupador].isin(top_etiquetas), "")
 
     # Crear gráfico
-    fig_disp = px.scatter(
-        df_disp,
-        x="UTILIDAD",
-        y="MARGEN_%",  # en %
-        size=col_venta,
-        text="ETIQUETA",
-        color=col_venta,
-        size_max=40,
-        hover_name=agrupador,
-        hover_data={
-            "UTILIDAD": False,
-            "MARGEN_%": False,
-            col_venta: False,
-            "UTILIDAD_TXT": True,
-            "MARGEN_TXT": True,
-            "VENTA_TXT": True,
-        },
-        labels={"UTILIDAD": "Utilidad", "MARGEN_%": "Margen %"}
-    )
-
-    fig_disp.update_traces(
-        textposition="top center",
-        textfont=dict(size=10, color="white"),
-        selector=dict(mode="markers+text")
-    )
-
-    fig_disp.update_layout(
-        xaxis_type="log", # Útil si la utilidad tiene un rango muy amplio
-        xaxis_tickprefix="₲ ",
-        xaxis_tickformat=",", # Separador de miles en el eje X
-        yaxis_tickformat=".2%", # Formato de porcentaje en el eje Y
-        hovermode="closest",
-        # Mejoras visuales adicionales para el gráfico
-        plot_bgcolor='#262730', # Fondo oscuro para el gráfico
-        paper_bgcolor='#262730', # Fondo oscuro para el área del gráfico
-        font_color='white' # Color de fuente general para el gráfico
-    )
-
-    st.plotly_chart(fig_disp, use_container_width=True)
+    mostrar_grafico("dispersion", df_disp, agrupador=agrupador, columna=col_venta)
 
 
     # Comparativo anual de ventas por local
     st.subheader(" Comparación Anual de Ventas por Local")
 
-    # Agrupación por LOCAL
-    ventas_local = comparativo_aa.groupby("LOCAL")[["ventas_actual", "ventas_anio_anterior"]].sum().reset_index()
-    #mostrar solo locales y no total
-    ventas_local = ventas_local[ventas_local["LOCAL"] != "TOTAL"]
+    # Subtotales por LOCAL del comparativo anual
+    ventas_local = tabla_comparativo("Comparativo Anual Ventas", por_local=True)
     # Etiquetas con formato ₲
     ventas_local["ventas_actual_txt"] = ventas_local["ventas_actual"].map(formatear_millones)
     ventas_local["ventas_anio_anterior_txt"] = ventas_local["ventas_anio_anterior"].map(formatear_millones)
 
     # Crear gráfico con etiquetas
-    fig = go.Figure(data=[
-        go.Bar(
-            name="Mes actual",
-            x=ventas_local["LOCAL"],
-            y=ventas_local["ventas_actual"],
-            text=ventas_local["ventas_actual_txt"],
-            textposition="outside",
-            marker_color="rgb(55, 83, 109)",
-            #negrita
-            textfont=dict(size=10, color="white", family="Arial", weight="bold")
-        ),
-        go.Bar(
-            name="Mismo mes año anterior",
-            x=ventas_local["LOCAL"],
-            y=ventas_local["ventas_anio_anterior"],
-            text=ventas_local["ventas_anio_anterior_txt"],
-            textposition="outside",
-            marker_color="rgb(204, 204, 204)"
-        )
-    ])
-
-    fig.update_layout(
-        barmode="group",
-        title=f" Ventas por Local – {mes_analizado} vs año anterior",
-        xaxis_title="Local",
-        yaxis_title="Ventas (₲)",
-        yaxis_tickprefix="₲ ",
-        yaxis_tickformat=",",
-        hovermode="x unified",
-        uniformtext_minsize=8,
-        uniformtext_mode="hide"
+    mostrar_grafico(
+        "barras_comparadas", ventas_local, actual="ventas_actual", comparado="ventas_anio_anterior",
+        nombre_comparado="Mismo mes año anterior", titulo=f" Ventas por Local – {mes_analizado} vs año anterior"
     )
 
-    st.plotly_chart(fig, use_container_width=True)
-
 
 
 
@@ -1006,138 +959,41 @@ if seccion == "📆 Comparativos Mensuales y Anuales":
 
     st.subheader(" Variación Mensual de Margen por Local y Sector")
 
-    col_venta = "Valor de Vtas:"
-    col_costo = "Costo de Vtas:"
-    grupo = ["LOCAL", "SECTOR"]
-
-    # Margen mes actual
-    m_actual = datos_mes_actual.copy()
-    m_actual = m_actual.groupby(grupo).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    m_actual["margen_actual"] = (m_actual[col_venta] - m_actual[col_costo]) / m_actual[col_venta]
-    m_actual.drop(columns=[col_venta, col_costo], inplace=True)
-
-    # Margen mes anterior
-    m_anterior = datos_mes_anterior.copy()
-    m_anterior = m_anterior.groupby(grupo).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    m_anterior["margen_anterior"] = (m_anterior[col_venta] - m_anterior[col_costo]) / m_anterior[col_venta]
-    m_anterior.drop(columns=[col_venta, col_costo], inplace=True)
-
-    # Merge y cálculo
-    tabla_margen = pd.merge(m_actual, m_anterior, on=grupo, how="outer").fillna(0)
-    tabla_margen["diferencia_margen"] = tabla_margen["margen_actual"] - tabla_margen["margen_anterior"]
-
-    # margen global actual
-    ventas_global_actual = datos_mes_actual[col_venta].sum()
-    costo_global_actual = datos_mes_actual[col_costo].sum()
-    margen_global_actual = (ventas_global_actual - costo_global_actual) / ventas_global_actual if ventas_global_actual != 0 else 0
-
-    # margen global mes anterior
-    ventas_global_ma = datos_mes_anterior[col_venta].sum()
-    costo_global_ma = datos_mes_anterior[col_costo].sum()
-    margen_global_ma = (ventas_global_ma - costo_global_ma) / ventas_global_ma if ventas_global_ma != 0 else 0
-
-    # variación del margen global
-    variacion_margen_global = margen_global_actual - margen_global_ma
-
-    # Crear la fila de totales
-    totales_row = pd.DataFrame({
-        'LOCAL': ['TOTAL GLOBAL'],
-        'SECTOR': [''],  # Puedes dejarlo en blanco o poner 'Todos'
-        'margen_actual': [margen_global_actual],
-        'margen_anterior': [margen_global_ma],
-        'diferencia_margen': [variacion_margen_global]
-    })
-    
-    tabla_margen = pd.concat([tabla_margen, totales_row], ignore_index=True)
+    # Margen por local y sector de los dos meses y su diferencia, con fila de totales
+    tabla_margen = tabla_comparativo("Variación de Margen")
 
     # Formato
     tabla_mostrar = tabla_margen.copy()
-    tabla_mostrar["margen_actual"] = tabla_mostrar["margen_actual"].map(formatear_porcentaje)
-    tabla_mostrar["margen_anterior"] = tabla_mostrar["margen_anterior"].map(formatear_porcentaje)
-    tabla_mostrar["diferencia_margen"] = tabla_mostrar["diferencia_margen"].map(formatear_porcentaje)
+    tabla_mostrar["margen_actual"] = formatear_columna_porcentaje(tabla_mostrar["margen_actual"])
+    tabla_mostrar["margen_anterior"] = formatear_columna_porcentaje(tabla_mostrar["margen_anterior"])
+    tabla_mostrar["diferencia_margen"] = formatear_columna_porcentaje(tabla_mostrar["diferencia_margen"])
 
     st.dataframe(tabla_mostrar, use_container_width=True)
 
     # Botón de descarga
-    excel_margen = generar_excel(tabla_margen, "Variación de Margen")
-    st.download_button(
-        label="⬇️ Descargar tabla de margen",
-        data=excel_margen,
-        file_name=f"variacion_margen_{mes_analizado}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    boton_descarga("⬇️ Descargar tabla de margen", tabla_margen, "Variación de Margen", f"variacion_margen_{mes_analizado}")
 
 
 
     st.subheader(" Comparativo Anual de Margen por Local y Sector")
 
-    col_venta = "Valor de Vtas:"
-    col_costo = "Costo de Vtas:"
-    grupo = ["LOCAL", "SECTOR"]
-
-    # Calcular margen actual
-    m_actual = datos_mes_actual.groupby(grupo).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    m_actual["margen_actual"] = (m_actual[col_venta] - m_actual[col_costo]) / m_actual[col_venta]
-    m_actual = m_actual[grupo + ["margen_actual"]]
-
-    # Calcular margen mismo mes del año anterior
-    m_aa = datos_mes_aa.groupby(grupo).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    m_aa["margen_anio_anterior"] = (m_aa[col_venta] - m_aa[col_costo]) / m_aa[col_venta]
-    m_aa = m_aa[grupo + ["margen_anio_anterior"]]
-
-    # Combinar
-    tabla_margen_aa = pd.merge(m_actual, m_aa, on=grupo, how="outer").fillna(0)
-
-    # Variación de margen
-    tabla_margen_aa["variacion_margen"] = tabla_margen_aa["margen_actual"] - tabla_margen_aa["margen_anio_anterior"]
-
-    # Margen Global Actual
-    ventas_global_actual = datos_mes_actual[col_venta].sum()
-    costo_global_actual = datos_mes_actual[col_costo].sum()
-    margen_global_actual = (ventas_global_actual - costo_global_actual) / ventas_global_actual if ventas_global_actual != 0 else 0
-
-    # Margen Global Año Anterior
-    ventas_global_aa = datos_mes_aa[col_venta].sum()
-    costo_global_aa = datos_mes_aa[col_costo].sum()
-    margen_global_aa = (ventas_global_aa - costo_global_aa) / ventas_global_aa if ventas_global_aa != 0 else 0
-
-
-    # Variación del Margen Global
-    variacion_margen_global = margen_global_actual - margen_global_aa
-
-    # Crear la fila de totales
-    totales_row = pd.DataFrame({
-        'LOCAL': ['TOTAL GLOBAL'],
-        'SECTOR': [''],  # Puedes dejarlo en blanco o poner 'Todos'
-        'margen_actual': [margen_global_actual],
-        'margen_anio_anterior': [margen_global_aa],
-        'variacion_margen': [variacion_margen_global]
-    })
-
-
-    tabla_margen_aa_con_totales = pd.concat([tabla_margen_aa, totales_row], ignore_index=True)
+    # Margen por local y sector del mes y del mismo mes del año anterior, con fila de totales
+    tabla_margen_aa = tabla_comparativo("Comparativo Anual Margen")
 
     # Formato para la tabla completa, incluyendo la fila de totales
-    tabla_mostrar_aa = tabla_margen_aa_con_totales.copy()
-    tabla_mostrar_aa["margen_actual"] = tabla_mostrar_aa["margen_actual"].map(formatear_porcentaje)
-    tabla_mostrar_aa["margen_anio_anterior"] = tabla_mostrar_aa["margen_anio_anterior"].map(formatear_porcentaje)
+    tabla_mostrar_aa = tabla_margen_aa.copy()
+    tabla_mostrar_aa["margen_actual"] = formatear_columna_porcentaje(tabla_mostrar_aa["margen_actual"])
+    tabla_mostrar_aa["margen_anio_anterior"] = formatear_columna_porcentaje(tabla_mostrar_aa["margen_anio_anterior"])
     # Formatear la columna de variación si existe
     if "variacion_%" in tabla_mostrar_aa.columns:
-        tabla_mostrar_aa["variacion_%"] = pd.to_numeric(tabla_mostrar_aa["variacion_%"], errors="coerce").round(2).map(formatear_porcentaje)
+        tabla_mostrar_aa["variacion_%"] = formatear_columna_porcentaje(pd.to_numeric(tabla_mostrar_aa["variacion_%"], errors="coerce").round(2))
     elif "variacion_margen" in tabla_mostrar_aa.columns:
-        tabla_mostrar_aa["variacion_margen"] = pd.to_numeric(tabla_mostrar_aa["variacion_margen"], errors="coerce").round(2).map(formatear_porcentaje)
+        tabla_mostrar_aa["variacion_margen"] = formatear_columna_porcentaje(pd.to_numeric(tabla_mostrar_aa["variacion_margen"], errors="coerce").round(2))
 
     # Mostrar la tabla en Streamlit
     st.dataframe(tabla_mostrar_aa.fillna(""), use_container_width=True)
 
-    # Descarga 44
-    excel_margen_aa = generar_excel(tabla_margen_aa, "Comparativo Anual Margen")
-    st.download_button(
-        label="⬇️ Descargar comparativo anual de margen",
-        data=excel_margen_aa,
-        file_name=f"margen_vs_año_pasado_{mes_analizado}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    boton_descarga("⬇️ Descargar comparativo anual de margen", tabla_margen_aa, "Comparativo Anual Margen", f"margen_vs_año_pasado_{mes_analizado}")
 
 
 
@@ -1145,164 +1001,75 @@ if seccion == "📆 Comparativos Mensuales y Anuales":
 
     st.subheader(" Variación Mensual de Utilidad por Local y Sector")
 
-    col_venta = "Valor de Vtas:"
-    col_costo = "Costo de Vtas:"
-    grupo = ["LOCAL", "SECTOR"]
-
-    # Utilidad mes actual
-    u_actual = datos_mes_actual.copy()
-    u_actual = u_actual.groupby(grupo).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    u_actual["utilidad_actual"] = u_actual[col_venta] - u_actual[col_costo]
-    u_actual = u_actual[grupo + ["utilidad_actual"]]
-
-    # Utilidad mes anterior
-    u_anterior = datos_mes_anterior.copy()
-    u_anterior = u_anterior.groupby(grupo).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    u_anterior["utilidad_anterior"] = u_anterior[col_venta] - u_anterior[col_costo]
-    u_anterior = u_anterior[grupo + ["utilidad_anterior"]]
-
-    # Unir y calcular
-    tabla_utilidad = pd.merge(u_actual, u_anterior, on=grupo, how="outer").fillna(0)
-    tabla_utilidad["variacion_%"] = ((tabla_utilidad["utilidad_actual"] - tabla_utilidad["utilidad_anterior"]) / 
-                                    tabla_utilidad["utilidad_anterior"].replace(0, pd.NA)) 
-    tabla_utilidad["diferencia"] = tabla_utilidad["utilidad_actual"] - tabla_utilidad["utilidad_anterior"]
-
-    # Utilidad global actual
-    ventas_global_actual = datos_mes_actual[col_venta].sum()
-    costo_global_actual = datos_mes_actual[col_costo].sum()
-    utilidad_global_actual = ventas_global_actual - costo_global_actual
-    # Utilidad global mes anterior
-    ventas_global_ma = datos_mes_anterior[col_venta].sum()
-    costo_global_ma = datos_mes_anterior[col_costo].sum()
-    utilidad_global_ma = ventas_global_ma - costo_global_ma
-
-    # Fila de totales
-    totales_row = pd.DataFrame({
-        'LOCAL': ['TOTAL GLOBAL'],
-        'SECTOR': [''],  # Puedes dejarlo en blanco o poner 'Todos'
-        'utilidad_actual': [utilidad_global_actual],
-        'utilidad_anterior': [utilidad_global_ma],
-        'variacion_%': [(utilidad_global_actual - utilidad_global_ma) / utilidad_global_ma  if utilidad_global_ma != 0 else 0],
-        'diferencia': [utilidad_global_actual - utilidad_global_ma]
-    })
-
-    # Agregar fila de totales a la tabla
-    tabla_utilidad = pd.concat([tabla_utilidad, totales_row], ignore_index=True)
+    # Utilidad por local y sector de los dos meses, con variación, diferencia y fila de totales
+    tabla_utilidad = tabla_comparativo("Variación de Utilidad")
 
     # Formato para mostrar
     tabla_u_mostrar = tabla_utilidad.copy()
-    tabla_u_mostrar["utilidad_actual"] = tabla_u_mostrar["utilidad_actual"].map(formatear_guaranies)
-    tabla_u_mostrar["utilidad_anterior"] = tabla_u_mostrar["utilidad_anterior"].map(formatear_guaranies)
-    tabla_u_mostrar["variacion_%"] = pd.to_numeric(tabla_u_mostrar["variacion_%"], errors="coerce").round(2).map(formatear_porcentaje)
-    tabla_u_mostrar["diferencia"] = tabla_u_mostrar["diferencia"].map(formatear_guaranies)
+    tabla_u_mostrar["utilidad_actual"] = formatear_columna_guaranies(tabla_u_mostrar["utilidad_actual"])
+    tabla_u_mostrar["utilidad_anterior"] = formatear_columna_guaranies(tabla_u_mostrar["utilidad_anterior"])
+    tabla_u_mostrar["variacion_%"] = formatear_columna_porcentaje(pd.to_numeric(tabla_u_mostrar["variacion_%"], errors="coerce").round(2))
+    tabla_u_mostrar["diferencia"] = formatear_columna_guaranies(tabla_u_mostrar["diferencia"])
 
     st.dataframe(tabla_u_mostrar, use_container_width=True)
 
     # Botón para descargar
-    excel_utilidad = generar_excel(tabla_utilidad, "Variación de Utilidad")
-    st.download_button(
-        label="⬇️ Descargar tabla de utilidad",
-        data=excel_utilidad,
-        file_name=f"variacion_utilidad_{mes_analizado}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    boton_descarga("⬇️ Descargar tabla de utilidad", tabla_utilidad, "Variación de Utilidad", f"variacion_utilidad_{mes_analizado}")
 
 
     st.subheader(" Comparativo Anual de Utilidad por Local y Sector")
 
-    col_venta = "Valor de Vtas:"
-    col_costo = "Costo de Vtas:"
+    # Utilidad por local y sector del mes y del mismo mes del año anterior, con fila de totales
+    tabla_utilidad_aa = tabla_comparativo("Comparativo Anual Utilidad")
+    # Formato para mostrar
+    tabla_mostrar_aa = tabla_utilidad_aa.copy()
+    tabla_mostrar_aa["utilidad_actual"] = formatear_columna_guaranies(tabla_mostrar_aa["utilidad_actual"])
+    tabla_mostrar_aa["utilidad_anio_anterior"] = formatear_columna_guaranies(tabla_mostrar_aa["utilidad_anio_anterior"])
+    tabla_mostrar_aa["variacion_%"] = formatear_columna_porcentaje(pd.to_numeric(tabla_mostrar_aa["variacion_%"], errors="coerce").round(2))
+    tabla_mostrar_aa["diferencia"] = formatear_columna_guaranies(tabla_mostrar_aa["diferencia"])
+
+    st.dataframe(tabla_mostrar_aa.fillna(""), use_container_width=True)
+
+    # Descarga
+    boton_descarga("⬇️ Descargar comparativo anual de utilidad", tabla_utilidad_aa, "Comparativo Anual Utilidad", f"utilidad_vs_año_pasado_{mes_analizado}")
+
+
+    st.subheader(" Acumulado del Año y Últimos 12 Meses por Local y Sector")
+
+    ventanas = {"Acumulado del año (YTD)": "ytd", "Últimos 12 meses (T12M)": "t12m"}
+    ventana_label = st.radio("Ventana:", list(ventanas), horizontal=True)
+    ventana = ventanas[ventana_label]
     grupo = ["LOCAL", "SECTOR"]
 
-    # Utilidad actual
-    u_actual = datos_mes_actual.groupby(grupo).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    u_actual["utilidad_actual"] = u_actual[col_venta] - u_actual[col_costo]
-    u_actual = u_actual[grupo + ["utilidad_actual"]]
-
-    # Utilidad mismo mes año anterior
-    u_aa = datos_mes_aa.groupby(grupo).agg({col_venta: "sum", col_costo: "sum"}).reset_index()
-    u_aa["utilidad_anio_anterior"] = u_aa[col_venta] - u_aa[col_costo]
-    u_aa = u_aa[grupo + ["utilidad_anio_anterior"]]
-
-    # Combinar
-    tabla_utilidad_aa = pd.merge(u_actual, u_aa, on=grupo, how="outer").fillna(0)
-
-    # Variación y diferencia
-    tabla_utilidad_aa["variacion_%"] = (
-        (tabla_utilidad_aa["utilidad_actual"] - tabla_utilidad_aa["utilidad_anio_anterior"]) /
-        tabla_utilidad_aa["utilidad_anio_anterior"].replace(0, pd.NA)
-    ) 
-    tabla_utilidad_aa["diferencia"] = tabla_utilidad_aa["utilidad_actual"] - tabla_utilidad_aa["utilidad_anio_anterior"]
-
-    #utilidad global actual
-    ventas_global_actual = datos_mes_actual[col_venta].sum()
-    costo_global_actual = datos_mes_actual[col_costo].sum()
-    utilidad_global_actual = ventas_global_actual - costo_global_actual
-    #utilidad global año anterior
-    ventas_global_aa = datos_mes_aa[col_venta].sum()
-    costo_global_aa = datos_mes_aa[col_costo].sum()
-    utilidad_global_aa = ventas_global_aa - costo_global_aa
-
-    #fila de totales
-    totales_row_aa = pd.DataFrame({
-        'LOCAL': ['TOTAL GLOBAL'],
-        'SECTOR': [''],  # Puedes dejarlo en blanco o poner 'Todos'
-        'utilidad_actual': [utilidad_global_actual],
-        'utilidad_anio_anterior': [utilidad_global_aa],
-        'variacion_%': [(utilidad_global_actual - utilidad_global_aa) / utilidad_global_aa if utilidad_global_aa != 0 else 0],
-        'diferencia': [utilidad_global_actual - utilidad_global_aa]
-    })
+    # La ventana que termina en el mes analizado contra la misma ventana del año anterior,
+    # restando sumas acumuladas por local y sector (calculadas una vez por versión y jefe)
+    acumulados = obtener_acumulados(dataset.version, tuple(grupo), jefe_usuario, cubo)
+    tabla_ventana = tabla_acumulada(acumulados, mes_analizado, ventana, grupo)
+
+    desde, hasta = ventana_de(mes_analizado, ventana)
+    st.caption(f"{periodo_de_clave(desde)} a {periodo_de_clave(hasta)} contra {periodo_de_clave(desde - 12)} a {periodo_de_clave(hasta - 12)}")
 
-    tabla_utilidad_aa = pd.concat([tabla_utilidad_aa, totales_row_aa], ignore_index=True)
     # Formato para mostrar
-    tabla_mostrar_aa = tabla_utilidad_aa.copy()
-    tabla_mostrar_aa["utilidad_actual"] = tabla_mostrar_aa["utilidad_actual"].map(formatear_guaranies)
-    tabla_mostrar_aa["utilidad_anio_anterior"] = tabla_mostrar_aa["utilidad_anio_anterior"].map(formatear_guaranies)
-    tabla_mostrar_aa["variacion_%"] = pd.to_numeric(tabla_mostrar_aa["variacion_%"], errors="coerce").round(2).map(formatear_porcentaje)
-    tabla_mostrar_aa["diferencia"] = tabla_mostrar_aa["diferencia"].map(formatear_guaranies)
+    tabla_ventana_mostrar = tabla_ventana.copy()
+    for col in ["ventas_actual", "ventas_anio_anterior", "utilidad_actual", "utilidad_anio_anterior"]:
+        tabla_ventana_mostrar[col] = formatear_columna_guaranies(tabla_ventana_mostrar[col])
+    for col in ["variacion_ventas_%", "variacion_utilidad_%", "margen_actual", "margen_anio_anterior", "diferencia_margen"]:
+        tabla_ventana_mostrar[col] = formatear_columna_porcentaje(pd.to_numeric(tabla_ventana_mostrar[col], errors="coerce"))
 
-    st.dataframe(tabla_mostrar_aa.fillna(""), use_container_width=True)
+    st.dataframe(tabla_ventana_mostrar.fillna(""), use_container_width=True)
 
     # Descarga
-    excel_utilidad_aa = generar_excel(tabla_utilidad_aa, "Comparativo Anual Utilidad")
-    st.download_button(
-        label="⬇️ Descargar comparativo anual de utilidad",
-        data=excel_utilidad_aa,
-        file_name=f"utilidad_vs_año_pasado_{mes_analizado}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    boton_descarga(f"⬇️ Descargar comparativo {ventana.upper()}", tabla_ventana, "Acumulado " + ventana.upper(), f"comparativo_{ventana}_{mes_analizado}")
 
 
 if seccion == "📅 Quiebres, Sobre stock y Margen <10%":
     st.subheader(" Productos en Quiebre Total")
-    if usuario == "admin":
-        datos_mes_actual = df[df["FECHA"].dt.to_period("M") == mes_analizado].copy()
-        datos_mes_anterior = df[df["FECHA"].dt.to_period("M") == (mes_analizado - 1)].copy()
-        datos_mes_aa = df[df["FECHA"].dt.to_period("M") == (mes_analizado - 12)].copy()
-    else:
-        datos_mes_actual = df[
-            (df["JEFE_AREA"] == usuario.upper()) &
-            (df["FECHA"].dt.to_period("M") == mes_analizado)
-        ].copy()
-        datos_mes_anterior = df[
-            (df["JEFE_AREA"] == usuario.upper()) &
-            (df["FECHA"].dt.to_period("M") == (mes_analizado - 1))
-        ].copy()
-        datos_mes_aa = df[
-            (df["JEFE_AREA"] == usuario.upper()) &
-            (df["FECHA"].dt.to_period("M") == (mes_analizado - 12))
-        ].copy()
 
     # Filtrar productos vendidos sin stock
-    quiebre = datos_mes_actual.copy()
-    quiebre = quiebre[
-        (quiebre["Valor de Stock:"] <= 0) &
-        (quiebre["Valor de Vtas:"] > 0)
-    ]
+    quiebre = filtrar_quiebre_total(datos_mes_actual)
 
     # Columnas clave a mostrar
-    columnas_mostrar = ["LOCAL", "SECTOR", "SUBSECTOR", "MARCA", "DESCRIPCION", 
-                        "Valor de Vtas:", "Valor de Stock:", "Fec.Ult Compra:"]
+    columnas_mostrar = COLUMNAS_QUIEBRE
 
     # st.write(" Columnas en df:", df.columns.tolist())
     # st.write(" Columnas en quiebre:", quiebre.columns.tolist())
@@ -1318,16 +1085,13 @@ if seccion == "📅 Quiebres, Sobre stock y Margen <10%":
 
     # Formateo si están las columnas
     if "Valor de Vtas:" in quiebre_mostrar:
-        quiebre_mostrar["Valor de Vtas:"] = quiebre_mostrar["Valor de Vtas:"].map(formatear_guaranies)
+        quiebre_mostrar["Valor de Vtas:"] = formatear_columna_guaranies(quiebre_mostrar["Valor de Vtas:"])
     if "Valor de Stock:" in quiebre_mostrar:
-        quiebre_mostrar["Valor de Stock:"] = quiebre_mostrar["Valor de Stock:"].map(formatear_guaranies)
+        quiebre_mostrar["Valor de Stock:"] = formatear_columna_guaranies(quiebre_mostrar["Valor de Stock:"])
 
     # Formatear la fecha de última compra si existe
     if "Fec.Ult Compra:" in quiebre_mostrar.columns:
-        # Convertir a datetime
-        quiebre_mostrar["Fec.Ult Compra:"] = pd.to_datetime(quiebre_mostrar["Fec.Ult Compra:"], errors="coerce")
-
-        # Calcular días desde la última compra
+        # Calcular días desde la última compra (la columna ya es datetime en el dataset preparado)
         hoy = pd.to_datetime(datetime.date.today())
         quiebre_mostrar["Días sin compra"] = (hoy - quiebre_mostrar["Fec.Ult Compra:"]).dt.days
 
@@ -1337,40 +1101,27 @@ if seccion == "📅 Quiebres, Sobre stock y Margen <10%":
     st.dataframe(quiebre_mostrar, use_container_width=True)
 
     # Descargar Excel
-    excel_quiebre = generar_excel(quiebre[columnas_presentes], "Quiebre Total")
-    st.download_button(
-        label="⬇️ Descargar tabla de quiebre total",
-        data=excel_quiebre,
-        file_name=f"quiebre_total_{mes_analizado}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    boton_descarga("⬇️ Descargar tabla de quiebre total", quiebre[columnas_presentes], "Quiebre Total", f"quiebre_total_{mes_analizado}")
 
 
 
     st.subheader(" Productos en Sobre Stock")
-    # Copia del mes actual
-    sobre_stock = datos_mes_actual.copy()
-
-    # Calcular MESES DE STOCK
-    sobre_stock["MESES DE STOCK"] = sobre_stock["Valor de Stock:"] / sobre_stock["Valor de Vtas:"].replace(0, pd.NA)
-
-    # Aplicar condición de sobre stock
-    sobre_stock = sobre_stock[
-        (sobre_stock["MESES DE STOCK"] >= 6) |
-        ((sobre_stock["Valor de Vtas:"] == 0) & (sobre_stock["Valor de Stock:"] > 0))
-    ]
+    # Seis meses o más de stock, o stock sin ventas
+    sobre_stock = filtrar_sobre_stock(datos_mes_actual)
 
     # Columnas a mostrar
-    columnas_sobre = [
-        "LOCAL", "SECTOR", "SUBSECTOR", "MARCA", "Fec.Ult Compra:",
-        "Valor de Vtas:", "Valor de Stock:", "MESES DE STOCK"
-    ]
+    columnas_sobre = COLUMNAS_SOBRE_STOCK
 
 
     # Verificar columnas disponibles
     columnas_presentes = [col for col in columnas_sobre if col in sobre_stock.columns]
     sobre_mostrar = sobre_stock[columnas_presentes].copy()
 
+    # Días sin compra y fecha como texto antes de agregar la fila de totales
+    if "Fec.Ult Compra:" in sobre_mostrar.columns:
+        sobre_mostrar["Días sin compra"] = (pd.to_datetime(datetime.date.today()) - sobre_mostrar["Fec.Ult Compra:"]).dt.days
+        sobre_mostrar["Fec.Ult Compra:"] = sobre_mostrar["Fec.Ult Compra:"].dt.strftime("%d/%m/%Y")
+
     #agregar total de Valor de Vtas y Valor de Stock
     total_stock = sobre_mostrar["Valor de Stock:"].sum()
     total_ventas = sobre_mostrar["Valor de Vtas:"].sum()
@@ -1391,68 +1142,38 @@ if seccion == "📅 Quiebres, Sobre stock y Margen <10%":
     sobre_mostrar = pd.concat([sobre_mostrar, totales_row], ignore_index=True)
 
 
-    # Formato de fechas y moneda
-    if "Fec.Ult Compra:" in sobre_mostrar.columns:
-        sobre_mostrar["Fec.Ult Compra:"] = pd.to_datetime(sobre_mostrar["Fec.Ult Compra:"], errors="coerce")
-        sobre_mostrar["Días sin compra"] = (pd.to_datetime(datetime.date.today()) - sobre_mostrar["Fec.Ult Compra:"]).dt.days
-        sobre_mostrar["Fec.Ult Compra:"] = sobre_mostrar["Fec.Ult Compra:"].dt.strftime("%d/%m/%Y")
-
+    # Formato de moneda
     if "Valor de Vtas:" in sobre_mostrar:
-        sobre_mostrar["Valor de Vtas:"] = sobre_mostrar["Valor de Vtas:"].map(formatear_guaranies)
+        sobre_mostrar["Valor de Vtas:"] = formatear_columna_guaranies(sobre_mostrar["Valor de Vtas:"])
     if "Valor de Stock:" in sobre_mostrar:
-        sobre_mostrar["Valor de Stock:"] = sobre_mostrar["Valor de Stock:"].map(formatear_guaranies)
+        sobre_mostrar["Valor de Stock:"] = formatear_columna_guaranies(sobre_mostrar["Valor de Stock:"])
     if "MESES DE STOCK" in sobre_mostrar.columns:
-        sobre_mostrar["MESES DE STOCK"] = sobre_mostrar["MESES DE STOCK"].map(formatear_numero)
+        sobre_mostrar["MESES DE STOCK"] = formatear_columna_numero(sobre_mostrar["MESES DE STOCK"])
     if "Días sin compra" in sobre_mostrar.columns:
-        sobre_mostrar["Días sin compra"] = sobre_mostrar["Días sin compra"].map(formatear_numeroint)
+        sobre_mostrar["Días sin compra"] = formatear_columna_numeroint(sobre_mostrar["Días sin compra"])
         #no mostrar vacios como nan, poner ""
 
     # Mostrar tabla
     st.dataframe(sobre_mostrar.fillna(""), use_container_width=True)
 
     # Descargar Excel
-    excel_sobre = generar_excel(sobre_stock[columnas_presentes], "Sobre Stock")
-    st.download_button(
-        label="⬇️ Descargar tabla de sobre stock",
-        data=excel_sobre,
-        file_name=f"sobre_stock_{mes_analizado}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    boton_descarga("⬇️ Descargar tabla de sobre stock", sobre_stock[columnas_presentes], "Sobre Stock", f"sobre_stock_{mes_analizado}")
 
 
     # Tabla de margen máximo por sector, subsector y marca
     st.subheader(" MARGEN maximo por Sector, Subsector y Marca")
 
     if all(col in datos_filtrados.columns for col in ["SECTOR", "SUBSECTOR", "MARCA", "LOCAL", "%:"]):
-        # Crear tabla pivot (sin formatear aún)
-        tabla_margen_cruda = pd.pivot_table(
-            datos_filtrados,
-            index=["SECTOR", "SUBSECTOR", "MARCA"],
-            columns="LOCAL",
-            values="%:",
-            aggfunc="mean"
-        )
-
-        # Calcular margen máximo entre locales (ignora NaN)
-        tabla_margen_cruda["Margen Máximo"] = tabla_margen_cruda.max(axis=1)
+        # Margen promedio por local y el máximo entre locales (sin formatear aún)
+        tabla_margen_cruda = obtener_margen_maximo(dataset.version, (str(mes_analizado),), jefe_usuario, datos_filtrados)
 
-        # Copiar y aplicar formato visual
-        tabla_margen = tabla_margen_cruda.copy()
-        tabla_margen = tabla_margen.map(formatear_porcentaje)
-
-        # Formatear también la nueva columna "Margen Máximo"
-        tabla_margen["Margen Máximo"] = tabla_margen_cruda["Margen Máximo"].map(formatear_porcentaje)
+        # Copiar y aplicar formato visual (incluida la columna "Margen Máximo")
+        tabla_margen = formatear_columna_porcentaje(tabla_margen_cruda)
 
         st.dataframe(tabla_margen, use_container_width=True)
 
         # Exportar tabla original (sin formato)
-        excel_margen = generar_excel(tabla_margen_cruda, "Margen")
-        st.download_button(
-            label="⬇️ Descargar tabla de margen",
-            data=excel_margen,
-            file_name=f"tabla_margen_maximo_{usuario}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        boton_descarga("⬇️ Descargar tabla de margen", tabla_margen_cruda, "Margen", f"tabla_margen_maximo_{usuario}", "porcentaje")
     else:
         st.warning("Faltan columnas para generar la tabla de margen.") # Faltan columnas
 
@@ -1463,24 +1184,18 @@ if seccion == "📅 Quiebres, Sobre stock y Margen <10%":
 
     if all(col in datos_filtrados.columns for col in ["SECTOR", "SUBSECTOR", "LOCAL", "MARCA", "%:"]):
         # Agrupación por SECTOR, SUBSECTOR y LOCAL
-        tabla_subsector = datos_filtrados.groupby(["LOCAL","SECTOR", "SUBSECTOR",  "MARCA"])["%:"].mean().reset_index()
+        tabla_subsector = margen_por_subsector(datos_filtrados)
 
         # Filtrar donde el margen promedio sea menor al 10%
         tabla_filtrada = tabla_subsector[tabla_subsector["%:"] < 0.1].copy()
 
         # Formatear margen
-        tabla_filtrada["%:"] = tabla_filtrada["%:"].map(formatear_porcentaje)
+        tabla_filtrada["%:"] = formatear_columna_porcentaje(tabla_filtrada["%:"])
 
         st.dataframe(tabla_filtrada, use_container_width=True)
 
         # Descargar versión sin formato
-        excel_margen_bajo = generar_excel(tabla_subsector[tabla_subsector["%:"] < 0.1], "Subsectores < 10")
-        st.download_button(
-            label="⬇️ Descargar subsectores con margen < 10%",
-            data=excel_margen_bajo,
-            file_name=f"subsectores_margen_bajo_{usuario}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        boton_descarga("⬇️ Descargar subsectores con margen < 10%", tabla_subsector[tabla_subsector["%:"] < 0.1], "Subsectores < 10", f"subsectores_margen_bajo_{usuario}")
     else:
         st.warning("Faltan columnas para generar esta tabla.")
 
@@ -1494,7 +1209,7 @@ if seccion == "📊 Comparativo por Tipo de Variación":
         tabla_ventas_anual,
         tabla_margen_anual,
         tabla_utilidad_anual,
-        formatear_guaranies,
-        formatear_porcentaje,
-        generar_excel
+        formatear_columna_guaranies,
+        formatear_columna_porcentaje,
+        boton_descarga
     )
\ No newline at end of file
@@ -0,0 +1,742 @@
+import datetime
+import hashlib
+import io
+import json
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# Carpeta donde se guardan los snapshots columnar del Excel ya parseado
+CACHE_DIR = Path(os.environ.get("INFORME_CACHE_DIR", ".cache_informe"))
+TAM_BLOQUE = 1 << 20
+
+# Tipos conocidos de las columnas del informe, para los buffers de la ingesta por streaming
+COLUMNAS_FECHA = ["FECHA", "Fec.Ult Compra:"]
+COLUMNAS_NUMERICAS = [
+    "Valor de Vtas:", "Costo de Vtas:", "Valor de Compras:",
+    "Valor:", "%:", "Valor de Stock:"
+]
+COLUMNAS_DIMENSION = ["LOCAL", "SECTOR", "SUBSECTOR", "MARCA", "JEFE_AREA", "DESCRIPCION"]
+# Medidas en guaraníes que se suman: se dejan en float64 para no perder precisión en los totales
+COLUMNAS_MONTO = ["Valor de Vtas:", "Costo de Vtas:", "Valor de Compras:", "Valor:", "Valor de Stock:"]
+
+_sesion = None
+
+# Estadísticas de la última ingesta del Excel (filas, segundos, filas/seg). El hilo del
+# actualizador publica un dict nuevo cada vez y nunca modifica el publicado, así la app puede
+# leerlo sin ver una ingesta a medio registrar
+_ultima_ingesta = {}
+_lock_ingesta = threading.Lock()
+
+
+def hash_archivo(ruta, tam_bloque=TAM_BLOQUE):
+    # Hash del contenido descargado; si los bytes no cambian, la clave tampoco
+    h = hashlib.blake2b(digest_size=16)
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(tam_bloque), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def obtener_sesion():
+    # Una sola sesión por proceso para reutilizar conexiones (keep-alive)
+    global _sesion
+    if _sesion is None:
+        _sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=2)
+        _sesion.mount("http://", adaptador)
+        _sesion.mount("https://", adaptador)
+    return _sesion
+
+
+def _rutas_descarga(url):
+    clave_url = hashlib.blake2b(url.encode(), digest_size=8).hexdigest()
+    return CACHE_DIR / f"fuente_{clave_url}.xlsx", CACHE_DIR / f"fuente_{clave_url}.json"
+
+
+def _leer_metadatos(ruta_meta):
+    try:
+        return json.loads(ruta_meta.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def descargar_archivo(url, timeout=60, tam_bloque=TAM_BLOQUE):
+    # Descarga condicional: si el servidor responde 304 se reutiliza la copia local.
+    # Devuelve (ruta del archivo, hash del contenido, si cambió o no)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    ruta_archivo, ruta_meta = _rutas_descarga(url)
+    meta = _leer_metadatos(ruta_meta) if ruta_archivo.exists() else {}
+
+    encabezados = {}
+    if meta.get("etag"):
+        encabezados["If-None-Match"] = meta["etag"]
+    if meta.get("last_modified"):
+        encabezados["If-Modified-Since"] = meta["last_modified"]
+
+    with obtener_sesion().get(url, headers=encabezados, stream=True, timeout=timeout) as response:
+        if response.status_code == 304 and meta.get("hash"):
+            return ruta_archivo, meta["hash"], False
+        response.raise_for_status()
+
+        # Se escribe por bloques en un temporal dentro de CACHE_DIR y se reemplaza al final
+        h = hashlib.blake2b(digest_size=16)
+        fd, tmp_path = tempfile.mkstemp(suffix=".xlsx.tmp", dir=CACHE_DIR)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for bloque in response.iter_content(chunk_size=tam_bloque):
+                    tmp.write(bloque)
+                    h.update(bloque)
+            os.replace(tmp_path, ruta_archivo)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "hash": h.hexdigest(),
+        }
+    ruta_meta.write_text(json.dumps(meta))
+    return ruta_archivo, meta["hash"], True
+
+
+# Versión del contenido de los snapshots (columnas y tipos que deja normalizar_tipos): va en el nombre
+# junto con el modo de ingesta, así un snapshot de otra versión o de otro lector no se reutiliza
+ESQUEMA_SNAPSHOT = 2
+
+
+def ruta_snapshot(clave, modo="streaming"):
+    return CACHE_DIR / f"{clave}-v{ESQUEMA_SNAPSHOT}-{modo}.parquet"
+
+
+def leer_snapshot(clave, modo="streaming"):
+    ruta = ruta_snapshot(clave, modo)
+    if not ruta.exists():
+        return None
+    try:
+        return pd.read_parquet(ruta)
+    except Exception:
+        # Snapshot corrupto o incompleto: se descarta y se vuelve a parsear
+        ruta.unlink(missing_ok=True)
+        return None
+
+
+def _columnas_mixtas_a_texto(df):
+    # Parquet no admite columnas object con tipos mezclados (ej. códigos numéricos y texto)
+    df = df.copy()
+    for col in df.select_dtypes(include="object").columns:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def _escribir_parquet(df, ruta):
+    tmp = ruta.with_suffix(".parquet.tmp")
+    try:
+        df.to_parquet(tmp, index=False)
+    except Exception:
+        _columnas_mixtas_a_texto(df).to_parquet(tmp, index=False)
+    # Reemplazo atómico para que nunca se lea un archivo a medio escribir
+    os.replace(tmp, ruta)
+    return ruta
+
+
+def guardar_snapshot(df, clave, modo="streaming"):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return _escribir_parquet(df, ruta_snapshot(clave, modo))
+
+
+def invalidar_snapshot(clave=None):
+    # Sin clave se borran todos los snapshots guardados; con clave, los de ese archivo en cualquier
+    # versión y modo
+    if not CACHE_DIR.exists():
+        return 0
+    patron = f"{clave}*.parquet" if clave else "*.parquet"
+    borrados = 0
+    for ruta in CACHE_DIR.glob(patron):
+        ruta.unlink(missing_ok=True)
+        borrados += 1
+    return borrados
+
+
+def _nuevo_buffer(col, n):
+    if col in COLUMNAS_FECHA:
+        return np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]")
+    if col in COLUMNAS_NUMERICAS:
+        return np.full(n, np.nan, dtype="float64")
+    return np.full(n, None, dtype=object)
+
+
+def _a_float(valor):
+    if valor is None or isinstance(valor, (int, float)):
+        return np.nan if valor is None else valor
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _a_fecha(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor
+    if isinstance(valor, datetime.date):
+        return datetime.datetime(valor.year, valor.month, valor.day)
+    return pd.to_datetime(valor, errors="coerce", dayfirst=True) if valor is not None else None
+
+
+def _abrir_hoja(ruta_xlsx):
+    # Devuelve (libro, columnas, iterador de filas, filas declaradas) de la primera hoja
+    import openpyxl
+
+    libro = openpyxl.load_workbook(ruta_xlsx, read_only=True, data_only=True)
+    hoja = libro.worksheets[0]
+    filas = hoja.iter_rows(values_only=True)
+    encabezado = next(filas, None) or ()
+    columnas = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(encabezado)]
+    # max_row viene de la dimensión declarada en la hoja y puede faltar
+    declaradas = (hoja.max_row - 1) if hoja.max_row and hoja.max_row > 1 else None
+    return libro, columnas, filas, declaradas
+
+
+def _filas_no_vacias(filas):
+    for fila in filas:
+        if fila is not None and any(v is not None for v in fila):
+            yield fila
+
+
+def _llenar_buffers(columnas, filas, capacidad):
+    # Llena buffers tipados preasignados; si la capacidad no alcanza se crece duplicando
+    capacidad = max(capacidad, 1)
+    buffers = [_nuevo_buffer(col, capacidad) for col in columnas]
+    conversores = [
+        _a_fecha if col in COLUMNAS_FECHA else _a_float if col in COLUMNAS_NUMERICAS else None
+        for col in columnas
+    ]
+    n_cols = len(columnas)
+
+    n = 0
+    for fila in filas:
+        if n == capacidad:
+            capacidad *= 2
+            for j, col in enumerate(columnas):
+                nuevo = _nuevo_buffer(col, capacidad)
+                nuevo[:n] = buffers[j][:n]
+                buffers[j] = nuevo
+        for j in range(min(n_cols, len(fila))):
+            valor = fila[j]
+            if valor is None:
+                continue
+            conversor = conversores[j]
+            buffers[j][n] = conversor(valor) if conversor else valor
+        n += 1
+
+    df = pd.DataFrame({col: buffers[j][:n] for j, col in enumerate(columnas)}, copy=False)
+    # Columnas no tipadas: se deja que pandas infiera (ej. enteros o texto)
+    otras = [col for col in columnas if col not in COLUMNAS_FECHA and col not in COLUMNAS_NUMERICAS]
+    if otras:
+        df[otras] = df[otras].infer_objects()
+    return df
+
+
+def _registrar_ingesta(modo, filas, inicio, **extra):
+    global _ultima_ingesta
+    segundos = time.perf_counter() - inicio
+    ingesta = {
+        "modo": modo,
+        "filas": filas,
+        "segundos": segundos,
+        "filas_por_seg": filas / segundos if segundos else float("inf"),
+        **extra,
+    }
+    with _lock_ingesta:
+        _ultima_ingesta = ingesta
+
+
+def _completar_ingesta(**extra):
+    global _ultima_ingesta
+    with _lock_ingesta:
+        _ultima_ingesta = {**_ultima_ingesta, **extra}
+
+
+def obtener_ultima_ingesta():
+    with _lock_ingesta:
+        return _ultima_ingesta
+
+
+def leer_excel_streaming(ruta_xlsx, filas_iniciales=65536):
+    # Lee la hoja fila por fila (openpyxl en modo read_only) y llena buffers tipados
+    # preasignados; así no se carga el modelo completo del libro en memoria
+    inicio = time.perf_counter()
+    libro, columnas, filas, declaradas = _abrir_hoja(ruta_xlsx)
+    try:
+        if not columnas:
+            return pd.DataFrame()
+        df = _llenar_buffers(columnas, _filas_no_vacias(filas), declaradas or filas_iniciales)
+    finally:
+        libro.close()
+
+    _registrar_ingesta("streaming", len(df), inicio)
+    return df
+
+
+def _dir_meses():
+    return CACHE_DIR / "meses"
+
+
+# Versión del formato del almacén por mes; si cambia, los meses guardados no se reutilizan
+ESQUEMA_ALMACEN = 4
+
+
+def _clave_mes(valor):
+    if isinstance(valor, datetime.date):
+        return f"{valor.year:04d}-{valor.month:02d}"
+    fecha = _a_fecha(valor) if valor is not None else None
+    if fecha is None or pd.isna(fecha):
+        return "sin_fecha"
+    return f"{fecha.year:04d}-{fecha.month:02d}"
+
+
+def invalidar_almacen_mensual():
+    dir_meses = _dir_meses()
+    if not dir_meses.exists():
+        return 0
+    borrados = 0
+    for ruta in dir_meses.glob("*"):
+        ruta.unlink(missing_ok=True)
+        borrados += 1
+    return borrados
+
+
+def _nombre_local(etiqueta):
+    return etiqueta.rsplit("}", 1)[-1]
+
+
+def _relaciones(archivo, ruta_parte):
+    # {tipo: ruta dentro del zip} de las relaciones de una parte (ruta "" = el paquete)
+    carpeta, nombre = posixpath.split(ruta_parte)
+    ruta_rels = posixpath.join(carpeta, "_rels", f"{nombre}.rels")
+    if ruta_rels not in archivo.namelist():
+        return {}
+    relaciones = {}
+    for rel in ET.fromstring(archivo.read(ruta_rels)):
+        destino = rel.get("Target", "")
+        destino = destino.lstrip("/") if destino.startswith("/") else posixpath.normpath(posixpath.join(carpeta, destino))
+        relaciones.setdefault(rel.get("Type", "").rsplit("/", 1)[-1], []).append((rel.get("Id"), destino))
+    return relaciones
+
+
+def _partes_libro(archivo):
+    # Rutas de la primera hoja, de los textos compartidos y de los estilos, y la época del libro,
+    # leídas de workbook.xml y sus relaciones (sin depender de la API interna de openpyxl)
+    ruta_libro = _relaciones(archivo, "").get("officeDocument", [(None, "xl/workbook.xml")])[0][1]
+    relaciones = _relaciones(archivo, ruta_libro)
+    por_id = {id_rel: destino for destinos in relaciones.values() for id_rel, destino in destinos}
+    ruta_hoja, fecha1904 = None, False
+    for elemento in ET.fromstring(archivo.read(ruta_libro)).iter():
+        nombre = _nombre_local(elemento.tag)
+        if nombre == "workbookPr":
+            fecha1904 = elemento.get("date1904", "0").lower() in ("1", "true")
+        elif nombre == "sheet" and ruta_hoja is None:
+            id_rel = next((valor for atributo, valor in elemento.attrib.items() if _nombre_local(atributo) == "id"), None)
+            ruta_hoja = por_id.get(id_rel)
+    ruta_textos = relaciones.get("sharedStrings", [(None, None)])[0][1]
+    ruta_estilos = relaciones.get("styles", [(None, None)])[0][1]
+    return ruta_hoja, ruta_textos, ruta_estilos, fecha1904
+
+
+def _contexto_libro(archivo, ruta_estilos, fecha1904):
+    # Además de los bytes de cada fila, cómo se leen depende de los estilos (formatos de fecha)
+    # y de la época del libro
+    h = hashlib.blake2b(digest_size=16)
+    h.update(b"1904" if fecha1904 else b"1900")
+    if ruta_estilos in archivo.namelist():
+        h.update(archivo.read(ruta_estilos))
+    return h.hexdigest()
+
+
+def _huella_textos(archivo, ruta_textos, n_previo):
+    # Recorre los textos compartidos y devuelve (cantidad, hash de los primeros n_previo, hash de
+    # todos). Si los primeros n_previo siguen iguales, los índices que usan las filas viejas apuntan
+    # a los mismos textos aunque el archivo haya agregado otros al final
+    h = hashlib.blake2b(digest_size=16)
+    n, prefijo = 0, h.hexdigest() if n_previo == 0 else None
+    if ruta_textos in archivo.namelist():
+        with archivo.open(ruta_textos) as origen:
+            for _, elemento in ET.iterparse(origen):
+                if _nombre_local(elemento.tag) != "si":
+                    continue
+                h.update(ET.tostring(elemento))
+                elemento.clear()
+                n += 1
+                if n == n_previo:
+                    prefijo = h.hexdigest()
+    return n, prefijo, h.hexdigest()
+
+
+def _tramos_hoja(archivo, ruta_hoja, cortes):
+    # Recorre el XML de la hoja sin parsearlo. Los tramos van desde la primera fila después del
+    # encabezado hasta la fila de cada corte (números de fila, en orden) y el último hasta el final.
+    # Devuelve (bytes donde empieza cada tramo, hash de cada tramo). Si una fila de corte no está,
+    # su tramo y los siguientes quedan fuera y el tramo anterior se extiende hasta el final.
+    # Excel, openpyxl y XlsxWriter escriben r como primer atributo de <row>
+    marcas = iter([b'<row r="1"', b"<row", *(b'<row r="%d"' % corte for corte in cortes)])
+    marca = next(marcas)
+    es_encabezado = True
+    desplazamientos, hashes = [], []
+    hasher = None
+    base, desde, resto = 0, 0, b""
+    with archivo.open(ruta_hoja) as origen:
+        for bloque in iter(lambda: origen.read(TAM_BLOQUE), b""):
+            buf = resto + bloque
+            # Una marca que empieza antes del último "<" está completa en buf
+            seguro = buf.rfind(b"<")
+            pos = 0
+            while marca is not None:
+                encontrado = buf.find(marca, desde, seguro)
+                if encontrado == -1:
+                    break
+                if hasher is not None:
+                    hasher.update(buf[pos:encontrado])
+                    hashes.append(hasher.hexdigest())
+                if not es_encabezado:
+                    hasher = hashlib.blake2b(digest_size=16)
+                    desplazamientos.append(base + encontrado)
+                es_encabezado = False
+                pos, desde = encontrado, encontrado + 1
+                marca = next(marcas, None)
+            if hasher is not None:
+                hasher.update(buf[pos:max(seguro, pos)])
+            corte = max(seguro, pos) if hasher is not None else max(seguro, 0)
+            base += corte
+            desde = max(desde - corte, 0)
+            resto = buf[corte:]
+    if hasher is not None:
+        hasher.update(resto)
+        hashes.append(hasher.hexdigest())
+    return desplazamientos, hashes
+
+
+def _libro_con_tramos(archivo, ruta_hoja, rangos):
+    # Copia en memoria del libro donde la hoja solo conserva los bytes de `rangos` (pares
+    # [desde, hasta) en orden; hasta None = hasta el final). Las filas que quedan mantienen sus
+    # números originales (openpyxl completa las que faltan con filas vacías)
+    salida = io.BytesIO()
+    with zipfile.ZipFile(salida, "w") as copia:
+        for info in archivo.infolist():
+            if info.filename != ruta_hoja:
+                copia.writestr(info, archivo.read(info.filename))
+                continue
+            # Sin comprimir: la copia vive solo en memoria mientras se lee
+            with archivo.open(ruta_hoja) as origen, copia.open(ruta_hoja, "w") as destino:
+                posicion = 0
+                for bloque in iter(lambda: origen.read(TAM_BLOQUE), b""):
+                    fin = posicion + len(bloque)
+                    for desde, hasta in rangos:
+                        hasta = fin if hasta is None else hasta
+                        if desde < fin and hasta > posicion:
+                            destino.write(bloque[max(desde - posicion, 0):min(hasta, fin) - posicion])
+                    posicion = fin
+    salida.seek(0)
+    return salida
+
+
+def _leer_meses(origen, columnas):
+    # Filas de datos agrupadas por mes de FECHA, en el orden del archivo: lista de (mes, número de
+    # su primera fila, DataFrame ya normalizado, bytes antes de normalizar). None si un mes vuelve
+    # a aparecer después de otro (el archivo no viene agrupado por mes)
+    pos_fecha = columnas.index("FECHA")
+    libro, _, filas, _ = _abrir_hoja(origen)
+    meses = []
+    mes_abierto, numero_inicio, filas_mes = None, None, []
+
+    def cerrar_mes():
+        df_mes, memoria_antes, _ = normalizar_tipos(_llenar_buffers(columnas, filas_mes, len(filas_mes)))
+        meses.append((mes_abierto, numero_inicio, df_mes, memoria_antes))
+
+    try:
+        # El encabezado ya se leyó; openpyxl devuelve una fila por número, vacías incluidas
+        for numero, fila in enumerate(filas, start=2):
+            if not fila or all(v is None for v in fila):
+                continue
+            mes = _clave_mes(fila[pos_fecha] if len(fila) > pos_fecha else None)
+            if mes != mes_abierto:
+                if mes_abierto is not None:
+                    cerrar_mes()
+                if any(mes == anterior for anterior, _, _, _ in meses):
+                    return None
+                mes_abierto, numero_inicio, filas_mes = mes, numero, []
+            filas_mes.append(fila)
+        if mes_abierto is not None:
+            cerrar_mes()
+    finally:
+        libro.close()
+    return meses
+
+
+def _unir_meses(partes, columnas):
+    # Cada mes guarda sus dimensiones como category con sus propias categorías: se pasan a la unión
+    # ordenada antes de concatenar, así el resultado queda igual que normalizando el archivo entero
+    if not partes:
+        return pd.DataFrame(columns=columnas)
+    for col in COLUMNAS_DIMENSION:
+        if not all(col in parte.columns and isinstance(parte[col].dtype, pd.CategoricalDtype) for parte in partes):
+            continue
+        categorias = sorted(set().union(*(parte[col].cat.categories for parte in partes)))
+        partes = [parte.assign(**{col: parte[col].cat.set_categories(categorias)}) for parte in partes]
+    df = pd.concat(partes, ignore_index=True)
+    # Las medidas se vuelven a reducir sobre el total (un mes puede haber quedado en float64)
+    df, _, _ = normalizar_tipos(df)
+    return df
+
+
+def leer_excel_incremental(ruta_xlsx, clave):
+    # Almacén con un parquet por mes de FECHA, ya con los tipos normalizados, y un índice con el hash
+    # de los bytes de las filas de cada mes en el XML de la hoja. Cada carga recorre el XML sin
+    # parsearlo y decodifica con openpyxl solo los meses cuyo hash cambió (y el último, porque puede
+    # haber crecido); el resto se lee del almacén tal cual.
+    # Devuelve None si no se puede usar el almacén (sin FECHA o archivo no agrupado por mes)
+    inicio = time.perf_counter()
+    dir_meses = _dir_meses()
+    dir_meses.mkdir(parents=True, exist_ok=True)
+    ruta_indice = dir_meses / "indice.json"
+    indice = _leer_metadatos(ruta_indice)
+    if indice.get("esquema") != ESQUEMA_ALMACEN:
+        indice = {}
+    previos = indice.get("meses", [])
+    rutas_previas = [dir_meses / f"{mes['mes']}.parquet" for mes in previos]
+
+    # Mismo archivo que la última carga: los meses guardados ya son el dataset
+    if indice.get("archivo") == clave and all(ruta.exists() for ruta in rutas_previas):
+        df = _unir_meses([pd.read_parquet(ruta) for ruta in rutas_previas], indice["columnas"])
+        _registrar_ingesta(
+            "incremental", len(df), inicio, meses_reingestados=0, meses_totales=len(previos),
+            memoria_antes=sum(mes["memoria_antes"] for mes in previos),
+            memoria_despues=int(df.memory_usage(deep=True).sum()),
+        )
+        return df
+
+    libro, columnas, _, _ = _abrir_hoja(ruta_xlsx)
+    libro.close()
+    if "FECHA" not in columnas:
+        return None
+
+    with zipfile.ZipFile(ruta_xlsx) as archivo:
+        ruta_hoja, ruta_textos, ruta_estilos, fecha1904 = _partes_libro(archivo)
+        if ruta_hoja is None:
+            return None
+        contexto = _contexto_libro(archivo, ruta_estilos, fecha1904)
+        n_textos, prefijo_textos, hash_textos = _huella_textos(archivo, ruta_textos, indice.get("n_textos", 0))
+        # Otro encabezado, otros estilos o textos compartidos reordenados: todos los meses cambiaron
+        if (indice.get("columnas") != columnas or indice.get("contexto") != contexto
+                or prefijo_textos != indice.get("hash_textos")):
+            previos = []
+
+        desplazamientos, hashes = _tramos_hoja(archivo, ruta_hoja, [mes["desde"] for mes in previos[1:]])
+        # El último tramo encontrado llega hasta el final del archivo: siempre se vuelve a leer
+        conservados = {
+            i for i in range(min(len(previos), len(hashes)) - 1)
+            if hashes[i] == previos[i]["hash"] and rutas_previas[i].exists()
+        }
+
+        if conservados:
+            # Encabezado de la hoja más los tramos que cambiaron; el último incluye el cierre del XML
+            rangos = [(0, desplazamientos[0])] + [
+                (desplazamientos[i], desplazamientos[i + 1] if i + 1 < len(hashes) else None)
+                for i in range(len(hashes)) if i not in conservados
+            ]
+            nuevos = _leer_meses(_libro_con_tramos(archivo, ruta_hoja, rangos), columnas)
+        else:
+            nuevos = _leer_meses(ruta_xlsx, columnas)
+        previos = [previos[i] for i in sorted(conservados)]
+        if nuevos is None or {mes for mes, _, _, _ in nuevos} & {mes["mes"] for mes in previos}:
+            return None
+
+        # Se guarda cuánto ocupaba cada mes antes de normalizar para informar la memoria sin releerlo
+        meses = sorted(
+            previos + [{"mes": mes, "desde": numero, "memoria_antes": antes} for mes, numero, _, antes in nuevos],
+            key=lambda mes: mes["desde"],
+        )
+        _, hashes = _tramos_hoja(archivo, ruta_hoja, [mes["desde"] for mes in meses[1:]])
+        for mes, hash_tramo in zip(meses, hashes):
+            mes["hash"] = hash_tramo
+
+    leidos = {}
+    for mes, _, df_mes, _ in nuevos:
+        _escribir_parquet(df_mes, dir_meses / f"{mes}.parquet")
+        leidos[mes] = df_mes
+    vigentes = {f"{mes['mes']}.parquet" for mes in meses}
+    for ruta in dir_meses.glob("*.parquet"):
+        if ruta.name not in vigentes:
+            ruta.unlink(missing_ok=True)
+
+    partes = [leidos[mes["mes"]] if mes["mes"] in leidos else pd.read_parquet(dir_meses / f"{mes['mes']}.parquet")
+              for mes in meses]
+    df = _unir_meses(partes, columnas)
+    ruta_indice.write_text(json.dumps({
+        "esquema": ESQUEMA_ALMACEN, "archivo": clave, "columnas": columnas, "contexto": contexto,
+        "n_textos": n_textos, "hash_textos": hash_textos, "meses": meses,
+    }))
+    _registrar_ingesta(
+        "incremental", len(df), inicio, meses_reingestados=len(nuevos), meses_totales=len(meses),
+        memoria_antes=sum(mes["memoria_antes"] for mes in meses),
+        memoria_despues=int(df.memory_usage(deep=True).sum()),
+    )
+    return df
+
+
+def _float32_sin_perdida(serie):
+    convertida = serie.astype("float32")
+    iguales = (convertida.astype("float64") == serie) | serie.isna()
+    return convertida if iguales.all() else serie
+
+
+def normalizar_tipos(df):
+    # Dimensiones a category (categorías ordenadas para que los códigos sean estables entre cargas)
+    # y medidas numéricas reducidas solo si el valor no cambia. Devuelve (df, bytes antes, bytes después)
+    memoria_antes = int(df.memory_usage(deep=True).sum())
+    df = df.copy()
+
+    for col in COLUMNAS_DIMENSION:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            valores = df[col].where(df[col].isna(), df[col].astype(str))
+            categorias = sorted(valores.dropna().unique())
+            df[col] = pd.Categorical(valores, categories=categorias)
+
+    for col in df.select_dtypes(include="number").columns:
+        if col in COLUMNAS_MONTO:
+            continue
+        serie = df[col]
+        if pd.api.types.is_integer_dtype(serie):
+            df[col] = pd.to_numeric(serie, downcast="integer")
+        elif serie.dtype == "float64":
+            df[col] = _float32_sin_perdida(serie)
+
+    memoria_despues = int(df.memory_usage(deep=True).sum())
+    return df, memoria_antes, memoria_despues
+
+
+def leer_excel_con_snapshot(ruta_xlsx, clave=None, modo="streaming"):
+    # Si el archivo ya fue parseado antes, se lee el snapshot y se evita openpyxl
+    inicio = time.perf_counter()
+    if clave is None:
+        clave = hash_archivo(ruta_xlsx)
+
+    # modo: "incremental" (almacén por mes), "streaming" (fila por fila) o "pandas" (read_excel).
+    # El almacén por mes ya guarda cada mes normalizado y hace de snapshot; si el archivo no se
+    # puede leer por mes se sigue como streaming
+    if modo == "incremental":
+        df = leer_excel_incremental(ruta_xlsx, clave)
+        if df is not None:
+            return df, clave
+        modo = "streaming"
+
+    df = leer_snapshot(clave, modo)
+    if df is not None:
+        # Del snapshot solo se conoce la memoria ya normalizada
+        _registrar_ingesta("snapshot", len(df), inicio, memoria_despues=int(df.memory_usage(deep=True).sum()))
+        return df, clave
+
+    if modo == "streaming":
+        df = leer_excel_streaming(ruta_xlsx)
+    else:
+        df = pd.read_excel(ruta_xlsx, engine="openpyxl")
+
+    # El snapshot se guarda ya normalizado, así la próxima lectura sale con los tipos compactos
+    df, memoria_antes, memoria_despues = normalizar_tipos(df)
+    _completar_ingesta(memoria_antes=memoria_antes, memoria_despues=memoria_despues)
+    try:
+        guardar_snapshot(df, clave, modo)
+    except Exception:
+        # Si no se puede escribir el snapshot se sigue con el DataFrame en memoria
+        pass
+    return df, clave
+
+
+def ruta_particionado(version):
+    return CACHE_DIR / "particionado" / version
+
+
+def escribir_dataset_particionado(df, version):
+    # Dataset parquet particionado por MES (AAAA-MM) y JEFE_AREA, para que cada vista lea
+    # solo los archivos que necesita. Se guarda una carpeta por versión y se borran las anteriores
+    destino = ruta_particionado(version)
+    if destino.exists():
+        return destino
+    base = destino.parent
+    base.mkdir(parents=True, exist_ok=True)
+
+    tmp = Path(tempfile.mkdtemp(prefix=".tmp_", dir=base))
+    try:
+        # _FILA guarda el orden original para devolver las filas igual que en el DataFrame completo
+        datos = df.assign(
+            MES=df["FECHA"].dt.strftime("%Y-%m").fillna("sin_fecha"),
+            _FILA=np.arange(len(df)),
+        )
+        datos.to_parquet(tmp, partition_cols=["MES", "JEFE_AREA"], index=False)
+        os.replace(tmp, destino)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for otra in base.iterdir():
+        if otra != destino and not otra.name.startswith(".tmp_"):
+            shutil.rmtree(otra, ignore_errors=True)
+    return destino
+
+
+def leer_particiones(version, meses=None, jefe=None, referencia=None):
+    # Lectura con filtros sobre las particiones: solo se abren los archivos de esos meses / ese jefe.
+    # `referencia` (los dtypes del DataFrame completo) deja las columnas en el mismo orden y tipo
+    filtros = []
+    if meses is not None:
+        filtros.append(("MES", "in", [str(m) for m in meses]))
+    if jefe is not None:
+        filtros.append(("JEFE_AREA", "==", jefe))
+    datos = pd.read_parquet(ruta_particionado(version), filters=filtros or None)
+    datos = datos.sort_values("_FILA").drop(columns=["MES", "_FILA"]).reset_index(drop=True)
+    if referencia is not None:
+        datos = datos[list(referencia.index)].astype(referencia.to_dict())
+    return datos
+
+
+def meses_particionados(version):
+    # Meses (AAAA-MM, o "sin_fecha") que tienen archivos en el dataset particionado
+    return sorted(ruta.name.split("=", 1)[1] for ruta in ruta_particionado(version).glob("MES=*"))
+
+
+COLUMNAS_REQUERIDAS = ["FECHA", "JEFE_AREA", "LOCAL", "SECTOR", "Valor de Vtas:", "Valor de Stock:"]
+
+
+def validar_dataset(df):
+    # Antes de reemplazar los datos en uso se verifica que el archivo nuevo sea utilizable
+    faltantes = [col for col in COLUMNAS_REQUERIDAS if col not in df.columns]
+    if faltantes:
+        raise ValueError(f"Faltan columnas en el archivo: {', '.join(faltantes)}")
+    if df.empty:
+        raise ValueError("El archivo no tiene filas")
+    if not pd.api.types.is_datetime64_any_dtype(df["FECHA"]):
+        raise ValueError("La columna FECHA no tiene fechas válidas")
+
+
+def cargar_dataset(url, modo="incremental", particionado=False):
+    # Descarga + lectura + validación, sin nada de Streamlit para poder correr en un hilo aparte
+    ruta_xlsx, clave, _ = descargar_archivo(url)
+    df, clave = leer_excel_con_snapshot(ruta_xlsx, clave, modo)
+    validar_dataset(df)
+    if particionado:
+        escribir_dataset_particionado(df, clave)
+        # Las secciones leen de las particiones: en memoria queda solo el esquema (columnas y tipos,
+        # con las categorías completas) para leerlas con los mismos dtypes
+        df = df.iloc[0:0].copy()
+    return df, clave
@@ -1,6 +1,7 @@
-import pandas as pd
 import streamlit as st
 
+from informe import categorias_que_bajaron
+
 def mostrar_comparativos_variacion(  
     tabla_ventas_mensual,
     tabla_margen_mensual,
@@ -8,9 +9,9 @@ def mostrar_comparativos_variacion(
     tabla_ventas_anual,
     tabla_margen_anual,
     tabla_utilidad_anual,
-    formatear_guaranies,
-    formatear_porcentaje,
-    generar_excel
+    formatear_columna_guaranies,
+    formatear_columna_porcentaje,
+    boton_descarga
 ):
     
     df = st.session_state.get("df")
@@ -25,49 +26,47 @@ def mostrar_comparativos_variacion(
             return
 
         tabla_mostrar = tabla.copy()
-        tabla_mostrar = tabla.copy()
 
         if "variacion_%" in tabla_mostrar:
-            tabla_mostrar["variacion_%"] = tabla_mostrar["variacion_%"].map(formatear_porcentaje)
+            tabla_mostrar["variacion_%"] = formatear_columna_porcentaje(tabla_mostrar["variacion_%"])
 
         if "utilidad_actual" in tabla_mostrar:
-            tabla_mostrar["utilidad_actual"] = tabla_mostrar["utilidad_actual"].map(formatear_guaranies)
+            tabla_mostrar["utilidad_actual"] = formatear_columna_guaranies(tabla_mostrar["utilidad_actual"])
 
         if "utilidad_anterior" in tabla_mostrar:
-            tabla_mostrar["utilidad_anterior"] = tabla_mostrar["utilidad_anterior"].map(formatear_guaranies)
+            tabla_mostrar["utilidad_anterior"] = formatear_columna_guaranies(tabla_mostrar["utilidad_anterior"])
 
         if "margen_actual" in tabla_mostrar:
-            tabla_mostrar["margen_actual"] = tabla_mostrar["margen_actual"].map(formatear_porcentaje)
+            tabla_mostrar["margen_actual"] = formatear_columna_porcentaje(tabla_mostrar["margen_actual"])
 
         if "margen_anterior" in tabla_mostrar:
-            tabla_mostrar["margen_anterior"] = tabla_mostrar["margen_anterior"].map(formatear_porcentaje)
+            tabla_mostrar["margen_anterior"] = formatear_columna_porcentaje(tabla_mostrar["margen_anterior"])
 
         if "ventas_mes_actual" in tabla_mostrar:
-            tabla_mostrar["ventas_mes_actual"] = tabla_mostrar["ventas_mes_actual"].map(formatear_guaranies)
+            tabla_mostrar["ventas_mes_actual"] = formatear_columna_guaranies(tabla_mostrar["ventas_mes_actual"])
 
         if "ventas_mes_anterior" in tabla_mostrar:
-            tabla_mostrar["ventas_mes_anterior"] = tabla_mostrar["ventas_mes_anterior"].map(formatear_guaranies)
+            tabla_mostrar["ventas_mes_anterior"] = formatear_columna_guaranies(tabla_mostrar["ventas_mes_anterior"])
         if "ventas_anio_actual" in tabla_mostrar:
-            tabla_mostrar["ventas_anio_actual"] = tabla_mostrar["ventas_anio_actual"].map(formatear_guaranies)
+            tabla_mostrar["ventas_anio_actual"] = formatear_columna_guaranies(tabla_mostrar["ventas_anio_actual"])
         if "ventas_anio_anterior" in tabla_mostrar:
-            tabla_mostrar["ventas_anio_anterior"] = tabla_mostrar["ventas_anio_anterior"].map(formatear_guaranies)
+            tabla_mostrar["ventas_anio_anterior"] = formatear_columna_guaranies(tabla_mostrar["ventas_anio_anterior"])
         if "diferencia" in tabla_mostrar:
-            tabla_mostrar["diferencia"] = tabla_mostrar["diferencia"].map(formatear_guaranies)
+            tabla_mostrar["diferencia"] = formatear_columna_guaranies(tabla_mostrar["diferencia"])
         if "ventas_actual" in tabla_mostrar:
-            tabla_mostrar["ventas_actual"] = tabla_mostrar["ventas_actual"].map(formatear_guaranies)
+            tabla_mostrar["ventas_actual"] = formatear_columna_guaranies(tabla_mostrar["ventas_actual"])
         if "margen_anio_anterior" in tabla_mostrar:
-            tabla_mostrar["margen_anio_anterior"] = tabla_mostrar["margen_anio_anterior"].map(formatear_porcentaje)
+            tabla_mostrar["margen_anio_anterior"] = formatear_columna_porcentaje(tabla_mostrar["margen_anio_anterior"])
         if "utilidad_anio_anterior" in tabla_mostrar:
-            tabla_mostrar["utilidad_anio_anterior"] = tabla_mostrar["utilidad_anio_anterior"].map(formatear_guaranies)
+            tabla_mostrar["utilidad_anio_anterior"] = formatear_columna_guaranies(tabla_mostrar["utilidad_anio_anterior"])
 
         st.subheader(f"{tipo} de {nombre}")
         st.dataframe(tabla_mostrar, use_container_width=True)
 
-        st.download_button(
-            label=f"⬇️ Descargar {tipo.lower()} de {nombre}",
-            data=generar_excel(tabla),
-            file_name=f"{tipo.lower()}_{nombre.lower().replace(' ', '_')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        # Una hoja con nombre propio por tabla, p. ej. "Disminución Utilidad (mensual)" (máx. 31 caracteres)
+        boton_descarga(
+            f"⬇️ Descargar {tipo.lower()} de {nombre}", tabla, f"{tipo} {nombre}"[:31],
+            f"{tipo.lower()}_{nombre.lower().replace(' ', '_')}"
         )
 
     with st.expander("📆 Comparativo Mensual", expanded=True):
@@ -94,36 +93,20 @@ def mostrar_comparativos_variacion(
 
     # --- NUEVA TABLA: Categorías generales que han bajado respecto al año anterior ---
     st.subheader("Categorías generales que han bajado en ventas respecto al año anterior")
-    # Filtrar las que bajaron
-    categorias_bajaron = tabla_ventas_anual[tabla_ventas_anual["ventas_actual"] < tabla_ventas_anual["ventas_anio_anterior"]].copy()
-    # Unir con ventas mes anterior
-    ventas_mes_ant = tabla_ventas_mensual[["LOCAL", "SECTOR", "SUBSECTOR", "MARCA", "ventas_mes_anterior"]].copy()
-    categorias_bajaron = categorias_bajaron.merge(ventas_mes_ant, on=["LOCAL", "SECTOR", "SUBSECTOR", "MARCA"], how="left")
-    # Unir con margen actual y margen año anterior
-    margen_actual = tabla_margen_anual[["LOCAL", "SECTOR", "SUBSECTOR", "MARCA", "margen_actual", "margen_anio_anterior"]].copy()
-    categorias_bajaron = categorias_bajaron.merge(margen_actual, on=["LOCAL", "SECTOR", "SUBSECTOR", "MARCA"], how="left")
-    # Unir con margen mes anterior
-    margen_mes_ant = tabla_margen_mensual[["LOCAL", "SECTOR", "SUBSECTOR", "MARCA", "margen_anterior"]].copy()
-    categorias_bajaron = categorias_bajaron.merge(margen_mes_ant, on=["LOCAL", "SECTOR", "SUBSECTOR", "MARCA"], how="left")
-    # Seleccionar y renombrar columnas para mostrar
-    cols = [
-        "LOCAL", "SECTOR", "SUBSECTOR", "MARCA",
-        "ventas_actual", "ventas_mes_anterior", "ventas_anio_anterior",
-        "margen_actual", "margen_mes_anterior", "margen_anio_anterior"
-    ]
-    categorias_bajaron = categorias_bajaron.rename(columns={"margen_anterior": "margen_mes_anterior"})
-    categorias_bajaron = categorias_bajaron[cols]
-    # Formatear
-    categorias_bajaron["ventas_actual"] = categorias_bajaron["ventas_actual"].map(formatear_guaranies)
-    categorias_bajaron["ventas_mes_anterior"] = categorias_bajaron["ventas_mes_anterior"].map(formatear_guaranies)
-    categorias_bajaron["ventas_anio_anterior"] = categorias_bajaron["ventas_anio_anterior"].map(formatear_guaranies)
-    categorias_bajaron["margen_actual"] = categorias_bajaron["margen_actual"].map(formatear_porcentaje)
-    categorias_bajaron["margen_mes_anterior"] = categorias_bajaron["margen_mes_anterior"].map(formatear_porcentaje)
-    categorias_bajaron["margen_anio_anterior"] = categorias_bajaron["margen_anio_anterior"].map(formatear_porcentaje)
-    st.dataframe(categorias_bajaron, use_container_width=True)
-    st.download_button(
-        label="⬇️ Descargar categorías que bajaron",
-        data=generar_excel(categorias_bajaron, "Categorias Bajaron"),
-        file_name="categorias_bajaron_ventas.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    # Menos ventas que el mismo mes del año anterior, con ventas del mes anterior y márgenes
+    categorias_bajaron = categorias_que_bajaron(
+        tabla_ventas_mensual, tabla_margen_mensual, tabla_ventas_anual, tabla_margen_anual
+    )
+    # Formatear una copia: la descarga lleva los valores crudos
+    categorias_mostrar = categorias_bajaron.copy()
+    categorias_mostrar["ventas_actual"] = formatear_columna_guaranies(categorias_mostrar["ventas_actual"])
+    categorias_mostrar["ventas_mes_anterior"] = formatear_columna_guaranies(categorias_mostrar["ventas_mes_anterior"])
+    categorias_mostrar["ventas_anio_anterior"] = formatear_columna_guaranies(categorias_mostrar["ventas_anio_anterior"])
+    categorias_mostrar["margen_actual"] = formatear_columna_porcentaje(categorias_mostrar["margen_actual"])
+    categorias_mostrar["margen_mes_anterior"] = formatear_columna_porcentaje(categorias_mostrar["margen_mes_anterior"])
+    categorias_mostrar["margen_anio_anterior"] = formatear_columna_porcentaje(categorias_mostrar["margen_anio_anterior"])
+    st.dataframe(categorias_mostrar, use_container_width=True)
+    boton_descarga(
+        "⬇️ Descargar categorías que bajaron", categorias_bajaron, "Categorias Bajaron",
+        "categorias_bajaron_ventas"
     )
@@ -0,0 +1,268 @@
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+
+# Formatos de número nativos de Excel: el archivo guarda el valor y Excel lo muestra con los
+# separadores de miles y decimales del equipo
+FORMATOS_NUMERO = {
+    "guaranies": '"₲" #,##0',
+    "porcentaje": "0.00%",
+    "numero": "#,##0.00",
+    "entero": "#,##0",
+}
+FORMATO_FECHA = "dd/mm/yyyy"
+
+# Formatos de descarga: extensión del archivo y tipo MIME
+FORMATOS_EXPORTACION = {
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("csv", "text/csv"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+def tipo_de_columna(nombre):
+    # Formato de una columna según su nombre (las de los informes y las del dataset)
+    nombre = str(nombre).lower()
+    if "%" in nombre or "margen" in nombre or "variacion" in nombre:
+        return "porcentaje"
+    if nombre.startswith(("valor", "costo", "ventas", "utilidad", "diferencia")):
+        return "guaranies"
+    if "meses" in nombre:
+        return "numero"
+    if "dias" in nombre or "días" in nombre:
+        return "entero"
+    return None
+
+
+def _con_indice(df):
+    # El índice solo se exporta si tiene nombre (pivots, agrupados); un índice de posiciones no aporta
+    if any(nombre is not None for nombre in df.index.names):
+        return df.reset_index()
+    return df.reset_index(drop=True)
+
+
+# Día 0 de las fechas de Excel (serie 1900, contando el 29/02/1900 que Excel cree que existe)
+_EPOCA_EXCEL = pd.Timestamp("1899-12-30")
+
+
+def _valores_columna(serie):
+    # (tipo de celda, lista de valores con None en los vacíos). Las fechas pasan a número de serie
+    # de Excel de una vez para toda la columna, en lugar de convertir cada celda
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        numeros = ((serie.dt.tz_localize(None) if serie.dt.tz else serie) - _EPOCA_EXCEL) / pd.Timedelta(days=1)
+        numeros = numeros.to_numpy(dtype="float64", na_value=np.nan)
+        valores = numeros.astype(object)
+        valores[~np.isfinite(numeros)] = None
+        return "fecha", valores.tolist()
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        numeros = serie.to_numpy(dtype="float64", na_value=np.nan)
+        valores = numeros.astype(object)
+        valores[~np.isfinite(numeros)] = None
+        return "numero", valores.tolist()
+    valores = serie.astype(object).to_numpy(copy=True)
+    valores[pd.isna(valores)] = None
+    return "texto", valores.tolist()
+
+
+def _formatos_libro(libro):
+    return {
+        "negrita": libro.add_format({"bold": True}),
+        "fecha": libro.add_format({"num_format": FORMATO_FECHA}),
+        **{tipo: libro.add_format({"num_format": formato}) for tipo, formato in FORMATOS_NUMERO.items()},
+    }
+
+
+def _escribir_hoja(libro, formatos, nombre_hoja, df, tipo_valores=None):
+    # Los números van crudos con formato nativo (₲, %, fechas); tipo_valores es el formato de las
+    # columnas numéricas que no se reconocen por nombre (pivots)
+    tabla = _con_indice(df)
+    hoja = libro.add_worksheet(nombre_hoja[:31])
+
+    def escribir_texto(fila, columna, valor, formato):
+        if isinstance(valor, (int, float, np.number)) and not isinstance(valor, bool):
+            hoja.write_number(fila, columna, valor, formato)
+        else:
+            hoja.write_string(fila, columna, str(valor))
+
+    escritores = {"fecha": hoja.write_number, "numero": hoja.write_number, "texto": escribir_texto}
+    columnas = []
+    for posicion, nombre in enumerate(tabla.columns):
+        tipo_celda, valores = _valores_columna(tabla[nombre])
+        if tipo_celda == "fecha":
+            formato = formatos["fecha"]
+        else:
+            formato = formatos.get(tipo_de_columna(nombre) or tipo_valores)
+        columnas.append((escritores[tipo_celda], formato, valores))
+        hoja.set_column(posicion, posicion, min(max(len(str(nombre)) + 2, 12), 40))
+
+    hoja.write_row(0, 0, [str(nombre) for nombre in tabla.columns], formatos["negrita"])
+    hoja.freeze_panes(1, 0)
+    escribir_columnas = [(escribir, formato) for escribir, formato, _ in columnas]
+    for fila, valores_fila in enumerate(zip(*(valores for _, _, valores in columnas)), start=1):
+        for columna, (valor, (escribir, formato)) in enumerate(zip(valores_fila, escribir_columnas)):
+            if valor is not None:
+                escribir(fila, columna, valor, formato)
+
+
+def generar_excel(df, nombre_hoja="Resumen", tipo_valores=None):
+    # xlsxwriter en modo constant_memory: las filas se escriben en orden y se vuelcan a disco, sin
+    # armar la hoja entera en memoria
+    salida = io.BytesIO()
+    libro = xlsxwriter.Workbook(salida, {"constant_memory": True})
+    _escribir_hoja(libro, _formatos_libro(libro), nombre_hoja, df, tipo_valores)
+    libro.close()
+    return salida.getvalue()
+
+
+def generar_libro(pasos, progreso):
+    # Un libro con una hoja por paso (nombre, función que arma la tabla, tipo_valores). Cada tabla
+    # se calcula justo antes de escribir su hoja; progreso lleva hojas hechas, total y la hoja actual.
+    # En constant_memory cada hoja se vuelca a disco al pasar a la siguiente
+    salida = io.BytesIO()
+    libro = xlsxwriter.Workbook(salida, {"constant_memory": True})
+    formatos = _formatos_libro(libro)
+    progreso.update(hechas=0, total=len(pasos))
+    for nombre_hoja, armar, tipo_valores in pasos:
+        progreso["etapa"] = nombre_hoja
+        _escribir_hoja(libro, formatos, nombre_hoja, armar(), tipo_valores)
+        progreso["hechas"] += 1
+    progreso["etapa"] = "Cerrando el archivo"
+    libro.close()
+    return salida.getvalue()
+
+
+def generar_csv(df, nombre_hoja=None, tipo_valores=None):
+    # Separador ";" y coma decimal como lo abre Excel en español; BOM para que reconozca UTF-8
+    return _con_indice(df).to_csv(index=False, sep=";", decimal=",", date_format="%d/%m/%Y").encode("utf-8-sig")
+
+
+def generar_parquet(df, nombre_hoja=None, tipo_valores=None):
+    # Las columnas de objetos (mezcla de textos y números, como las filas de totales) van como texto
+    tabla = _con_indice(df)
+    objetos = tabla.select_dtypes(include="object").columns
+    tabla = tabla.astype({columna: "str" for columna in objetos})
+    salida = io.BytesIO()
+    tabla.to_parquet(salida, index=False)
+    return salida.getvalue()
+
+
+GENERADORES = {"xlsx": generar_excel, "csv": generar_csv, "parquet": generar_parquet}
+
+
+def huella_tabla(df):
+    # Hash del contenido de la tabla (valores e índice fila por fila, más columnas y tipos):
+    # dos tablas iguales dan la misma huella aunque vengan de sesiones distintas
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((list(df.columns), [str(t) for t in df.dtypes], list(df.index.names))).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+class CacheExportaciones:
+    # Archivos ya exportados, compartidos por todas las sesiones y guardados por (huella de la tabla,
+    # hoja, formato). El total se limita en bytes y se desaloja el que se usó hace más tiempo.
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes_usados = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        # Última exportación generada (hoja, formato, filas, segundos, bytes)
+        self.ultima = None
+        self._archivos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, generar):
+        with self._lock:
+            datos = self._archivos.get(clave)
+            if datos is not None:
+                self._archivos.move_to_end(clave)
+                self.aciertos += 1
+                return datos
+            self.fallos += 1
+        # Se genera fuera del lock para no frenar las descargas de otras sesiones; si dos piden
+        # el mismo archivo a la vez se genera dos veces y se guarda uno
+        datos = generar()
+        with self._lock:
+            if clave not in self._archivos and len(datos) <= self.max_bytes:
+                self._archivos[clave] = datos
+                self.bytes_usados += len(datos)
+                while self.bytes_usados > self.max_bytes:
+                    _, viejo = self._archivos.popitem(last=False)
+                    self.bytes_usados -= len(viejo)
+                    self.desalojos += 1
+        return datos
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+                "archivos": len(self._archivos),
+                "bytes_usados": self.bytes_usados,
+                "max_bytes": self.max_bytes,
+                "ultima": self.ultima,
+            }
+
+    def registrar_exportacion(self, **datos):
+        with self._lock:
+            self.ultima = datos
+
+
+def exportar(cache, df, nombre_hoja="Resumen", formato="xlsx", tipo_valores=None):
+    def generar():
+        inicio = time.perf_counter()
+        datos = GENERADORES[formato](df, nombre_hoja, tipo_valores)
+        cache.registrar_exportacion(
+            hoja=nombre_hoja, formato=formato, filas=len(df),
+            segundos=time.perf_counter() - inicio, bytes=len(datos),
+        )
+        return datos
+
+    clave = (huella_tabla(df), nombre_hoja, formato, tipo_valores)
+    return cache.obtener(clave, generar)
+
+
+# Informe completo en armado o terminado: el futuro del hilo y su progreso (hechas, total, etapa)
+Trabajo = namedtuple("Trabajo", ["futuro", "progreso"])
+
+
+class GeneradorInformes:
+    # Arma libros de varias hojas en hilos aparte, para que la página siga respondiendo mientras
+    # tanto. Los trabajos se guardan por clave (mes, jefe) y se reutilizan hasta que cambia la
+    # versión de los datos; uno que falló se vuelve a lanzar al pedirlo de nuevo
+
+    def __init__(self, max_hilos=2):
+        self._ejecutor = ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="informes")
+        self._version = None
+        self._trabajos = {}
+        self._lock = threading.Lock()
+
+    def _vigentes(self, version):
+        if version != self._version:
+            self._version = version
+            self._trabajos = {}
+        return self._trabajos
+
+    def pedir(self, version, clave, pasos):
+        with self._lock:
+            trabajos = self._vigentes(version)
+            trabajo = trabajos.get(clave)
+            if trabajo is None or (trabajo.futuro.done() and trabajo.futuro.exception() is not None):
+                progreso = {"hechas": 0, "total": len(pasos), "etapa": "En espera"}
+                trabajo = Trabajo(self._ejecutor.submit(generar_libro, pasos, progreso), progreso)
+                trabajos[clave] = trabajo
+            return trabajo
+
+    def trabajo(self, version, clave):
+        with self._lock:
+            return self._vigentes(version).get(clave)
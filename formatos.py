@@ -0,0 +1,174 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+# Formato paraguayo ("₲ 1.234.567", "1.234,57", "12,34%"). Las funciones formatear_* son las de
+# siempre, de a un valor (para métricas y totales sueltos); las formatear_columna_* hacen lo mismo
+# sobre una Series o un DataFrame entero con operaciones de texto de NumPy, sin llamar a Python por celda
+
+
+def formatear_guaranies(valor):
+    try:
+        if pd.isna(valor):
+            return ""
+        return f"₲ {valor:,.0f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    except:
+        return valor
+
+def formatear_numero(valor):
+    try:
+        if pd.isna(valor):
+            return ""
+        return f"{valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    except:
+        return ""
+
+def formatear_porcentaje(valor):
+    valor = valor * 100
+    try:
+        if pd.isna(valor):
+            return ""
+        return f"{valor:.2f}%".replace(".", ",")
+    except:
+        return valor
+
+def formatear_numeroint(valor):
+    try:
+        if pd.isna(valor):
+            return ""
+        return f"{valor:,.0f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    except:
+        return valor
+
+
+# Arriba de esto un float ya no tiene todos los enteros exactos
+_MAXIMO_EXACTO = 2.0 ** 53
+
+
+def _valores(valores):
+    # Pasa los valores a float64 y marca los que no son números (textos ya formateados, etc.),
+    # que se resuelven con la función de a un valor. Las columnas numéricas no recorren celdas
+    arreglo = np.asarray(valores)
+    if arreglo.dtype.kind in "fiub":
+        numeros = arreglo.astype("float64")
+        # Como .map, que pasa a la función de a un valor floats e ints de Python (no float32/int64)
+        originales = numeros if arreglo.dtype.kind == "f" else arreglo.astype(object)
+        return originales, numeros, np.zeros(len(arreglo), dtype=bool)
+    arreglo = np.asarray(valores, dtype=object)
+    nulos = np.asarray(pd.isna(arreglo), dtype=bool)
+    numericos = np.fromiter(
+        (isinstance(v, (int, float, np.number)) for v in arreglo), dtype=bool, count=len(arreglo)
+    )
+    numeros = np.full(len(arreglo), np.nan)
+    numeros[numericos & ~nulos] = arreglo[numericos & ~nulos].astype("float64")
+    return arreglo, numeros, ~numericos & ~nulos
+
+
+# "000" a "999": cada grupo de tres dígitos se saca de la tabla en vez de convertir enteros a texto
+_TRIOS = np.array([f"{i:03d}" for i in range(1000)])
+
+
+def _texto_entero(enteros, separador):
+    # Grupos de tres dígitos con ceros a la izquierda unidos con el separador; después se sacan los
+    # ceros y separadores que sobran adelante ("000.001.234" -> "1.234")
+    grupos = max(1, (len(str(int(enteros.max(initial=0)))) + 2) // 3)
+    texto = _TRIOS[enteros % 1000]
+    for _ in range(grupos - 1):
+        enteros = enteros // 1000
+        texto = np.strings.add(np.strings.add(_TRIOS[enteros % 1000], separador), texto)
+    texto = np.strings.lstrip(texto, "0" + separador)
+    return np.where(texto == "", "0", texto)
+
+
+def _componer(enteros, negativos, decimales, miles, prefijo, sufijo):
+    # Textos de enteros no negativos en unidades del último decimal, con operaciones de texto de NumPy
+    parte, fraccion = np.divmod(enteros, 10 ** decimales)
+    texto = _texto_entero(parte, "." if miles else "")
+    if decimales:
+        fracciones = np.array([f"{i:0{decimales}d}" for i in range(10 ** decimales)])
+        texto = np.strings.add(np.strings.add(texto, ","), fracciones[fraccion])
+    texto = np.strings.add(np.where(negativos, prefijo + "-", prefijo), texto)
+    return np.strings.add(texto, sufijo).astype(object)
+
+
+def _formatear(valores, escalar, escala=1, decimales=0, miles=True, prefijo="", sufijo=""):
+    # Dos valores que redondean al mismo entero (en unidades del último decimal) y tienen el mismo
+    # signo dan el mismo texto: se agrupan con pd.factorize y se arma el texto una vez por grupo.
+    # Devuelve un arreglo de objetos con el texto de cada valor
+    arreglo, numeros, otros = _valores(valores)
+    if not len(arreglo):
+        return np.empty(0, dtype=object)
+    with np.errstate(invalid="ignore", over="ignore"):
+        escalados = numeros * escala
+        absolutos = np.abs(escalados) * 10 ** decimales
+        redondeados = np.rint(absolutos)
+        # rint redondea igual que format (mitad al par) salvo cuando multiplicar por 10 ** decimales
+        # dejó el valor pegado a un .5: esos casos, los no finitos y los enormes van de a uno
+        dudosos = (decimales > 0) & (np.abs(absolutos - np.floor(absolutos) - 0.5) <= 4 * np.spacing(absolutos))
+    nulos = np.isnan(escalados) & ~otros
+    a_mano = otros | np.isinf(escalados) | dudosos | (absolutos >= _MAXIMO_EXACTO)
+
+    # Clave de grupo: el doble del entero redondeado más el signo (-0,00 y 0,00 son textos
+    # distintos); los nulos comparten la clave -1 y los que van de a uno la -2
+    claves = np.where(nulos | a_mano, 0, redondeados).astype("int64") * 2 + np.signbit(escalados)
+    claves[nulos] = -1
+    claves[a_mano] = -2
+    codigos, unicos = pd.factorize(claves)
+    textos = _componer(np.maximum(unicos, 0) // 2, unicos % 2 == 1, decimales, miles, prefijo, sufijo)
+    textos[unicos == -1] = ""
+    resultado = textos[codigos]
+    for posicion in np.flatnonzero(a_mano):
+        resultado[posicion] = escalar(arreglo[posicion])
+    return resultado
+
+
+def _por_columna(datos, escalar, **formato):
+    # Series -> Series con el mismo índice; DataFrame -> todas las celdas en una sola pasada
+    # (los valores repetidos entre columnas también se formatean una sola vez)
+    if isinstance(datos, pd.DataFrame):
+        if datos.empty:
+            return datos.copy()
+        texto = _formatear(datos.to_numpy().ravel(order="F"), escalar, **formato)
+        return pd.DataFrame(texto.reshape(datos.shape, order="F"), index=datos.index, columns=datos.columns)
+    return pd.Series(_formatear(datos.to_numpy(), escalar, **formato), index=datos.index, name=datos.name)
+
+
+def formatear_columna_guaranies(datos):
+    return _por_columna(datos, formatear_guaranies, prefijo="₲ ")
+
+
+def formatear_columna_numero(datos):
+    return _por_columna(datos, formatear_numero, decimales=2)
+
+
+def formatear_columna_porcentaje(datos):
+    return _por_columna(datos, formatear_porcentaje, escala=100, decimales=2, miles=False, sufijo="%")
+
+
+def formatear_columna_numeroint(datos):
+    return _por_columna(datos, formatear_numeroint)
+
+
+FORMATOS = {
+    "Guaraníes": (formatear_columna_guaranies, formatear_guaranies),
+    "Número": (formatear_columna_numero, formatear_numero),
+    "Porcentaje": (formatear_columna_porcentaje, formatear_porcentaje),
+    "Entero": (formatear_columna_numeroint, formatear_numeroint),
+}
+
+
+def medir_formatos(serie):
+    # Para cada formato: tiempo de la versión por columna contra .map de la de a un valor,
+    # y si dan el mismo texto
+    resultados = {}
+    for nombre, (por_columna, escalar) in FORMATOS.items():
+        inicio = time.perf_counter()
+        rapido = por_columna(serie)
+        tiempo_rapido = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        original = serie.map(escalar)
+        tiempo_original = time.perf_counter() - inicio
+        iguales = rapido.astype(str).tolist() == original.astype(str).tolist()
+        resultados[nombre] = (tiempo_rapido, tiempo_original, iguales)
+    return resultados
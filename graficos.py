@@ -0,0 +1,122 @@
+import plotly.express as px
+import plotly.graph_objects as go
+
+# Figuras de la app armadas solo a partir de la tabla que grafican y de parámetros simples
+# (títulos, nombres de columnas), para poder reutilizarlas mientras esos datos no cambien
+
+
+def figura_evolucion(ventas_por_mes, columna, titulo):
+    fig = px.line(ventas_por_mes, x="MES", y=columna, title=titulo)
+    fig.update_traces(mode="lines+markers")
+    fig.update_layout(xaxis_title="Mes", yaxis_title="Ventas", hovermode="x unified")
+    fig.update_layout(yaxis_tickprefix="₲ ", yaxis_tickformat=",")
+    return fig
+
+
+def figura_ventas_local(ventas_por_local, columna):
+    # ventas_por_local trae la etiqueta ya formateada en "ventas_format"
+    fig = px.bar(
+        ventas_por_local,
+        x="LOCAL",
+        y=columna,
+        title="Ventas por Sucursal",
+        labels={columna: "Ventas"},
+        text="ventas_format"
+    )
+    fig.update_layout(
+        xaxis_title="Sucursal",
+        yaxis_title="Ventas (₲)",
+        yaxis_tickprefix="₲ ",
+        yaxis_tickformat=",.2s",
+        uniformtext_minsize=8,
+        uniformtext_mode='hide'
+    )
+    fig.update_traces(texttemplate='%{text}', textposition='outside')
+    return fig
+
+
+def figura_barras_comparadas(tabla, actual, comparado, nombre_comparado, titulo):
+    # Barras agrupadas por LOCAL del mes contra otro período; las etiquetas van en las columnas
+    # "<columna>_txt" de la tabla
+    fig = go.Figure(data=[
+        go.Bar(
+            name="Mes actual",
+            x=tabla["LOCAL"],
+            y=tabla[actual],
+            text=tabla[f"{actual}_txt"],
+            textposition="outside",
+            marker_color="rgb(55, 83, 109)",
+            #negrita
+            textfont=dict(size=10, color="white", family="Arial", weight="bold")
+        ),
+        go.Bar(
+            name=nombre_comparado,
+            x=tabla["LOCAL"],
+            y=tabla[comparado],
+            text=tabla[f"{comparado}_txt"],
+            textposition="outside",
+            marker_color="rgb(204, 204, 204)"
+        )
+    ])
+
+    fig.update_layout(
+        barmode="group",
+        title=titulo,
+        xaxis_title="Local",
+        yaxis_title="Ventas (₲)",
+        yaxis_tickprefix="₲ ",
+        yaxis_tickformat=",",
+        hovermode="x unified",
+        uniformtext_minsize=8,
+        uniformtext_mode="hide"
+    )
+    return fig
+
+
+def figura_dispersion(df_disp, agrupador, columna):
+    fig = px.scatter(
+        df_disp,
+        x="UTILIDAD",
+        y="MARGEN_%",  # en %
+        size=columna,
+        text="ETIQUETA",
+        color=columna,
+        size_max=40,
+        hover_name=agrupador,
+        hover_data={
+            "UTILIDAD": False,
+            "MARGEN_%": False,
+            columna: False,
+            "UTILIDAD_TXT": True,
+            "MARGEN_TXT": True,
+            "VENTA_TXT": True,
+        },
+        labels={"UTILIDAD": "Utilidad", "MARGEN_%": "Margen %"}
+    )
+
+    fig.update_traces(
+        textposition="top center",
+        textfont=dict(size=10, color="white"),
+        selector=dict(mode="markers+text")
+    )
+
+    fig.update_layout(
+        xaxis_type="log", # Útil si la utilidad tiene un rango muy amplio
+        xaxis_tickprefix="₲ ",
+        xaxis_tickformat=",", # Separador de miles en el eje X
+        yaxis_tickformat=".2%", # Formato de porcentaje en el eje Y
+        hovermode="closest",
+        # Mejoras visuales adicionales para el gráfico
+        plot_bgcolor='#262730', # Fondo oscuro para el gráfico
+        paper_bgcolor='#262730', # Fondo oscuro para el área del gráfico
+        font_color='white' # Color de fuente general para el gráfico
+    )
+    return fig
+
+
+GRAFICOS = {
+    "evolucion": figura_evolucion,
+    "ventas_local": figura_ventas_local,
+    "barras_comparadas": figura_barras_comparadas,
+    "dispersion": figura_dispersion,
+}
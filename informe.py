@@ -0,0 +1,193 @@
+from functools import partial
+
+from agregaciones import AGRUPADOR_VARIACION, comparar_en_panel, comparar_ventana, con_fila_total, pivotear
+
+# Tablas del informe completo del mes. Son las mismas que arman las secciones, pero con funciones
+# puras sobre el panel, los acumulados y las filas del mes que se piden antes en la página, así se
+# pueden calcular en un hilo aparte
+
+GRUPO_COMPARATIVOS = ["LOCAL", "SECTOR"]
+
+# Comparativos Mensuales y Anuales por local y sector:
+# (hoja, métrica, meses hacia atrás, columnas renombradas, etiqueta de la fila de total)
+TABLAS_COMPARATIVOS = [
+    ("Variación de Ventas", "ventas", 1, {
+        "actual": "ventas_mes_actual", "comparado": "ventas_mes_anterior",
+        "variacion_%": "variacion_%", "diferencia": "diferencia",
+    }, "TOTAL"),
+    ("Comparativo Anual Ventas", "ventas", 12, {
+        "actual": "ventas_actual", "comparado": "ventas_anio_anterior",
+        "variacion_%": "variacion_%", "diferencia": "diferencia",
+    }, "TOTAL"),
+    ("Variación de Margen", "margen", 1, {
+        "actual": "margen_actual", "comparado": "margen_anterior", "diferencia": "diferencia_margen",
+    }, "TOTAL GLOBAL"),
+    ("Comparativo Anual Margen", "margen", 12, {
+        "actual": "margen_actual", "comparado": "margen_anio_anterior", "diferencia": "variacion_margen",
+    }, "TOTAL GLOBAL"),
+    ("Variación de Utilidad", "utilidad", 1, {
+        "actual": "utilidad_actual", "comparado": "utilidad_anterior",
+        "variacion_%": "variacion_%", "diferencia": "diferencia",
+    }, "TOTAL GLOBAL"),
+    ("Comparativo Anual Utilidad", "utilidad", 12, {
+        "actual": "utilidad_actual", "comparado": "utilidad_anio_anterior",
+        "variacion_%": "variacion_%", "diferencia": "diferencia",
+    }, "TOTAL GLOBAL"),
+]
+
+# Comparativo por Tipo de Variación (local, sector, subsector y marca, sin fila de total)
+TABLAS_VARIACION = {
+    "ventas_mensual": ("ventas", 1, {
+        "actual": "ventas_mes_actual", "comparado": "ventas_mes_anterior",
+        "variacion_%": "variacion_%", "diferencia": "diferencia",
+    }),
+    "margen_mensual": ("margen", 1, {
+        "actual": "margen_actual", "comparado": "margen_anterior", "variacion_%": "variacion_%",
+    }),
+    "utilidad_mensual": ("utilidad", 1, {
+        "actual": "utilidad_actual", "comparado": "utilidad_anterior",
+        "variacion_%": "variacion_%", "diferencia": "diferencia",
+    }),
+    "ventas_anual": ("ventas", 12, {
+        "actual": "ventas_actual", "comparado": "ventas_anio_anterior",
+        "variacion_%": "variacion_%", "diferencia": "diferencia",
+    }),
+    "margen_anual": ("margen", 12, {
+        "actual": "margen_actual", "comparado": "margen_anio_anterior", "variacion_%": "variacion_%",
+    }),
+    "utilidad_anual": ("utilidad", 12, {
+        "actual": "utilidad_actual", "comparado": "utilidad_anio_anterior",
+        "variacion_%": "variacion_%", "diferencia": "diferencia",
+    }),
+}
+
+# Métricas de la tabla YTD / T12M, con sus columnas renombradas
+COLUMNAS_VENTANA = [
+    ("ventas", {"actual": "ventas_actual", "comparado": "ventas_anio_anterior", "variacion_%": "variacion_ventas_%"}),
+    ("utilidad", {"actual": "utilidad_actual", "comparado": "utilidad_anio_anterior", "variacion_%": "variacion_utilidad_%"}),
+    ("margen", {"actual": "margen_actual", "comparado": "margen_anio_anterior", "diferencia": "diferencia_margen"}),
+]
+
+COLUMNAS_QUIEBRE = [
+    "LOCAL", "SECTOR", "SUBSECTOR", "MARCA", "DESCRIPCION", "Valor de Vtas:", "Valor de Stock:", "Fec.Ult Compra:"
+]
+COLUMNAS_SOBRE_STOCK = [
+    "LOCAL", "SECTOR", "SUBSECTOR", "MARCA", "Fec.Ult Compra:", "Valor de Vtas:", "Valor de Stock:", "MESES DE STOCK"
+]
+
+
+def tabla_de_comparacion(comparacion, dims, columnas, etiqueta=None):
+    # Detalle de una Comparacion con las columnas renombradas (columnas: {columna de comparar: nombre},
+    # en orden) y la fila de total con los mismos nombres si hay etiqueta
+    tabla = comparacion.detalle.rename(columns=columnas)[[*dims, *columnas.values()]]
+    if etiqueta is None:
+        return tabla
+    total = {nombre: comparacion.total[columna] for columna, nombre in columnas.items()}
+    return con_fila_total(tabla, dims, etiqueta, total)
+
+
+def tabla_de_subtotales(comparacion, dim, columnas):
+    # Los subtotales de una Comparacion (por la primera de sus dimensiones) con las columnas renombradas
+    return comparacion.subtotales.rename(columns=columnas)[[dim, *columnas.values()]]
+
+
+def tabla_de_panel(panel, metrica, periodo, desplazamiento, dims, columnas, etiqueta=None):
+    # Tabla de una métrica contra el mes desplazamiento meses atrás, leída del panel
+    comparacion = comparar_en_panel(panel, metrica, periodo, desplazamiento)
+    return tabla_de_comparacion(comparacion, dims, columnas, etiqueta)
+
+
+def tabla_acumulada(acumulados, periodo, ventana, grupo):
+    # Ventas, utilidad y margen de la ventana (ytd / t12m) contra la del año anterior, con total
+    tabla = None
+    totales = {}
+    for metrica, columnas in COLUMNAS_VENTANA:
+        comparacion = comparar_ventana(acumulados, metrica, periodo, ventana)
+        parte = comparacion.detalle.rename(columns=columnas)[[*grupo, *columnas.values()]]
+        tabla = parte if tabla is None else tabla.merge(parte, on=grupo)
+        totales.update({nombre: comparacion.total[col] for col, nombre in columnas.items()})
+    return con_fila_total(tabla, grupo, "TOTAL GLOBAL", totales)
+
+
+def filtrar_quiebre_total(filas):
+    # Productos vendidos sin stock
+    return filas[(filas["Valor de Stock:"] <= 0) & (filas["Valor de Vtas:"] > 0)]
+
+
+def filtrar_sobre_stock(filas):
+    # Seis meses o más de stock, o stock sin ventas. MESES DE STOCK sale de MESES_DE_STOCK del
+    # dataset preparado; sin ventas queda vacío
+    filas = filas.assign(**{"MESES DE STOCK": filas["MESES_DE_STOCK"].where(filas["Valor de Vtas:"] != 0)})
+    return filas[
+        (filas["MESES DE STOCK"] >= 6) |
+        ((filas["Valor de Vtas:"] == 0) & (filas["Valor de Stock:"] > 0))
+    ]
+
+
+def margen_por_subsector(filas):
+    return filas.groupby(["LOCAL", "SECTOR", "SUBSECTOR", "MARCA"], observed=True)["%:"].mean().reset_index()
+
+
+def margen_maximo(filas):
+    tabla = pivotear(filas, ["SECTOR", "SUBSECTOR", "MARCA"], "LOCAL", "%:", "mean")
+    tabla["Margen Máximo"] = tabla.max(axis=1)
+    return tabla
+
+
+def categorias_que_bajaron(tabla_ventas_mensual, tabla_margen_mensual, tabla_ventas_anual, tabla_margen_anual):
+    # Categorías con menos ventas que el mismo mes del año anterior, con las ventas del mes
+    # anterior y los márgenes de los tres períodos
+    claves = ["LOCAL", "SECTOR", "SUBSECTOR", "MARCA"]
+    categorias = tabla_ventas_anual[tabla_ventas_anual["ventas_actual"] < tabla_ventas_anual["ventas_anio_anterior"]]
+    categorias = categorias.merge(tabla_ventas_mensual[[*claves, "ventas_mes_anterior"]], on=claves, how="left")
+    categorias = categorias.merge(
+        tabla_margen_anual[[*claves, "margen_actual", "margen_anio_anterior"]], on=claves, how="left"
+    )
+    categorias = categorias.merge(tabla_margen_mensual[[*claves, "margen_anterior"]], on=claves, how="left")
+    categorias = categorias.rename(columns={"margen_anterior": "margen_mes_anterior"})
+    return categorias[[
+        *claves,
+        "ventas_actual", "ventas_mes_anterior", "ventas_anio_anterior",
+        "margen_actual", "margen_mes_anterior", "margen_anio_anterior",
+    ]]
+
+
+def _presentes(tabla, columnas):
+    return tabla[[columna for columna in columnas if columna in tabla.columns]]
+
+
+def _categorias(panel, periodo):
+    tablas = {
+        nombre: tabla_de_panel(panel, metrica, periodo, desplazamiento, AGRUPADOR_VARIACION, columnas)
+        for nombre, (metrica, desplazamiento, columnas) in TABLAS_VARIACION.items()
+        if nombre in ("ventas_mensual", "margen_mensual", "ventas_anual", "margen_anual")
+    }
+    return categorias_que_bajaron(
+        tablas["ventas_mensual"], tablas["margen_mensual"], tablas["ventas_anual"], tablas["margen_anual"]
+    )
+
+
+def pasos_informe(periodo, panel_comparativos, panel_variacion, acumulados, filas):
+    # Hojas del informe como (nombre, función que arma la tabla, formato de los valores sin nombre
+    # reconocible). Las tablas se calculan recién al escribir cada hoja, en el hilo que arma el libro
+    pasos = [
+        (hoja, partial(tabla_de_panel, panel_comparativos, metrica, periodo, desplazamiento,
+                       GRUPO_COMPARATIVOS, columnas, etiqueta), None)
+        for hoja, metrica, desplazamiento, columnas, etiqueta in TABLAS_COMPARATIVOS
+    ]
+    pasos += [
+        ("Acumulado YTD", partial(tabla_acumulada, acumulados, periodo, "ytd", GRUPO_COMPARATIVOS), None),
+        ("Acumulado T12M", partial(tabla_acumulada, acumulados, periodo, "t12m", GRUPO_COMPARATIVOS), None),
+        ("Quiebre Total", lambda: _presentes(filtrar_quiebre_total(filas), COLUMNAS_QUIEBRE), None),
+        ("Sobre Stock", lambda: _presentes(filtrar_sobre_stock(filas), COLUMNAS_SOBRE_STOCK), None),
+        ("Margen Máximo", partial(margen_maximo, filas), "porcentaje"),
+        ("Subsectores < 10", lambda: margen_por_subsector(filas).query("`%:` < 0.1"), None),
+    ]
+    pasos += [
+        ("Var. " + nombre.replace("_", " ").capitalize(),
+         partial(tabla_de_panel, panel_variacion, metrica, periodo, desplazamiento, AGRUPADOR_VARIACION, columnas),
+         None)
+        for nombre, (metrica, desplazamiento, columnas) in TABLAS_VARIACION.items()
+    ]
+    pasos.append(("Categorías que bajaron", partial(_categorias, panel_variacion, periodo), None))
+    return pasos
@@ -0,0 +1,129 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# DataFrame ordenado más los rangos de filas de cada mes y de cada (jefe, mes), para que pedir
+# un mes sea tomar un slice y no filtrar todo el df. El dataset preparado y sus particiones por jefe
+# se ordenan por (MES_KEY, FECHA), así la FECHA queda ordenada y un rango de fechas también es un slice.
+# En el df completo un jefe no queda contiguo: rangos_jefe_mes es None y solo se arma en las particiones
+DatasetPreparado = namedtuple("DatasetPreparado", ["df", "rangos_mes", "rangos_jefe_mes"])
+
+COL_VENTA = "Valor de Vtas:"
+COL_COSTO = "Costo de Vtas:"
+COL_STOCK = "Valor de Stock:"
+COL_ULT_COMPRA = "Fec.Ult Compra:"
+
+
+def _dividir(numerador, denominador):
+    # División que deja 0 cuando no hay denominador (en lugar de inf o NaN)
+    return (numerador / denominador).replace([np.inf, -np.inf], np.nan).fillna(0)
+
+
+# Columnas calculadas, en el orden en que se agregan. Cada una es una función vectorizada
+# sobre el df (puede usar las anteriores)
+COLUMNAS_DERIVADAS = {
+    "UTILIDAD": lambda d: d[COL_VENTA] - d[COL_COSTO],
+    "MESES_DE_STOCK": lambda d: _dividir(d[COL_STOCK], d[COL_VENTA]),
+    "DIAS_DE_STOCK": lambda d: _dividir(d[COL_STOCK], d[COL_VENTA] / 30),
+    "QUIEBRE_INMINENTE": lambda d: np.where(
+        (0 < d["DIAS_DE_STOCK"]) & (d["DIAS_DE_STOCK"] < 20), "QUIEBRE INMINENTE", ""
+    ),
+}
+# Columnas de trabajo que no se muestran en las tablas con el detalle de filas
+COLUMNAS_INTERNAS = ["MES_KEY", "UTILIDAD"]
+
+
+def quitar_filas_sin_movimiento(df):
+    # Sacar los que tienen cero (o vacío) en ventas y en stock
+    return df[(df[COL_VENTA].fillna(0) != 0) | (df[COL_STOCK].fillna(0) != 0)]
+
+
+def procesar(df):
+    # Pipeline por versión de datos: filtro de filas sin movimiento, fecha de última compra
+    # como datetime y columnas derivadas, todo vectorizado y una sola vez
+    df = quitar_filas_sin_movimiento(df)
+    if COL_ULT_COMPRA in df.columns and not pd.api.types.is_datetime64_any_dtype(df[COL_ULT_COMPRA]):
+        df = df.assign(**{COL_ULT_COMPRA: pd.to_datetime(df[COL_ULT_COMPRA], errors="coerce")})
+    return df.assign(**COLUMNAS_DERIVADAS)
+
+
+def clave_mes(fechas):
+    # Mes como entero compacto (año * 12 + mes - 1); las fechas vacías quedan en -1
+    fechas = pd.DatetimeIndex(fechas)
+    claves = (fechas.year * 12 + fechas.month - 1).to_numpy(dtype="float64", na_value=np.nan)
+    return np.where(np.isnan(claves), -1, claves).astype("int32")
+
+
+def clave_de_periodo(periodo):
+    return periodo.year * 12 + periodo.month - 1
+
+
+def periodo_de_clave(clave):
+    return pd.Period(year=clave // 12, month=clave % 12 + 1, freq="M")
+
+
+def rangos_contiguos(claves):
+    # Para un arreglo ya ordenado devuelve {clave: (inicio, fin)} de cada bloque de valores iguales
+    if len(claves) == 0:
+        return {}
+    cortes = np.flatnonzero(claves[1:] != claves[:-1]) + 1
+    inicios = np.concatenate(([0], cortes))
+    fines = np.concatenate((cortes, [len(claves)]))
+    return {int(claves[i]): (int(i), int(f)) for i, f in zip(inicios, fines)}
+
+
+def preparar_dataset(df):
+    # Se procesa el df, se calcula MES_KEY una sola vez y se ordena por fecha (las filas sin fecha,
+    # MES_KEY -1, quedan al principio). Los meses quedan contiguos y se indexan
+    df = procesar(df)
+    df = df.assign(MES_KEY=clave_mes(df["FECHA"]))
+    df = df.sort_values(["MES_KEY", "FECHA"], kind="stable").reset_index(drop=True)
+    return DatasetPreparado(df, rangos_contiguos(df["MES_KEY"].to_numpy()), None)
+
+
+def particionar_por_jefe(preparado):
+    # Un DatasetPreparado por JEFE_AREA, armado una sola vez por versión de los datos.
+    # Como el df está ordenado por (MES_KEY, FECHA), cada partición queda ordenada por fecha
+    particiones = {}
+    for jefe, parte in preparado.df.groupby("JEFE_AREA", observed=True, sort=False):
+        parte = parte.reset_index(drop=True)
+        rangos_mes = rangos_contiguos(parte["MES_KEY"].to_numpy())
+        rangos_jefe_mes = {(jefe, mes): rango for mes, rango in rangos_mes.items()}
+        particiones[jefe] = DatasetPreparado(parte, rangos_mes, rangos_jefe_mes)
+    return particiones
+
+
+def particion_vacia(preparado):
+    return DatasetPreparado(preparado.df.iloc[0:0], {}, {})
+
+
+def filas_mes(preparado, periodo, jefe=None):
+    # Slice de las filas de un mes (y opcionalmente de un jefe): costo O(1), sin máscaras.
+    # Por jefe solo donde hay rangos por (jefe, mes): particiones por jefe o cubo
+    clave = clave_de_periodo(periodo)
+    if jefe is None:
+        inicio, fin = preparado.rangos_mes.get(clave, (0, 0))
+    elif preparado.rangos_jefe_mes is None:
+        raise ValueError("El dataset no está indexado por jefe: usar su partición por jefe")
+    else:
+        inicio, fin = preparado.rangos_jefe_mes.get((jefe, clave), (0, 0))
+    return preparado.df.iloc[inicio:fin]
+
+
+def filas_rango(preparado, inicio, fin):
+    # Filas con FECHA en [inicio, fin] por búsqueda binaria sobre la FECHA ordenada: un slice
+    # (sin copiar) en O(log n). Las filas sin fecha están al principio y se saltean
+    fechas = preparado.df["FECHA"].to_numpy()
+    sin_fecha = preparado.rangos_mes.get(-1, (0, 0))[1]
+    fechas = fechas[sin_fecha:]
+    desde = sin_fecha + np.searchsorted(fechas, pd.Timestamp(inicio).to_datetime64(), side="left")
+    hasta = sin_fecha + np.searchsorted(fechas, pd.Timestamp(fin).to_datetime64(), side="right")
+    return preparado.df.iloc[desde:hasta]
+
+
+def meses_disponibles(preparado, desde=None):
+    meses = [periodo_de_clave(clave) for clave in sorted(preparado.rangos_mes) if clave >= 0]
+    if desde is not None:
+        meses = [m for m in meses if m >= desde]
+    return meses
@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Los módulos de la app están en la raíz del repo, sin paquete
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import carga_datos  # noqa: E402
+
+LOCALES = ["CENTRO", "NORTE", "SUR"]
+SECTORES = {"ALMACEN": ["ACEITES", "FIDEOS"], "BEBIDAS": ["AGUAS", "GASEOSAS"], "LIMPIEZA": ["JABONES"]}
+MARCAS = ["ACME", "DELTA", "OMEGA"]
+JEFES = ["ANA", "LUIS"]
+
+
+def _filas_de_prueba(meses, filas_por_mes=40, semilla=0):
+    # Filas con las columnas del informe, ordenadas por FECHA (como llega el Excel de Dropbox)
+    rng = np.random.default_rng(semilla)
+    partes = []
+    for periodo in pd.period_range("2023-01", periods=meses, freq="M"):
+        dias = rng.integers(0, periodo.days_in_month, filas_por_mes)
+        sectores = rng.choice(list(SECTORES), filas_por_mes)
+        ventas = np.round(rng.uniform(0, 5_000_000, filas_por_mes))
+        ventas[rng.random(filas_por_mes) < 0.1] = 0
+        partes.append(pd.DataFrame({
+            "FECHA": periodo.start_time + pd.to_timedelta(np.sort(dias), unit="D"),
+            "JEFE_AREA": rng.choice(JEFES, filas_por_mes),
+            "LOCAL": rng.choice(LOCALES, filas_por_mes),
+            "SECTOR": sectores,
+            "SUBSECTOR": [rng.choice(SECTORES[sector]) for sector in sectores],
+            "MARCA": rng.choice(MARCAS, filas_por_mes),
+            "DESCRIPCION": [f"ARTICULO {n}" for n in rng.integers(0, 60, filas_por_mes)],
+            "Valor de Vtas:": ventas,
+            "Costo de Vtas:": np.round(ventas * rng.uniform(0.6, 0.95, filas_por_mes)),
+            "Valor de Stock:": np.round(rng.uniform(0, 2_000_000, filas_por_mes)),
+            "%:": np.round(rng.uniform(-0.1, 0.4, filas_por_mes), 4),
+        }))
+    return pd.concat(partes, ignore_index=True)
+
+
+@pytest.fixture
+def filas():
+    # 15 meses: alcanza para comparar el acumulado del año y los últimos 12 meses contra el año anterior
+    return _filas_de_prueba(15)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # Cada test con su propia carpeta de snapshots, almacén por mes y descargas
+    monkeypatch.setattr(carga_datos, "CACHE_DIR", tmp_path / "cache")
+    return tmp_path / "cache"
+
+
+@pytest.fixture
+def escribir_libro(tmp_path):
+    def escribir(df, nombre="informe.xlsx"):
+        ruta = tmp_path / nombre
+        df.to_excel(ruta, index=False)
+        return ruta
+    return escribir
@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import carga_datos
+from agregaciones import acumulados_mensuales, comparar_ventana, construir_cubo, pivotear, ventana_de
+from carga_datos import (
+    cargar_dataset, leer_excel_incremental, leer_excel_streaming, normalizar_tipos, obtener_ultima_ingesta,
+)
+from formatos import FORMATOS
+from preparacion import COL_VENTA, preparar_dataset
+
+URL = "https://dropbox.test/informe.xlsx"
+
+
+class _Respuesta:
+    def __init__(self, status_code, contenido=b"", headers=None):
+        self.status_code = status_code
+        self.contenido = contenido
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise carga_datos.requests.HTTPError(self.status_code)
+
+    def iter_content(self, chunk_size):
+        for inicio in range(0, len(self.contenido), chunk_size):
+            yield self.contenido[inicio:inicio + chunk_size]
+
+
+class _ServidorFalso:
+    # Hace de requests.Session: sirve un archivo con ETag y Last-Modified y responde 304 a las
+    # descargas condicionales que coinciden
+    def __init__(self, contenido, etag='"v1"', ultima_modificacion="Mon, 02 Oct 2023 10:00:00 GMT"):
+        self.contenido, self.etag, self.ultima_modificacion = contenido, etag, ultima_modificacion
+        self.pedidos = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        headers = headers or {}
+        self.pedidos.append(headers)
+        validadores = [("If-None-Match", self.etag), ("If-Modified-Since", self.ultima_modificacion)]
+        if any(valor and headers.get(encabezado) == valor for encabezado, valor in validadores):
+            return _Respuesta(304)
+        encabezados = {"ETag": self.etag, "Last-Modified": self.ultima_modificacion}
+        return _Respuesta(200, self.contenido, {k: v for k, v in encabezados.items() if v})
+
+
+@pytest.fixture
+def servidor(monkeypatch):
+    def servir(ruta_xlsx, **kwargs):
+        servidor = _ServidorFalso(ruta_xlsx.read_bytes(), **kwargs)
+        monkeypatch.setattr(carga_datos, "_sesion", servidor)
+        return servidor
+    return servir
+
+
+def _normalizado(ruta_xlsx):
+    return normalizar_tipos(leer_excel_streaming(ruta_xlsx))[0]
+
+
+def test_snapshot_conserva_valores_y_tipos(cache, filas, escribir_libro, servidor):
+    servidor(escribir_libro(filas))
+    parseado, version = cargar_dataset(URL, modo="streaming")
+    assert obtener_ultima_ingesta()["modo"] == "streaming"
+
+    del_snapshot, version_snapshot = cargar_dataset(URL, modo="streaming")
+    assert obtener_ultima_ingesta()["modo"] == "snapshot"
+    assert version_snapshot == version
+    pd.testing.assert_frame_equal(del_snapshot, parseado)
+    assert isinstance(del_snapshot["LOCAL"].dtype, pd.CategoricalDtype)
+
+
+@pytest.mark.parametrize("validador", [
+    {},
+    {"etag": None},
+])
+def test_304_reutiliza_la_copia_local(cache, filas, escribir_libro, servidor, validador):
+    # Con ETag o solo con Last-Modified, la segunda descarga es condicional y no baja el archivo
+    falso = servidor(escribir_libro(filas), **validador)
+    primero, version = cargar_dataset(URL, modo="streaming")
+    ruta_xlsx, _ = carga_datos._rutas_descarga(URL)
+    modificado = ruta_xlsx.stat().st_mtime_ns
+
+    segundo, version_304 = cargar_dataset(URL, modo="streaming")
+    assert "If-None-Match" in falso.pedidos[-1] or "If-Modified-Since" in falso.pedidos[-1]
+    assert version_304 == version
+    assert ruta_xlsx.stat().st_mtime_ns == modificado
+    pd.testing.assert_frame_equal(segundo, primero)
+
+
+def test_incremental_igual_a_streaming(cache, filas, escribir_libro):
+    previo = escribir_libro(filas[filas["FECHA"] < "2024-03-01"], "previo.xlsx")
+    leer_excel_incremental(previo, "previo")
+    assert obtener_ultima_ingesta()["meses_reingestados"] == 14
+
+    # Un mes nuevo al final: se vuelven a leer el último mes guardado y el nuevo
+    actual = escribir_libro(filas, "actual.xlsx")
+    df = leer_excel_incremental(actual, "actual")
+    ingesta = obtener_ultima_ingesta()
+    assert (ingesta["meses_reingestados"], ingesta["meses_totales"]) == (2, 15)
+    assert ingesta["memoria_antes"] > ingesta["memoria_despues"] > 0
+    pd.testing.assert_frame_equal(df, _normalizado(actual))
+
+    # Mismo archivo: todo sale del almacén
+    pd.testing.assert_frame_equal(leer_excel_incremental(actual, "actual"), df)
+    assert obtener_ultima_ingesta()["meses_reingestados"] == 0
+
+
+def test_incremental_relee_solo_los_meses_modificados(cache, filas, escribir_libro):
+    leer_excel_incremental(escribir_libro(filas, "actual.xlsx"), "actual")
+
+    # Un importe corregido en un mes del medio: ese mes y el último (que siempre se relee)
+    corregido = filas.copy()
+    corregido.loc[corregido["FECHA"].dt.month.eq(5).idxmax(), COL_VENTA] = 1234567.0
+    ruta = escribir_libro(corregido, "corregido.xlsx")
+    df = leer_excel_incremental(ruta, "corregido")
+    assert obtener_ultima_ingesta()["meses_reingestados"] == 2
+    pd.testing.assert_frame_equal(df, _normalizado(ruta))
+
+
+def test_incremental_sin_agrupar_por_mes_devuelve_none(cache, filas, escribir_libro):
+    desordenado = pd.concat([filas, filas.iloc[:5]], ignore_index=True)
+    assert leer_excel_incremental(escribir_libro(desordenado), "desordenado") is None
+
+
+@pytest.mark.parametrize("ventana", ["ytd", "t12m"])
+@pytest.mark.parametrize("metrica", ["ventas", "utilidad"])
+def test_comparar_ventana_igual_a_sumar_las_filas(filas, ventana, metrica):
+    preparado = preparar_dataset(normalizar_tipos(filas)[0])
+    dims = ["LOCAL", "SECTOR"]
+    periodo = pd.Period("2024-03", freq="M")
+    comparacion = comparar_ventana(acumulados_mensuales(construir_cubo(preparado), dims), metrica, periodo, ventana)
+
+    desde, hasta = ventana_de(periodo, ventana)
+    df = preparado.df
+    valor = df[COL_VENTA] if metrica == "ventas" else df["UTILIDAD"]
+
+    def sumar(corrimiento):
+        en_ventana = df["MES_KEY"].between(desde - corrimiento, hasta - corrimiento)
+        return valor[en_ventana].groupby([df.loc[en_ventana, dim] for dim in dims], observed=True).sum()
+
+    esperado = pd.concat({"actual": sumar(0), "comparado": sumar(12)}, axis=1).fillna(0).reset_index()
+    obtenido = comparacion.detalle.astype({dim: str for dim in dims})
+    esperado = esperado.astype({dim: str for dim in dims})
+    combinado = esperado.merge(obtenido, on=dims, suffixes=("_esperado", ""), validate="one_to_one")
+    assert len(combinado) == len(esperado) == len(obtenido)
+    np.testing.assert_allclose(combinado["actual"], combinado["actual_esperado"])
+    np.testing.assert_allclose(combinado["comparado"], combinado["comparado_esperado"])
+    assert comparacion.total["actual"] == pytest.approx(combinado["actual_esperado"].sum())
+
+
+@pytest.mark.parametrize("agregacion", ["sum", "mean"])
+def test_pivotear_igual_a_pivot_table(filas, agregacion):
+    datos = normalizar_tipos(filas)[0]
+    datos.loc[datos.index[::7], "%:"] = np.nan
+    indice = ["SECTOR", "SUBSECTOR", "MARCA"]
+    obtenido = pivotear(datos, indice, "LOCAL", "%:", agregacion)
+    esperado = pd.pivot_table(datos, index=indice, columns="LOCAL", values="%:", aggfunc=agregacion, observed=True)
+    # pivotear deja las etiquetas como valores simples; pivot_table, como categóricas
+    esperado.index = pd.MultiIndex.from_tuples(esperado.index.tolist(), names=indice)
+    esperado.columns = pd.Index(esperado.columns.tolist(), name="LOCAL")
+    pd.testing.assert_frame_equal(obtenido, esperado, check_index_type=False, check_column_type=False)
+
+
+@pytest.mark.parametrize("nombre", list(FORMATOS))
+def test_formatos_por_columna_igual_a_map(nombre):
+    por_columna, escalar = FORMATOS[nombre]
+    rng = np.random.default_rng(1)
+    valores = pd.Series(np.concatenate([
+        rng.normal(0, 1e6, 500), rng.normal(0, 1, 500), np.round(rng.normal(0, 100, 500), 2),
+        [0.0, -0.0, -0.001, 0.005, 0.015, 0.125, 2.675, 1e17, -1e20, np.inf, -np.inf, np.nan, 0.5, 1.5, 2.5],
+    ]))
+    assert por_columna(valores).tolist() == valores.map(escalar).tolist()
+
+    mezclados = pd.Series([1, "ya formateado", np.nan, 2.5, -3], dtype=object)
+    assert por_columna(mezclados).tolist() == mezclados.map(escalar).tolist()
+
+    tabla = pd.DataFrame({"a": valores[:50].to_numpy(), "b": valores[50:100].to_numpy()})
+    assert por_columna(tabla).to_numpy().tolist() == tabla.map(escalar).to_numpy().tolist()